@@ -0,0 +1,74 @@
+"""Agregados por libro mantenidos de forma incremental.
+
+``libro_stats`` guarda, por libro, el número de préstamos y la suma, cantidad,
+promedio e histograma (1 a 5 estrellas) de sus calificaciones. Las rutas que
+insertan préstamos o reseñas actualizan la fila en la misma transacción, así
+el dashboard y el detalle del libro leen un índice en vez de agrupar
+``prestamo`` y ``reseña`` completos.
+"""
+
+
+def recalcular(conn, prestamos='prestamo'):
+    """Reconstruye ``libro_stats`` desde cero (backfill de una sola pasada). No hace commit.
+
+    ``prestamos`` es la tabla (o subconsulta) de préstamos a contar, p. ej.
+    ``historico.fuente(conn)`` para incluir los archivados.
+    """
+    conn.execute('DELETE FROM libro_stats')
+    conn.execute(f"""
+        INSERT INTO libro_stats (libro_id, total_prestamos, suma_calificaciones, num_calificaciones,
+                                 promedio, estrellas_1, estrellas_2, estrellas_3, estrellas_4, estrellas_5)
+        SELECT l.id, COALESCE(p.total, 0), COALESCE(r.suma, 0), COALESCE(r.num, 0), r.promedio,
+               COALESCE(r.e1, 0), COALESCE(r.e2, 0), COALESCE(r.e3, 0), COALESCE(r.e4, 0), COALESCE(r.e5, 0)
+        FROM libro l
+        LEFT JOIN (SELECT libro_id, COUNT(*) AS total FROM {prestamos} GROUP BY libro_id) p
+               ON p.libro_id = l.id
+        LEFT JOIN (SELECT libro_id, SUM(calificacion) AS suma, COUNT(*) AS num,
+                          AVG(calificacion) AS promedio,
+                          SUM(calificacion = 1) AS e1, SUM(calificacion = 2) AS e2,
+                          SUM(calificacion = 3) AS e3, SUM(calificacion = 4) AS e4,
+                          SUM(calificacion = 5) AS e5
+                   FROM reseña GROUP BY libro_id) r
+               ON r.libro_id = l.id
+    """)
+
+
+def quitar(conn, libro_id):
+    """Borra los agregados de un libro eliminado. No hace commit."""
+    conn.execute('DELETE FROM libro_stats WHERE libro_id = ?', (libro_id,))
+
+
+def registrar_prestamo(conn, libro_id):
+    """Suma un préstamo al libro. No hace commit: va en la transacción del llamador."""
+    conn.execute("""
+        INSERT INTO libro_stats (libro_id, total_prestamos) VALUES (?, 1)
+        ON CONFLICT(libro_id) DO UPDATE SET total_prestamos = total_prestamos + 1
+    """, (libro_id,))
+
+
+def registrar_prestamos(conn, conteos):
+    """Suma ``{libro_id: cantidad}`` préstamos de un lote. No hace commit."""
+    conn.executemany("""
+        INSERT INTO libro_stats (libro_id, total_prestamos) VALUES (?, ?)
+        ON CONFLICT(libro_id) DO UPDATE SET total_prestamos = total_prestamos + excluded.total_prestamos
+    """, sorted(conteos.items()))
+
+
+def registrar_reseña(conn, libro_id, calificacion):
+    """Suma una calificación (1-5) al libro. No hace commit."""
+    estrellas = [int(calificacion == n) for n in range(1, 6)]
+    conn.execute("""
+        INSERT INTO libro_stats (libro_id, suma_calificaciones, num_calificaciones, promedio,
+                                 estrellas_1, estrellas_2, estrellas_3, estrellas_4, estrellas_5)
+        VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(libro_id) DO UPDATE SET
+            suma_calificaciones = suma_calificaciones + excluded.suma_calificaciones,
+            num_calificaciones = num_calificaciones + 1,
+            promedio = CAST(suma_calificaciones + excluded.suma_calificaciones AS REAL)
+                       / (num_calificaciones + 1),
+            estrellas_1 = estrellas_1 + excluded.estrellas_1,
+            estrellas_2 = estrellas_2 + excluded.estrellas_2,
+            estrellas_3 = estrellas_3 + excluded.estrellas_3,
+            estrellas_4 = estrellas_4 + excluded.estrellas_4,
+            estrellas_5 = estrellas_5 + excluded.estrellas_5
+    """, (libro_id, calificacion, float(calificacion), *estrellas))
@@ -0,0 +1,275 @@
+"""Almacenamiento de archivos subidos direccionado por contenido.
+
+Cada archivo se guarda una sola vez en la carpeta de subidas con el nombre
+``<sha256>.<ext>``. La tabla ``archivo`` lleva un contador de referencias
+(portadas de libros, documentos y portadas de la biblioteca virtual); cuando
+llega a cero el archivo se borra. Volver a subir la misma portada o el mismo
+PDF no crea otra copia.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import time
+from datetime import datetime
+
+TAMANO_BLOQUE = 64 * 1024
+
+# nombres ya direccionados por contenido: 64 hex + extensión
+PATRON_BLOB = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
+
+# temporales de subidas interrumpidas (ver guardar y subidas.py)
+PREFIJOS_TEMPORALES = ('.subida-', '.parcial-')
+
+CATEGORIAS = ('referenciados', 'huerfanos', 'recientes', 'temporales')
+
+# columnas que guardan nombres de archivos subidos
+REFERENCIAS = (
+    ('libro', 'portada_filename'),
+    ('biblioteca_virtual', 'filename'),
+    ('biblioteca_virtual', 'cover_filename'),
+)
+
+
+def es_blob(filename):
+    return bool(filename and PATRON_BLOB.match(filename))
+
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[1].lower()
+
+
+def _hash_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _registrar(conn, digest, filename, size, referencias=1):
+    """Suma referencias al blob (lo da de alta si es nuevo). No hace commit."""
+    conn.execute("""
+        INSERT INTO archivo (hash, filename, bytes, referencias, fecha_subida) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(hash) DO UPDATE SET referencias = referencias + excluded.referencias
+    """, (digest, filename, size, referencias, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    return conn.execute('SELECT filename FROM archivo WHERE hash = ?', (digest,)).fetchone()[0]
+
+
+def guardar(conn, directorio, file):
+    """Guarda un ``FileStorage`` por bloques calculando su SHA-256.
+
+    El contenido se escribe en un temporal dentro de ``directorio`` y se
+    renombra a ``<sha256>.<ext>``; si ese blob ya existía el temporal se
+    descarta. Devuelve el nombre del blob. No hace commit: la referencia se
+    confirma junto con la fila que la usa.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    h = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=directorio, prefix='.subida-')
+    try:
+        with os.fdopen(fd, 'wb') as destino:
+            for bloque in iter(lambda: file.stream.read(TAMANO_BLOQUE), b''):
+                h.update(bloque)
+                destino.write(bloque)
+                size += len(bloque)
+        return _colocar(conn, directorio, tmp, h.hexdigest(), _extension(file.filename), size)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _colocar(conn, directorio, tmp, digest, extension, size):
+    """Renombra ``tmp`` a su blob (o lo descarta si ya existe) y suma la referencia."""
+    filename = f'{digest}.{extension}'
+    existente = conn.execute('SELECT filename FROM archivo WHERE hash = ?', (digest,)).fetchone()
+    if existente and os.path.exists(os.path.join(directorio, existente[0])):
+        os.remove(tmp)
+        # reciente otra vez: recolectar no lo toca durante el periodo de gracia
+        os.utime(os.path.join(directorio, existente[0]))
+    else:
+        os.replace(tmp, os.path.join(directorio, existente[0] if existente else filename))
+    return _registrar(conn, digest, filename, size)
+
+
+def adoptar(conn, directorio, ruta, nombre_original):
+    """Como ``guardar``, pero para un archivo ya escrito en ``directorio`` (p. ej. una subida por bloques).
+
+    El archivo se mueve (o se descarta si el contenido ya estaba). No hace commit.
+    """
+    try:
+        return _colocar(conn, directorio, ruta, _hash_archivo(ruta), _extension(nombre_original),
+                        os.path.getsize(ruta))
+    except BaseException:
+        if os.path.exists(ruta):
+            os.remove(ruta)
+        raise
+
+
+def referenciar(conn, filename):
+    """Suma una referencia a un blob ya guardado. No hace commit."""
+    conn.execute('UPDATE archivo SET referencias = referencias + 1 WHERE filename = ?', (filename,))
+
+
+def liberar(conn, filename):
+    """Resta una referencia al blob. No hace commit.
+
+    Devuelve el nombre del archivo si quedó sin referencias (el llamador lo
+    borra con ``borrar`` después del commit), o None.
+    """
+    if not filename:
+        return None
+    fila = conn.execute('SELECT hash, referencias FROM archivo WHERE filename = ?', (filename,)).fetchone()
+    if fila is None:
+        return None
+    if fila[1] > 1:
+        conn.execute('UPDATE archivo SET referencias = referencias - 1 WHERE hash = ?', (fila[0],))
+        return None
+    conn.execute('DELETE FROM archivo WHERE hash = ?', (fila[0],))
+    return filename
+
+
+def borrar(directorio, *filenames):
+    for filename in filenames:
+        if not filename:
+            continue
+        try:
+            os.remove(os.path.join(directorio, filename))
+        except FileNotFoundError:
+            pass
+
+
+def _referenciados(conn):
+    nombres = set()
+    for tabla, columna in REFERENCIAS:
+        nombres.update(r[0] for r in conn.execute(
+            f'SELECT DISTINCT {columna} FROM {tabla} WHERE {columna} IS NOT NULL'))
+    return nombres
+
+
+def recolectar(conn, directorios, gracia_segundos=24 * 3600, simular=False, conservar=(), ahora=None,
+               muestras=20):
+    """Concilia las carpetas de archivos con las columnas de ``REFERENCIAS``.
+
+    ``directorios`` es ``{etiqueta: ruta}`` (p. ej. subidas y
+    ``static/images``). Cada carpeta se recorre una vez con ``os.scandir``
+    y cada archivo cae en una categoría:
+
+    - ``referenciados``: su nombre aparece en la base o en ``conservar``.
+    - ``huerfanos``: sin referencia y modificado hace más de la gracia.
+    - ``recientes``: sin referencia pero dentro de la gracia (puede ser de
+      un formulario en curso); no se toca.
+    - ``temporales``: restos de subidas interrumpidas, más viejos que la gracia.
+
+    Salvo con ``simular``, borra huérfanos y temporales y sus filas de
+    ``archivo``. Conviene llamarla dentro de una transacción de escritura
+    (BEGIN IMMEDIATE) para que ninguna referencia nueva se confirme a mitad
+    del recorrido; no hace commit.
+
+    Devuelve bytes y cantidad por carpeta y categoría, lo borrado (o lo que
+    se borraría, con ``simular``), hasta
+    ``muestras`` nombres de ejemplo y los nombres referenciados que no
+    están en ninguna carpeta (``faltantes``).
+    """
+    ahora = time.time() if ahora is None else ahora
+    referenciados = _referenciados(conn)
+    protegidos = referenciados | set(conservar)
+    vistos = set()
+    resumen = {'directorios': {}, 'eliminados': 0, 'bytes_liberados': 0, 'muestras': [],
+               'simulado': simular}
+    for etiqueta, carpeta in directorios.items():
+        totales = {c: {'archivos': 0, 'bytes': 0} for c in CATEGORIAS}
+        resumen['directorios'][etiqueta] = totales
+        if not os.path.isdir(carpeta):
+            continue
+        with os.scandir(carpeta) as entradas:
+            for entrada in entradas:
+                if not entrada.is_file(follow_symlinks=False):
+                    continue
+                nombre = entrada.name
+                temporal = nombre.startswith(PREFIJOS_TEMPORALES)
+                if nombre.startswith('.') and not temporal:
+                    continue
+                info = entrada.stat(follow_symlinks=False)
+                if nombre in protegidos:
+                    categoria = 'referenciados'
+                    vistos.add(nombre)
+                elif ahora - info.st_mtime < gracia_segundos:
+                    categoria = 'recientes'
+                else:
+                    categoria = 'temporales' if temporal else 'huerfanos'
+                totales[categoria]['archivos'] += 1
+                totales[categoria]['bytes'] += info.st_size
+                if categoria in ('huerfanos', 'temporales'):
+                    if len(resumen['muestras']) < muestras:
+                        resumen['muestras'].append({'directorio': etiqueta, 'nombre': nombre,
+                                                    'bytes': info.st_size, 'categoria': categoria})
+                    if not simular:
+                        try:
+                            os.remove(entrada.path)
+                        except FileNotFoundError:
+                            continue
+                        if not temporal:
+                            conn.execute('DELETE FROM archivo WHERE filename = ?', (nombre,))
+                    resumen['eliminados'] += 1
+                    resumen['bytes_liberados'] += info.st_size
+    resumen['faltantes'] = sorted(referenciados - vistos)
+    return resumen
+
+
+def deduplicar(conn, directorio, directorios_copia=()):
+    """Migra las subidas existentes al almacenamiento por contenido.
+
+    - Cada archivo referenciado en la base se renombra a ``<sha256>.<ext>``
+      (o se elimina si ese contenido ya estaba guardado) y se actualizan sus
+      referencias.
+    - Los archivos sin referencia cuyo contenido ya existe como blob se
+      eliminan; los demás se dejan en su lugar.
+    - En ``directorios_copia`` (p. ej. ``static/images``) se eliminan las
+      copias de contenido ya guardado.
+
+    Hace commit al final. Devuelve un resumen con los contadores.
+    """
+    resumen = {'migrados': 0, 'duplicados_eliminados': 0, 'bytes_liberados': 0}
+
+    referenciados = _referenciados(conn)
+
+    def eliminar_duplicado(ruta):
+        resumen['bytes_liberados'] += os.path.getsize(ruta)
+        resumen['duplicados_eliminados'] += 1
+        os.remove(ruta)
+
+    for nombre in sorted(referenciados):
+        ruta = os.path.join(directorio, nombre)
+        if es_blob(nombre) or '.' not in nombre or not os.path.isfile(ruta):
+            continue
+        digest = _hash_archivo(ruta)
+        existente = conn.execute('SELECT filename FROM archivo WHERE hash = ?', (digest,)).fetchone()
+        destino = existente[0] if existente else f'{digest}.{_extension(nombre)}'
+        if os.path.exists(os.path.join(directorio, destino)):
+            eliminar_duplicado(ruta)
+        else:
+            os.replace(ruta, os.path.join(directorio, destino))
+        usos = 0
+        for tabla, columna in REFERENCIAS:
+            usos += conn.execute(f'UPDATE {tabla} SET {columna} = ? WHERE {columna} = ?',
+                                 (destino, nombre)).rowcount
+        _registrar(conn, digest, destino, os.path.getsize(os.path.join(directorio, destino)), usos)
+        resumen['migrados'] += 1
+    conn.commit()
+
+    guardados = {r[0] for r in conn.execute('SELECT hash FROM archivo')}
+    for carpeta, solo_no_blobs in [(directorio, True)] + [(d, False) for d in directorios_copia]:
+        if not os.path.isdir(carpeta):
+            continue
+        with os.scandir(carpeta) as entradas:
+            for entrada in entradas:
+                if not entrada.is_file() or entrada.name.startswith('.'):
+                    continue
+                if solo_no_blobs and (es_blob(entrada.name) or entrada.name in referenciados):
+                    continue
+                if _hash_archivo(entrada.path) in guardados:
+                    eliminar_duplicado(entrada.path)
+    return resumen
@@ -1,26 +1,116 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_from_directory, jsonify
+from flask import Flask, render_template, stream_template, Response, request, redirect, url_for, session, flash, send_from_directory, jsonify, abort
+from werkzeug.security import safe_join
 import sqlite3
+import click
 from datetime import datetime, timedelta
+import hmac
+import io
+import mimetypes
 import os
+import re
 import time
-from werkzeug.utils import secure_filename
-import shutil
+
+import agregados
+import autocompletar
+import almacenamiento
+import busqueda
+import cache_respuestas
+import catalogo
+import circulacion
+import db
+import estaticos
+import estadisticas
+import facetas
+import historico
+import importacion
+import metricas
+import migraciones
+import reportes
+import subidas
+import versiones
 
 app = Flask(__name__)
-app.secret_key = 'ENSDB123'
+app.config['SECRET_KEY'] = 'ENSDB123'
 
-DATABASE = 'biblioteca.db'
-# NEW: usar ruta absoluta dentro del paquete 'biblioteca'
-BASE_DIR = os.path.dirname(__file__)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# la base junto a la carpeta del paquete, no relativa al directorio de trabajo
+DATABASE = os.path.join(os.path.dirname(BASE_DIR), 'biblioteca.db')
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['DATABASE'] = DATABASE
+app.config['DB_POOL_SIZE'] = 8
+# conexiones que cada worker abre al arrancar (ver calentar())
+app.config['DB_POOL_WARM'] = 1
+# descarga de /uploads: None (la sirve Flask), 'x-sendfile' (Apache/lighttpd)
+# o 'x-accel-redirect' (nginx, con una location interna en UPLOADS_ACCEL_PREFIX)
+app.config['UPLOADS_OFFLOAD'] = None
+app.config['UPLOADS_ACCEL_PREFIX'] = '/_uploads/'
+# los nombres de las subidas cambian si cambia el contenido: se cachean un año
+app.config['UPLOADS_MAX_AGE'] = 365 * 24 * 3600
+# los archivos sin referencia más nuevos que esto no se borran (pueden ser de un formulario en curso)
+app.config['UPLOADS_GC_GRACE_HOURS'] = 24
+# subidas por bloques de la biblioteca virtual (ver subidas.py): tamaño máximo del archivo y de cada bloque
+app.config['UPLOAD_MAX_BYTES'] = 1024 * 1024 * 1024
+app.config['UPLOAD_CHUNK_BYTES'] = 8 * 1024 * 1024
+# préstamos devueltos hace más de ARCHIVE_AFTER_DAYS se mueven a esta base (flask archivar-prestamos);
+# None desactiva el archivo
+app.config['ARCHIVE_DATABASE'] = None
+app.config['ARCHIVE_AFTER_DAYS'] = 365
+# copia de solo lectura para estadísticas e historial (flask actualizar-reportes); None: leen la base principal
+app.config['REPORT_SNAPSHOT'] = None
+# caché de páginas renderizadas (dashboard, biblioteca virtual, detalle de libro)
+app.config['RESPONSE_CACHE_ENABLED'] = True
+app.config['RESPONSE_CACHE_SIZE'] = 256
+app.config['RESPONSE_CACHE_TTL'] = 60
+# /metrics: solo admin, o con "Authorization: Bearer <METRICS_TOKEN>" para el recolector
+app.config['METRICS_TOKEN'] = None
+# sentencias más lentas que esto (ms) van al log 'biblioteca.sql_lento'; None lo desactiva
+app.config['SLOW_QUERY_MS'] = 200
+app.config['SLOW_QUERY_LOG'] = None
+# estáticos con huella y precomprimidos (flask construir-estaticos); sin manifiesto se sirven tal cual
+app.config['STATIC_FINGERPRINT'] = True
+app.config['STATIC_BUILD_FOLDER'] = os.path.join(BASE_DIR, 'static_build')
+
+# cualquier valor anterior se puede cambiar con una variable de entorno BIBLIOTECA_<CLAVE>,
+# p. ej. BIBLIOTECA_DATABASE=/srv/biblioteca/biblioteca.db o BIBLIOTECA_DB_POOL_SIZE=16
+app.config.from_prefixed_env('BIBLIOTECA')
+db.init_app(app)
+cache_respuestas.init_app(app)
+metricas.init_app(app)
+estaticos.init_app(app)
+reportes.init_app(app)
 
 ALLOWED_EXT = {'png', 'jpg', 'jpeg', 'gif', 'pdf'}
 
+# días que faltan para el vencimiento de un préstamo (negativo si está vencido)
+SQL_DIAS_RESTANTES = "CAST(julianday(p.fecha_vencimiento) - julianday(date('now', 'localtime')) AS INTEGER)"
+
+# tamaños de página permitidos en los listados paginados del admin
+TAMANOS_PAGINA = (25, 50, 100, 200)
+app.jinja_env.globals['tamanos_pagina'] = TAMANOS_PAGINA
+
+# entradas aceptadas en una devolución o préstamo por lote
+LOTE_MAXIMO = 1000
+
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    # conexión del pool, ligada al contexto de la app; se devuelve en el teardown
+    return db.get_connection()
+
+def leer_tamano_pagina():
+    por_pagina = request.args.get('por_pagina', type=int)
+    return por_pagina if por_pagina in TAMANOS_PAGINA else TAMANOS_PAGINA[1]
+
+def cortar_pagina(filas, por_pagina, cursor, filtros):
+    """Recorta la fila extra pedida con LIMIT por_pagina + 1.
+
+    Devuelve (filas, siguiente): ``siguiente`` son los argumentos de
+    ``url_for`` para la próxima página (filtros, tamaño y el cursor que
+    ``cursor`` construye con la última fila), o None si no hay más.
+    """
+    if len(filas) <= por_pagina:
+        return filas, None
+    filas = filas[:por_pagina]
+    return filas, dict(filtros, por_pagina=por_pagina, **cursor(filas[-1]))
 
 def allowed_file(filename):
     return filename and '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXT
@@ -30,118 +120,244 @@ def save_file(file):
         return None
     if not allowed_file(file.filename):
         return None
-    fname = secure_filename(file.filename)
-    fname = f"{int(time.time())}_{fname}"
-    # asegurar carpeta uploads dentro del paquete
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    dst = os.path.join(app.config['UPLOAD_FOLDER'], fname)
-    file.save(dst)
-
-    # opcional: copiar imágenes a static/images para verlas fácilmente
-    ext = fname.rsplit('.', 1)[1].lower()
-    if ext in {'png', 'jpg', 'jpeg', 'gif'}:
-        static_images_dir = os.path.join(BASE_DIR, 'static', 'images')
-        os.makedirs(static_images_dir, exist_ok=True)
+    # se guarda una sola vez por contenido (sha256) y se cuenta la referencia;
+    # la referencia queda confirmada con el commit de la ruta que la usa
+    inicio = time.perf_counter()
+    filename = almacenamiento.guardar(get_db_connection(), app.config['UPLOAD_FOLDER'], file)
+    metricas.observar_subida(os.path.getsize(os.path.join(app.config['UPLOAD_FOLDER'], filename)),
+                             time.perf_counter() - inicio)
+    return filename
+
+def archivo_del_formulario():
+    """Nombre del archivo enviado con el formulario: la subida por bloques (``subida_id``) o el campo ``file``.
+
+    Devuelve None si no hay archivo; una subida incompleta o vencida
+    también devuelve None, con un mensaje flash.
+    """
+    subida_id = request.form.get('subida_id', '').strip()
+    if subida_id:
         try:
-            shutil.copyfile(dst, os.path.join(static_images_dir, fname))
-        except Exception as e:
-            print("WARN: no se pudo copiar la portada a static/images:", e)
-
-    # DEBUG: imprimir rutas y nombre guardado
-    print("DEBUG saved file:", dst)
-    return fname
-
-def crear_tablas():
-    with get_db_connection() as conn:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS biblioteca_virtual (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                titulo TEXT,
-                descripcion TEXT,
-                filename TEXT,
-                cover_filename TEXT,
-                curso TEXT,
-                letra TEXT,
-                letra_from TEXT,
-                letra_to TEXT,
-                fecha_subida TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        conn.commit()
+            return subidas.finalizar(get_db_connection(), app.config['UPLOAD_FOLDER'], subida_id)
+        except subidas.ErrorSubida as e:
+            flash(f'No se pudo completar la subida: {e}.', 'error')
+            return None
+    return save_file(request.files.get('file'))
+
+def delete_files(*filenames):
+    # archivos que quedaron sin referencias (ver almacenamiento.liberar)
+    almacenamiento.borrar(app.config['UPLOAD_FOLDER'], *filenames)
+
+def recolectar_subidas(simular=False, gracia_horas=None):
+    """Borra (o solo informa, con ``simular``) los archivos huérfanos de subidas y static/images."""
+    if gracia_horas is None:
+        gracia_horas = app.config['UPLOADS_GC_GRACE_HOURS']
+    directorios = {'uploads': app.config['UPLOAD_FOLDER'],
+                   'static/images': os.path.join(app.static_folder, 'images')}
+    # imágenes que las plantillas usan directamente (p. ej. placeholder_book.png)
+    conservar = set()
+    for nombre in app.jinja_env.list_templates():
+        fuente = app.jinja_loader.get_source(app.jinja_env, nombre)[0]
+        conservar.update(re.findall(r"filename=['\"]images/([^'\"]+)['\"]", fuente))
+
+    def operacion(conn):
+        resumen = almacenamiento.recolectar(conn, directorios, gracia_horas * 3600, simular=simular,
+                                            conservar=conservar)
+        if not simular:
+            # subidas por bloques cuyo archivo parcial se borró por abandonado
+            subidas.purgar(conn, app.config['UPLOAD_FOLDER'])
+        return resumen
+    conn = get_db_connection()
+    if simular:
+        return operacion(conn)
+    return circulacion.en_transaccion_inmediata(conn, operacion)
 
-        # migraciones: agregar columnas si faltan (silencioso)
-        cols = [r[1] for r in conn.execute("PRAGMA table_info(biblioteca_virtual)").fetchall()]
-        # mantener compatibilidad con versiones previas
-        if 'cover_filename' not in cols:
-            try:
-                conn.execute("ALTER TABLE biblioteca_virtual ADD COLUMN cover_filename TEXT")
-                conn.commit()
-            except Exception:
-                pass
-        if 'curso' not in cols:
-            try:
-                conn.execute("ALTER TABLE biblioteca_virtual ADD COLUMN curso TEXT")
-                conn.commit()
-            except Exception:
-                pass
-        if 'letra' not in cols:
-            try:
-                conn.execute("ALTER TABLE biblioteca_virtual ADD COLUMN letra TEXT")
-                conn.commit()
-            except Exception:
-                pass
-        # nuevas columnas para rango (admin)
-        if 'letra_from' not in cols:
-            try:
-                conn.execute("ALTER TABLE biblioteca_virtual ADD COLUMN letra_from TEXT")
-                conn.commit()
-            except Exception:
-                pass
-        if 'letra_to' not in cols:
-            try:
-                conn.execute("ALTER TABLE biblioteca_virtual ADD COLUMN letra_to TEXT")
-                conn.commit()
-            except Exception:
-                pass
-
-        # asegurar columna portada en libro si tabla vieja no la tiene
-        cols_libro = [r[1] for r in conn.execute("PRAGMA table_info(libro)").fetchall()]
-        if 'portada_filename' not in cols_libro:
-            try:
-                conn.execute("ALTER TABLE libro ADD COLUMN portada_filename TEXT")
-                conn.commit()
-            except Exception:
-                pass
-    conn.close()
+def actualizar_reportes(progreso=None):
+    """Regenera la copia de reportes (REPORT_SNAPSHOT) desde la base principal. Devuelve los segundos."""
+    return reportes.actualizar(app.config['DATABASE'], app.config['REPORT_SNAPSHOT'], progreso=progreso)
+
+def describir_edad(segundos):
+    if segundos is None:
+        return None
+    if segundos < 90:
+        return f'{int(segundos)} s'
+    if segundos < 90 * 60:
+        return f'{round(segundos / 60)} min'
+    if segundos < 36 * 3600:
+        return f'{round(segundos / 3600)} h'
+    return f'{round(segundos / 86400)} días'
+
+# antigüedad de la copia de reportes, para el panel de administración
+app.jinja_env.globals['edad_reportes'] = lambda: describir_edad(reportes.edad())
+
+def archivo_activo():
+    """True si hay una base de archivo de préstamos configurada (ver historico.py)."""
+    return bool(app.config.get('ARCHIVE_DATABASE'))
 
 def generar_codigo_libro(conn, seccion, libro_id):
     seccion_prefix = seccion[:3].upper()
     return f"{seccion_prefix}-{libro_id:03d}"
 
-def aplicar_migraciones():
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(libro)")
-        columnas_libro = [column['name'] for column in cursor.fetchall()]
-        if 'codigo_libro' not in columnas_libro:
-            print("Applying migration: Adding 'codigo_libro' to 'libro' table.")
-            conn.execute('ALTER TABLE libro ADD COLUMN codigo_libro TEXT')
-            conn.commit()
-            # --- Populate existing books with codes ---
-            libros = conn.execute('SELECT id, seccion FROM libro').fetchall()
-            for libro in libros:
-                codigo = generar_codigo_libro(conn, libro['seccion'], libro['id'])
-                conn.execute('UPDATE libro SET codigo_libro = ? WHERE id = ?', (codigo, libro['id']))
-            conn.commit()
-            print(f"{len(libros)} existing books updated with codes.")
-
-        cursor.execute("PRAGMA table_info(prestamo)")
-        columnas_prestamo = [column['name'] for column in cursor.fetchall()]
-        if 'reseñado' not in columnas_prestamo:
-            conn.execute('ALTER TABLE prestamo ADD COLUMN reseñado INTEGER DEFAULT 0')
-        if 'fecha_devolucion' not in columnas_prestamo:
-            conn.execute('ALTER TABLE prestamo ADD COLUMN fecha_devolucion TEXT')
-        conn.commit()
+def preparar_base_de_datos():
+    # una sola lectura de PRAGMA user_version si el esquema ya está al día
+    conn = get_db_connection()
+    for paso in migraciones.migrar(conn):
+        print(f"Migración aplicada: {paso}")
+    # tablas de la base de archivo adjunta, si hay una configurada
+    historico.preparar(conn)
+    conn.commit()
+
+def create_app(config=None):
+    """Devuelve la aplicación configurada (usada por wsgi.py, los benchmarks y scripts).
+
+    Las rutas se registran al importar este módulo; ``config`` se aplica
+    por encima de los valores por defecto y de las variables BIBLIOTECA_*.
+    """
+    if config:
+        app.config.update(config)
+        cache_respuestas.init_app(app)
+        metricas.init_app(app)
+        estaticos.init_app(app)
+    return app
+
+def preparar_esquema():
+    """Migraciones en el proceso maestro, antes de crear los workers.
+
+    Cierra las conexiones usadas: una conexión SQLite no debe cruzar un fork.
+    """
+    with app.app_context():
+        preparar_base_de_datos()
+    db.get_pool(app).close_all()
+
+def compilar_plantillas():
+    """Carga todas las plantillas en la caché de Jinja. Devuelve los segundos usados.
+
+    Llamada en el maestro antes del fork, los workers heredan las plantillas
+    ya compiladas (copy-on-write) y no repiten el trabajo.
+    """
+    inicio = time.perf_counter()
+    for nombre in app.jinja_env.list_templates():
+        app.jinja_env.get_template(nombre)
+    return time.perf_counter() - inicio
+
+def calentar():
+    """Abre conexiones del pool y completa la caché de plantillas en este worker.
+
+    Pensado para el hook post-fork: la primera petición ya no paga abrir la
+    base (pragmas y lectura del esquema) ni compilar Jinja. Devuelve la
+    duración de cada paso en segundos.
+    """
+    tiempos = {}
+    inicio = time.perf_counter()
+    db.precalentar(app, app.config.get('DB_POOL_WARM', 1))
+    tiempos['conexiones'] = time.perf_counter() - inicio
+    tiempos['plantillas'] = compilar_plantillas()
+    metricas.arranque['calentamiento_segundos'] = sum(tiempos.values())
+    return tiempos
+
+
+@app.cli.command('migrar')
+def migrar_command():
+    """Aplica las migraciones de esquema pendientes."""
+    preparar_base_de_datos()
+    print(f"Esquema en la versión {migraciones.version_actual(get_db_connection())}.")
+
+
+@app.cli.command('reconstruir-busqueda')
+def reconstruir_busqueda_command():
+    """Regenera los índices FTS5 del catálogo y la biblioteca virtual."""
+    preparar_base_de_datos()
+    conn = get_db_connection()
+    busqueda.reconstruir_indices(conn)
+    conn.commit()
+    print('Índices de búsqueda reconstruidos.')
+
+
+@app.cli.command('recalcular-estadisticas')
+def recalcular_estadisticas_command():
+    """Recalcula libro_stats, los resúmenes diarios y usuario_stats a partir de prestamo y reseña."""
+    preparar_base_de_datos()
+    conn = get_db_connection()
+    # incluye los préstamos archivados, si hay base de archivo
+    prestamos = historico.fuente(conn)
+    agregados.recalcular(conn, prestamos)
+    estadisticas.recalcular(conn, prestamos)
+    conn.commit()
+    print('Estadísticas por libro y resúmenes diarios recalculados.')
+
+
+@app.cli.command('deduplicar-subidas')
+def deduplicar_subidas_command():
+    """Migra las subidas existentes al almacenamiento por contenido y elimina copias."""
+    preparar_base_de_datos()
+    resumen = almacenamiento.deduplicar(get_db_connection(), app.config['UPLOAD_FOLDER'],
+                                        [os.path.join(BASE_DIR, 'static', 'images')])
+    print(f"{resumen['migrados']} archivo(s) migrados, {resumen['duplicados_eliminados']} copia(s) "
+          f"eliminadas, {resumen['bytes_liberados']} bytes liberados.")
+
+
+@app.cli.command('archivar-prestamos')
+@click.option('--dias', type=int, default=None,
+              help='Archiva los devueltos hace más de estos días (por defecto ARCHIVE_AFTER_DAYS).')
+@click.option('--lote', type=int, default=historico.LOTE, show_default=True,
+              help='Préstamos movidos por transacción.')
+def archivar_prestamos_command(dias, lote):
+    """Mueve los préstamos devueltos antiguos a la base de archivo (ARCHIVE_DATABASE)."""
+    if not archivo_activo():
+        raise click.ClickException('Configura ARCHIVE_DATABASE (o BIBLIOTECA_ARCHIVE_DATABASE) primero.')
+    preparar_base_de_datos()
+    conn = get_db_connection()
+    dias = app.config['ARCHIVE_AFTER_DAYS'] if dias is None else dias
+    corte = (datetime.now() - timedelta(days=dias)).strftime('%Y-%m-%d')
+    print(f"{historico.pendientes(conn, corte)} préstamo(s) devueltos antes de {corte} por archivar.")
+    movidos = historico.archivar(conn, corte, lote=lote,
+                                 progreso=lambda n: print(f'  {n} archivados', end='\r', flush=True))
+    print(f"\n{movidos} préstamo(s) movidos a {app.config['ARCHIVE_DATABASE']}.")
+
+
+@app.cli.command('actualizar-reportes')
+@click.option('--cada', type=int, default=None,
+              help='Repite la copia cada estos segundos (sin cron); por defecto la hace una sola vez.')
+def actualizar_reportes_command(cada):
+    """Copia la base a REPORT_SNAPSHOT con la API de backup, sin bloquear los préstamos."""
+    if not app.config['REPORT_SNAPSHOT']:
+        raise click.ClickException('Configura REPORT_SNAPSHOT (o BIBLIOTECA_REPORT_SNAPSHOT) primero.')
+    while True:
+        segundos = actualizar_reportes(
+            progreso=lambda hechas, total: print(f'  {hechas}/{total} páginas', end='\r', flush=True))
+        print(f"\nCopia de reportes actualizada en {segundos:.2f} s: {app.config['REPORT_SNAPSHOT']}.")
+        if not cada:
+            return
+        time.sleep(cada)
+
+
+@app.cli.command('construir-estaticos')
+def construir_estaticos_command():
+    """Genera los estáticos con huella de contenido, sus variantes comprimidas y el manifiesto."""
+    destino = app.config['STATIC_BUILD_FOLDER']
+    manifiesto = estaticos.construir(app.static_folder, destino)
+    originales = sum(e['bytes'] for e in manifiesto.values())
+    comprimidos = sum(min([e['bytes'], *e['codificaciones'].values()]) for e in manifiesto.values())
+    print(f"{len(manifiesto)} archivo(s) en {destino}: {originales} bytes, "
+          f"{comprimidos} con la mejor compresión. Reinicia la aplicación para usarlos.")
+
+
+@app.cli.command('limpiar-subidas')
+@click.option('--dry-run', is_flag=True, help='Solo informa; no borra nada.')
+@click.option('--gracia-horas', type=float, default=None,
+              help='Antigüedad mínima de un huérfano para borrarlo (por defecto UPLOADS_GC_GRACE_HOURS).')
+def limpiar_subidas_command(dry_run, gracia_horas):
+    """Borra los archivos subidos que ya no referencia ningún libro ni documento."""
+    preparar_base_de_datos()
+    resumen = recolectar_subidas(simular=dry_run, gracia_horas=gracia_horas)
+    for etiqueta, totales in resumen['directorios'].items():
+        detalle = ', '.join(f"{categoria} {t['archivos']} ({t['bytes']} bytes)" for categoria, t in totales.items())
+        print(f'{etiqueta}: {detalle}')
+    for muestra in resumen['muestras']:
+        print(f"  {muestra['categoria']}: {muestra['directorio']}/{muestra['nombre']} ({muestra['bytes']} bytes)")
+    verbo = 'se borrarían' if dry_run else 'borrados'
+    print(f"{resumen['eliminados']} archivo(s) {verbo}, {resumen['bytes_liberados']} bytes.")
+    if resumen['faltantes']:
+        print(f"{len(resumen['faltantes'])} archivo(s) referenciados no existen: {', '.join(resumen['faltantes'][:20])}")
 
 
 # --- User Routes ---
@@ -159,6 +375,8 @@ def login():
     return render_template('login.html')
 
 @app.route('/dashboard')
+@versiones.etag_por_version('libro', 'prestamo', 'reseña')
+@cache_respuestas.cachear('libro', 'prestamo', 'reseña')
 def dashboard():
     if 'correo' not in session:
         return redirect(url_for('login'))
@@ -169,55 +387,53 @@ def dashboard():
     search_query = request.args.get('search', '')
     seccion_filter = request.args.get('seccion', '')
 
-    # Fetch all unique sections for the dropdown
-    secciones_disponibles_raw = conn.execute('SELECT DISTINCT seccion FROM libro ORDER BY seccion').fetchall()
-    secciones_disponibles = [row['seccion'] for row in secciones_disponibles_raw]
+    # foto del catálogo en memoria: secciones y libros ya agrupados (ver catalogo.py)
+    foto = catalogo.obtener(conn)
+    secciones_disponibles = foto.secciones
 
-    # Dashboard analytics
+    # Dashboard analytics (contadores precalculados en libro_stats)
     libros_populares = conn.execute("""
-        SELECT l.id, l.titulo, l.autor, COUNT(p.libro_id) as total_prestamos
-        FROM libro l JOIN prestamo p ON l.id = p.libro_id
-        GROUP BY l.id, l.titulo, l.autor
-        ORDER BY total_prestamos DESC LIMIT 5
+        SELECT l.id, l.titulo, l.autor, s.total_prestamos
+        FROM libro_stats s JOIN libro l ON l.id = s.libro_id
+        WHERE s.total_prestamos > 0
+        ORDER BY s.total_prestamos DESC LIMIT 5
     """).fetchall()
 
     libros_mejor_calificados = conn.execute("""
-        SELECT l.id, l.titulo, l.autor, AVG(r.calificacion) as avg_rating
-        FROM libro l JOIN reseña r ON l.id = r.libro_id
-        GROUP BY l.id, l.titulo, l.autor
-        ORDER BY avg_rating DESC LIMIT 5
+        SELECT l.id, l.titulo, l.autor, s.promedio as avg_rating
+        FROM libro_stats s JOIN libro l ON l.id = s.libro_id
+        WHERE s.num_calificaciones > 0
+        ORDER BY s.promedio DESC LIMIT 5
     """).fetchall()
 
-    # Build the query based on filters
-    query = "SELECT * FROM libro WHERE stock > 0"
-    params = []
-
-    if search_query:
-        query += " AND (titulo LIKE ? OR autor LIKE ? OR codigo_libro LIKE ?)"
-        params.extend([f'%{search_query}%', f'%{search_query}%', f'%{search_query}%'])
-
-    if seccion_filter:
-        query += " AND seccion = ?"
-        params.append(seccion_filter)
+    consulta = busqueda.consulta_fts(search_query)
+    if consulta:
+        # búsqueda por prefijos en el índice FTS5, ordenada por relevancia (bm25);
+        # solo se piden los ids, los libros salen de la foto
+        query = ("SELECT l.id FROM libro_fts JOIN libro l ON l.id = libro_fts.rowid "
+                 "WHERE libro_fts MATCH ? AND l.stock > 0")
+        params = [consulta]
+        if seccion_filter:
+            query += " AND l.seccion = ?"
+            params.append(seccion_filter)
+        query += " ORDER BY bm25(libro_fts) LIMIT ?"
+        params.append(busqueda.LIMITE_RESULTADOS)
+        libros = foto.disponibles([fila[0] for fila in conn.execute(query, params)])
+    elif seccion_filter:
+        libros = foto.disponibles_por_seccion(seccion_filter).get(seccion_filter, ())
+    else:
+        libros = None
 
-    query += " ORDER BY seccion, titulo"
-    libros = conn.execute(query, params).fetchall()
-    
     # Group books by section for display
-    secciones_agrupadas = {}
-    if search_query or seccion_filter: 
-        # If filtering, group results under a single header
-        if libros:
-            secciones_agrupadas['Resultados de la Búsqueda'] = libros
-    else:
+    if libros is None:
         # On default view, group by actual section
-        for libro in libros:
-            secciones_agrupadas.setdefault(libro['seccion'], []).append(libro)
+        secciones_agrupadas = foto.disponibles_por_seccion()
+    else:
+        # If filtering, group results under a single header
+        secciones_agrupadas = {'Resultados de la Búsqueda': libros} if libros else {}
 
-    conn.close()
     
     return render_template('dashboard.html', 
-                            correo=session['correo'], 
                             secciones_agrupadas=secciones_agrupadas, 
                             search=search_query,
                             secciones_disponibles=secciones_disponibles,
@@ -228,22 +444,23 @@ def dashboard():
 
 
 @app.route('/libro/<int:libro_id>')
+@versiones.etag_por_version('libro', 'reseña')
+@cache_respuestas.cachear('libro', 'reseña')
 def libro_detalle(libro_id):
     if 'correo' not in session:
         return redirect(url_for('login'))
 
     conn = get_db_connection()
-    libro = conn.execute('SELECT * FROM libro WHERE id = ?', (libro_id,)).fetchone()
+    libro = catalogo.obtener(conn).libro(libro_id)
 
     if not libro:
         flash('El libro no fue encontrado.', 'error')
         return redirect(url_for('dashboard'))
 
     reseñas = conn.execute('SELECT * FROM reseña WHERE libro_id = ? ORDER BY fecha DESC', (libro_id,)).fetchall()
-    avg_rating_result = conn.execute('SELECT AVG(calificacion) as avg FROM reseña WHERE libro_id = ?', (libro_id,)).fetchone()
-    avg_rating = round(avg_rating_result['avg'], 1) if avg_rating_result['avg'] else 0
+    avg_rating_result = conn.execute('SELECT promedio FROM libro_stats WHERE libro_id = ?', (libro_id,)).fetchone()
+    avg_rating = round(avg_rating_result['promedio'], 1) if avg_rating_result and avg_rating_result['promedio'] else 0
     
-    conn.close()
     return render_template('libro_detalle.html', libro=libro, reseñas=reseñas, avg_rating=avg_rating)
 
 @app.route('/prestar/<int:libro_id>', methods=['GET', 'POST'])
@@ -252,9 +469,9 @@ def prestar(libro_id):
         return redirect(url_for('login'))
     
     conn = get_db_connection()
-    libro = conn.execute('SELECT * FROM libro WHERE id = ? AND stock > 0', (libro_id,)).fetchone()
+    libro = catalogo.obtener(conn).libro(libro_id)
 
-    if not libro:
+    if not libro or libro.stock <= 0:
         flash('El libro no está disponible o no existe.', 'error')
         return redirect(url_for('dashboard'))
 
@@ -269,19 +486,17 @@ def prestar(libro_id):
             return render_template('prestar.html', libro=libro)
 
         fecha_prestamo = datetime.now().strftime('%Y-%m-%d')
-        
-        conn.execute(
-            'INSERT INTO prestamo (nombre, grado, curso, libro_id, dias, correo, fecha_prestamo) VALUES (?, ?, ?, ?, ?, ?, ?)',
-            (nombre, grado, curso, libro_id, dias, session['correo'], fecha_prestamo)
-        )
-        conn.execute('UPDATE libro SET stock = stock - 1 WHERE id = ?', (libro_id,))
-        conn.commit()
-        conn.close()
-        
+
+        # reserva atómica: otro estudiante pudo llevarse la última unidad
+        prestamo_id = circulacion.prestar_libro(conn, libro_id, nombre, grado, curso, dias,
+                                                session['correo'], fecha_prestamo)
+        if prestamo_id is None:
+            flash('El libro no está disponible o no existe.', 'error')
+            return redirect(url_for('dashboard'))
+
         flash(f'¡Préstamo del libro "{libro["titulo"]}" solicitado con éxito!', 'success')
         return redirect(url_for('dashboard'))
 
-    conn.close()
     return render_template('prestar.html', libro=libro)
 
 @app.route('/perfil')
@@ -292,31 +507,25 @@ def perfil():
     conn = get_db_connection()
     user_email = session['correo']
     
-    prestamos_activos_raw = conn.execute("""
-        SELECT p.*, l.titulo AS libro, l.autor, l.codigo_libro
+    prestamos_activos = conn.execute(f"""
+        SELECT p.*, l.titulo AS libro, l.autor, l.codigo_libro,
+               p.fecha_vencimiento AS fecha_devolucion_estimada,
+               MAX({SQL_DIAS_RESTANTES}, -1) AS dias_restantes
         FROM prestamo p JOIN libro l ON p.libro_id = l.id 
         WHERE p.correo = ? AND p.devuelto = 0
+        ORDER BY p.fecha_vencimiento
     """, (user_email,)).fetchall()
 
-    prestamos_activos = []
-    hoy = datetime.now()
-    for p in prestamos_activos_raw:
-        p_dict = dict(p)
-        fecha_inicio = datetime.strptime(p['fecha_prestamo'], '%Y-%m-%d')
-        fecha_fin = fecha_inicio + timedelta(days=int(p['dias']))
-        dias_restantes = (fecha_fin - hoy).days + 1
-        p_dict['fecha_devolucion_estimada'] = fecha_fin.strftime('%Y-%m-%d')
-        p_dict['dias_restantes'] = dias_restantes if dias_restantes >= 0 else -1
-        prestamos_activos.append(p_dict)
-
-    historial = conn.execute("""
-        SELECT p.*, l.titulo AS libro, l.codigo_libro
-        FROM prestamo p JOIN libro l ON p.libro_id = l.id 
-        WHERE p.correo = ? ORDER BY p.fecha_prestamo DESC
-    """, (user_email,)).fetchall()
-    
-    conn.close()
-    return render_template('perfil.html', correo=user_email, prestamos=prestamos_activos, historial=historial)
+    # los préstamos archivados (ver historico.py) solo se leen si se piden
+    archivados = archivo_activo() and bool(request.args.get('archivados'))
+    sql, repeticiones = historico.union("""
+        SELECT p.*, l.titulo AS libro, l.codigo_libro, {archivado} AS archivado
+        FROM {prestamo} p JOIN libro l ON p.libro_id = l.id
+        WHERE p.correo = ?""", archivados)
+    historial = conn.execute(sql + ' ORDER BY fecha_prestamo DESC', (user_email,) * repeticiones).fetchall()
+
+    return render_template('perfil.html', correo=user_email, prestamos=prestamos_activos, historial=historial,
+                           archivo_activo=archivo_activo(), archivados=archivados)
 
 @app.route('/escribir_reseña/<int:prestamo_id>', methods=['GET', 'POST'])
 def escribir_reseña(prestamo_id):
@@ -339,9 +548,10 @@ def escribir_reseña(prestamo_id):
         calificacion = request.form.get('calificacion')
         comentario = request.form.get('comentario')
         
-        if not calificacion:
+        if calificacion not in {'1', '2', '3', '4', '5'}:
             flash('Debes seleccionar una calificación.', 'error')
             return render_template('escribir_reseña.html', libro=libro, prestamo=prestamo)
+        calificacion = int(calificacion)
 
         fecha_reseña = datetime.now().strftime('%Y-%m-%d')
         conn.execute(
@@ -349,13 +559,12 @@ def escribir_reseña(prestamo_id):
             (libro['id'], session['correo'], calificacion, comentario, fecha_reseña)
         )
         conn.execute('UPDATE prestamo SET reseñado = 1 WHERE id = ?', (prestamo_id,))
+        agregados.registrar_reseña(conn, libro['id'], calificacion)
         conn.commit()
-        conn.close()
 
         flash('¡Gracias por tu reseña!', 'success')
         return redirect(url_for('perfil'))
 
-    conn.close()
     return render_template('escribir_reseña.html', libro=libro, prestamo=prestamo)
 
 @app.route('/logout')
@@ -417,9 +626,87 @@ def admin_libros():
         conn.commit()
         flash(f'Libro "{titulo}" (Código: {codigo}) añadido correctamente.', 'success')
 
-    libros = conn.execute('SELECT * FROM libro ORDER BY seccion, codigo_libro').fetchall()
-    conn.close()
-    return render_template('admin_libros.html', libros=libros)
+    if request.args.get('todo'):
+        # catálogo completo: se transmite mientras se lee el cursor, sin fetchall(); el cursor
+        # se sigue leyendo después del teardown, con una conexión propia cerrada al terminar el envío
+        propia = db.conexion_propia()
+        libros = propia.execute('SELECT * FROM libro ORDER BY seccion, codigo_libro')
+        response = Response(stream_template('admin_libros.html', libros=libros, todo=True))
+        response.call_on_close(propia.close)
+        return response
+
+    por_pagina = leer_tamano_pagina()
+    despues_seccion = request.args.get('despues_seccion')
+    despues_codigo = request.args.get('despues_codigo')
+    query = 'SELECT * FROM libro'
+    params = []
+    es_continuacion = despues_seccion is not None and despues_codigo is not None
+    if es_continuacion:
+        query += ' WHERE (seccion, codigo_libro) > (?, ?)'
+        params.extend([despues_seccion, despues_codigo])
+    query += ' ORDER BY seccion, codigo_libro LIMIT ?'
+    params.append(por_pagina + 1)
+
+    libros, siguiente = cortar_pagina(
+        conn.execute(query, params).fetchall(), por_pagina,
+        lambda ultimo: {'despues_seccion': ultimo['seccion'], 'despues_codigo': ultimo['codigo_libro']}, {})
+    return render_template('admin_libros.html', libros=libros, siguiente=siguiente, filtros={},
+                            por_pagina=por_pagina, es_continuacion=es_continuacion)
+
+@app.route('/admin_libros/importar', methods=['GET', 'POST'])
+def admin_importar_libros():
+    if not session.get('admin'):
+        return redirect(url_for('admin_login'))
+
+    if request.method == 'GET':
+        return render_template('admin_importar_libros.html')
+
+    archivo_csv = request.files.get('csv')
+    if not archivo_csv or archivo_csv.filename == '':
+        flash('No se seleccionó ningún archivo CSV.', 'error')
+        return redirect(url_for('admin_importar_libros'))
+    dry_run = bool(request.form.get('dry_run'))
+    portadas = {f.filename: f for f in request.files.getlist('portadas')
+                if f and f.filename and allowed_file(f.filename)}
+
+    flujo = io.TextIOWrapper(archivo_csv.stream, encoding='utf-8-sig', newline='')
+    try:
+        informe = importacion.importar_csv(get_db_connection(), flujo, generar_codigo_libro,
+                                           portadas=portadas, directorio_subidas=app.config['UPLOAD_FOLDER'],
+                                           dry_run=dry_run)
+    except (importacion.ErrorImportacion, UnicodeDecodeError) as e:
+        flash(f'No se pudo leer el CSV: {e}', 'error')
+        return redirect(url_for('admin_importar_libros'))
+
+    totales = importacion.resumen(informe)
+    if dry_run:
+        flash(f"Simulación: se importarían {totales['importados']} libro(s); {totales['errores']} fila(s) con errores.", 'success')
+    else:
+        flash(f"{totales['importados']} libro(s) importados; {totales['errores']} fila(s) con errores.", 'success')
+    return render_template('admin_importar_libros.html', informe=informe, totales=totales, dry_run=dry_run)
+
+@app.cli.command('importar-libros')
+@click.argument('archivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--portadas', 'directorio_portadas', type=click.Path(exists=True, file_okay=False),
+              help='Carpeta con las imágenes nombradas en la columna portada.')
+@click.option('--dry-run', is_flag=True, help='Valida y muestra el informe sin guardar nada.')
+def importar_libros_command(archivo, directorio_portadas, dry_run):
+    """Importa libros desde un CSV (titulo, autor, editorial, stock, seccion[, portada])."""
+    preparar_base_de_datos()
+    portadas = importacion.PortadasEnDirectorio(directorio_portadas) if directorio_portadas else None
+    with open(archivo, encoding='utf-8-sig', newline='') as flujo:
+        try:
+            informe = importacion.importar_csv(get_db_connection(), flujo, generar_codigo_libro,
+                                               portadas=portadas, directorio_subidas=app.config['UPLOAD_FOLDER'],
+                                               dry_run=dry_run)
+        except importacion.ErrorImportacion as e:
+            raise click.ClickException(str(e))
+    for fila in informe:
+        if fila['error']:
+            click.echo(f"fila {fila['fila']}: ERROR {fila['error']}", err=True)
+    totales = importacion.resumen(informe)
+    prefijo = 'Simulación: ' if dry_run else ''
+    click.echo(f"{prefijo}{totales['importados']} importados, {totales['errores']} con errores, {totales['total']} filas.")
 
 @app.route('/admin_editar_libro/<int:libro_id>', methods=['GET', 'POST'])
 def admin_editar_libro(libro_id):
@@ -441,13 +728,11 @@ def admin_editar_libro(libro_id):
             (titulo, autor, editorial, stock, seccion, codigo, libro_id)
         )
         conn.commit()
-        conn.close()
         
         flash(f'Libro "{titulo}" (Código: {codigo}) actualizado correctamente.', 'success')
         return redirect(url_for('admin_libros'))
 
     libro = conn.execute('SELECT * FROM libro WHERE id = ?', (libro_id,)).fetchone()
-    conn.close()
     
     if libro is None:
         flash('El libro no fue encontrado.', 'error')
@@ -462,17 +747,21 @@ def admin_eliminar_libro(libro_id):
 
     conn = get_db_connection()
     
-    loan_count = conn.execute('SELECT COUNT(*) FROM prestamo WHERE libro_id = ?', (libro_id,)).fetchone()[0]
+    # también cuentan los préstamos archivados: su libro_id debe seguir existiendo
+    loan_count = conn.execute(f'SELECT COUNT(*) FROM {historico.fuente(conn)} WHERE libro_id = ?',
+                              (libro_id,)).fetchone()[0]
     
     if loan_count > 0:
         flash(f'No se puede eliminar este libro porque tiene un historial de {loan_count} préstamo(s). Para darlo de baja, edítalo y pon su stock a 0.', 'error')
     else:
-        libro = conn.execute('SELECT titulo FROM libro WHERE id = ?', (libro_id,)).fetchone()
+        libro = conn.execute('SELECT titulo, portada_filename FROM libro WHERE id = ?', (libro_id,)).fetchone()
+        huerfano = almacenamiento.liberar(conn, libro['portada_filename'])
+        agregados.quitar(conn, libro_id)
         conn.execute('DELETE FROM libro WHERE id = ?', (libro_id,))
         conn.commit()
+        delete_files(huerfano)
         flash(f'Libro "{libro["titulo"]}" eliminado permanentemente ya que no tenía préstamos asociados.', 'success')
         
-    conn.close()
     return redirect(url_for('admin_libros'))
 
 @app.route('/admin_prestamos')
@@ -481,25 +770,44 @@ def admin_prestamos():
         return redirect(url_for('admin_login'))
     
     conn = get_db_connection()
-    prestamos_raw = conn.execute("""
-        SELECT p.*, l.titulo as libro, l.codigo_libro 
+    prestamos_list = conn.execute(f"""
+        SELECT p.*, l.titulo as libro, l.codigo_libro, {SQL_DIAS_RESTANTES} AS dias_restantes
         FROM prestamo p JOIN libro l ON p.libro_id = l.id
         WHERE p.devuelto = 0 
         ORDER BY p.fecha_prestamo
     """).fetchall()
-    
-    prestamos_list = []
-    hoy = datetime.now()
-    for p in prestamos_raw:
-        p_dict = dict(p)
-        fecha_inicio = datetime.strptime(p['fecha_prestamo'], '%Y-%m-%d')
-        fecha_fin = fecha_inicio + timedelta(days=int(p['dias']))
-        dias_restantes = (fecha_fin - hoy).days + 1
-        p_dict['dias_restantes'] = dias_restantes
-        prestamos_list.append(p_dict)
-
-    conn.close()
-    return render_template('admin_prestamos.html', prestamos=prestamos_list)
+    total_vencidos = conn.execute(
+        "SELECT COUNT(*) FROM prestamo WHERE devuelto = 0 AND fecha_vencimiento < date('now', 'localtime')"
+    ).fetchone()[0]
+
+    return render_template('admin_prestamos.html', prestamos=prestamos_list, total_vencidos=total_vencidos)
+
+@app.route('/admin_vencidos')
+def admin_vencidos():
+    if not session.get('admin'):
+        return redirect(url_for('admin_login'))
+
+    grado_filter = request.args.get('grado', '').strip()
+    curso_filter = request.args.get('curso', '').strip()
+
+    # solo préstamos vencidos, los más atrasados primero (usa idx_prestamo_devuelto_vencimiento)
+    query = """SELECT p.*, l.titulo as libro, l.codigo_libro,
+                      CAST(julianday(date('now', 'localtime')) - julianday(p.fecha_vencimiento) AS INTEGER) AS dias_atraso
+               FROM prestamo p JOIN libro l ON p.libro_id = l.id
+               WHERE p.devuelto = 0 AND p.fecha_vencimiento < date('now', 'localtime')"""
+    params = []
+    if grado_filter:
+        query += " AND p.grado = ?"
+        params.append(grado_filter)
+    if curso_filter:
+        query += " AND p.curso = ?"
+        params.append(curso_filter)
+    query += " ORDER BY p.fecha_vencimiento, p.id"
+
+    conn = get_db_connection()
+    prestamos = conn.execute(query, params).fetchall()
+    return render_template('admin_vencidos.html', prestamos=prestamos,
+                            grado=grado_filter, curso=curso_filter)
 
 @app.route('/devolver_prestamo/<int:prestamo_id>', methods=['POST'])
 def devolver_prestamo(prestamo_id):
@@ -507,72 +815,192 @@ def devolver_prestamo(prestamo_id):
         return redirect(url_for('admin_login'))
 
     conn = get_db_connection()
-    prestamo = conn.execute('SELECT libro_id FROM prestamo WHERE id = ?', (prestamo_id,)).fetchone()
-    
-    if prestamo:
-        fecha_devolucion = datetime.now().strftime('%Y-%m-%d')
-        conn.execute('UPDATE prestamo SET devuelto = 1, fecha_devolucion = ? WHERE id = ?', (fecha_devolucion, prestamo_id))
-        conn.execute('UPDATE libro SET stock = stock + 1 WHERE id = ?', (prestamo['libro_id'],))
-        conn.commit()
+    fecha_devolucion = datetime.now().strftime('%Y-%m-%d')
+    libro_id = circulacion.devolver_prestamo(conn, prestamo_id, fecha_devolucion)
+
+    if libro_id is not None:
         flash('Préstamo marcado como devuelto y libro repuesto al stock.', 'success')
     else:
-        flash('No se encontró el préstamo.', 'error')
+        flash('No se encontró el préstamo o ya estaba devuelto.', 'error')
         
-    conn.close()
     return redirect(url_for('admin_prestamos'))
 
+@app.route('/admin/circulacion/lote', methods=['GET', 'POST'])
+def admin_circulacion_lote():
+    """Devolución o préstamo de muchos libros a la vez desde el lector de códigos.
+
+    Acepta el formulario (``items`` con una entrada por línea) o JSON
+    ``{"operacion": "devolver"|"prestar", "items": [...], ...}``; responde
+    con el resultado de cada entrada (ver ``circulacion.devolver_lote`` y
+    ``circulacion.prestar_lote``).
+    """
+    if not session.get('admin'):
+        if request.is_json:
+            return jsonify({'error': 'no autorizado'}), 401
+        return redirect(url_for('admin_login'))
+    if request.method == 'GET':
+        return render_template('admin_circulacion_lote.html', datos={'operacion': 'devolver'})
+
+    datos = request.get_json(silent=True) if request.is_json else request.form.to_dict()
+    datos = datos or {}
+    operacion = datos.get('operacion', 'devolver')
+    entradas = circulacion.leer_entradas(datos.get('items') or [])
+    grado = str(datos.get('grado') or '').strip()
+    curso = str(datos.get('curso') or '').strip()
+    error = None
+    if operacion not in ('devolver', 'prestar'):
+        error = 'operacion debe ser devolver o prestar'
+    elif not entradas:
+        error = 'No se leyó ningún código.'
+    elif len(entradas) > LOTE_MAXIMO:
+        error = f'Como máximo {LOTE_MAXIMO} entradas por lote.'
+
+    resultados = None
+    if error is None:
+        conn = get_db_connection()
+        hoy = datetime.now().strftime('%Y-%m-%d')
+        if operacion == 'devolver':
+            # grado y curso, si se indican, limitan la devolución a los préstamos de ese curso
+            resultados = circulacion.devolver_lote(conn, entradas, hoy, grado or None, curso or None)
+        else:
+            nombre = str(datos.get('nombre') or '').strip()
+            correo = str(datos.get('correo') or '').strip()
+            try:
+                dias = int(datos.get('dias') or 0)
+            except (TypeError, ValueError):
+                dias = 0
+            if not (nombre and grado and curso and correo):
+                error = 'Para prestar se necesitan nombre, grado, curso y correo.'
+            elif dias <= 0 or dias > 62:
+                error = 'El número de días para el préstamo debe ser entre 1 y 62.'
+            else:
+                resultados = circulacion.prestar_lote(conn, entradas, nombre, grado, curso, dias, correo, hoy)
+
+    resumen = {}
+    for resultado in resultados or ():
+        resumen[resultado['estado']] = resumen.get(resultado['estado'], 0) + 1
+    if request.is_json:
+        if error:
+            return jsonify({'error': error}), 400
+        return jsonify({'operacion': operacion, 'resumen': resumen, 'resultados': resultados})
+    if error:
+        flash(error, 'error')
+    return render_template('admin_circulacion_lote.html', datos=datos, resultados=resultados, resumen=resumen)
+
 @app.route('/admin_historial')
 def admin_historial():
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
 
     search_query = request.args.get('search', '')
-    conn = get_db_connection()
+    # con archivados=1 también se leen los préstamos movidos a la base de archivo (UNION ALL)
+    archivados = archivo_activo() and bool(request.args.get('archivados'))
 
-    base_query = """SELECT p.*, l.titulo as libro, l.codigo_libro
-                    FROM prestamo p JOIN libro l ON p.libro_id = l.id"""
+    base_query = """SELECT p.*, l.titulo as libro, l.codigo_libro, {archivado} AS archivado
+                    FROM {prestamo} p JOIN libro l ON p.libro_id = l.id"""
+    condiciones = []
     params = []
 
     if search_query:
-        base_query += " WHERE p.nombre LIKE ? OR p.correo LIKE ? OR l.titulo LIKE ? OR l.codigo_libro LIKE ?"
+        condiciones.append("(p.nombre LIKE ? OR p.correo LIKE ? OR l.titulo LIKE ? OR l.codigo_libro LIKE ?)")
         params = [f'%{search_query}%'] * 4
-    
-    base_query += " ORDER BY p.fecha_prestamo DESC"
 
-    prestamos = conn.execute(base_query, params).fetchall()
-    conn.close()
-    
-    return render_template('admin_historial.html', prestamos=prestamos, search=search_query)
+    if request.args.get('todo'):
+        # historial completo: se transmite fila a fila desde el cursor, la memoria no crece
+        if condiciones:
+            base_query += " WHERE " + " AND ".join(condiciones)
+        sql, repeticiones = historico.union(base_query, archivados)
+        # se sigue leyendo después del teardown: conexión propia (a la copia de reportes si
+        # existe, si no a la base principal), cerrada al terminar el envío
+        propia = reportes.abrir() or db.conexion_propia()
+        prestamos = propia.execute(sql + " ORDER BY fecha_prestamo DESC, id DESC", params * repeticiones)
+        response = Response(stream_template('admin_historial.html', prestamos=prestamos,
+                                            search=search_query, todo=True, archivados=archivados,
+                                            archivo_activo=archivo_activo()))
+        response.call_on_close(propia.close)
+        return response
+
+    filtros = {'search': search_query} if search_query else {}
+    if archivados:
+        filtros['archivados'] = 1
+    por_pagina = leer_tamano_pagina()
+    antes_fecha = request.args.get('antes_fecha')
+    antes_id = request.args.get('antes_id', type=int)
+    es_continuacion = antes_fecha is not None and antes_id is not None
+    if es_continuacion:
+        condiciones.append("(p.fecha_prestamo, p.id) < (?, ?)")
+        params.extend([antes_fecha, antes_id])
+
+    if condiciones:
+        base_query += " WHERE " + " AND ".join(condiciones)
+    sql, repeticiones = historico.union(base_query, archivados)
+    sql += " ORDER BY fecha_prestamo DESC, id DESC LIMIT ?"
+    params = params * repeticiones + [por_pagina + 1]
+
+    # las búsquedas con LIKE leen la copia de reportes, no la base en la que escriben los préstamos
+    conn = reportes.conexion()
+    prestamos, siguiente = cortar_pagina(
+        conn.execute(sql, params).fetchall(), por_pagina,
+        lambda ultimo: {'antes_fecha': ultimo['fecha_prestamo'], 'antes_id': ultimo['id']}, filtros)
+
+    return render_template('admin_historial.html', prestamos=prestamos, search=search_query,
+                            siguiente=siguiente, filtros=filtros, por_pagina=por_pagina, es_continuacion=es_continuacion,
+                            archivados=archivados, archivo_activo=archivo_activo())
 
 @app.route('/admin_estadisticas')
 def admin_estadisticas():
     if not session.get('admin'):
         return redirect(url_for('admin_login'))
     
-    conn = get_db_connection()
+    conn = reportes.conexion()
     libros_populares = conn.execute("""
-        SELECT l.titulo as libro, COUNT(p.libro_id) as total, l.codigo_libro
-        FROM prestamo p JOIN libro l ON p.libro_id = l.id
-        GROUP BY l.titulo
-        ORDER BY total DESC
+        SELECT l.titulo as libro, s.total_prestamos as total, l.codigo_libro
+        FROM libro_stats s JOIN libro l ON l.id = s.libro_id
+        WHERE s.total_prestamos > 0
+        ORDER BY s.total_prestamos DESC
         LIMIT 5
     """).fetchall()
     usuarios_activos = conn.execute("""
-        SELECT nombre, correo, COUNT(*) as total
-        FROM prestamo
-        GROUP BY correo
-        ORDER BY total DESC
+        SELECT nombre, correo, total_prestamos as total
+        FROM usuario_stats
+        ORDER BY total_prestamos DESC
         LIMIT 5
     """).fetchall()
-    total_prestamos = conn.execute('SELECT COUNT(*) FROM prestamo').fetchone()[0]
+    total_prestamos = estadisticas.total_prestamos(conn)
     total_libros = conn.execute('SELECT SUM(stock) FROM libro').fetchone()[0]
-    conn.close()
-    
+
+    # tendencias del rango elegido, sumando los resúmenes diarios
+    desde, hasta = estadisticas.rango(request.args.get('desde'), request.args.get('hasta'))
+    granularidad = request.args.get('granularidad', 'dia')
+    if granularidad not in estadisticas.GRANULARIDADES:
+        granularidad = 'dia'
+
     return render_template('admin_estadisticas.html',
                             libros_populares=libros_populares,
                             usuarios_activos=usuarios_activos,
                             total_prestamos=total_prestamos,
-                            total_libros=total_libros or 0)
+                            total_libros=total_libros or 0,
+                            desde=desde, hasta=hasta, granularidad=granularidad,
+                            resumen=estadisticas.resumen(conn, desde, hasta),
+                            serie=estadisticas.serie(conn, desde, hasta, granularidad),
+                            por_seccion=estadisticas.por_dimension(conn, 'seccion', desde, hasta),
+                            por_curso=estadisticas.por_dimension(conn, 'curso', desde, hasta))
+
+@app.route('/admin/cache')
+def admin_cache():
+    if not session.get('admin'):
+        return redirect(url_for('admin_login'))
+    return jsonify(cache_respuestas.cache.estadisticas())
+
+@app.route('/metrics')
+def metrics():
+    token = app.config.get('METRICS_TOKEN')
+    autorizado = session.get('admin') or (
+        token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'))
+    if not autorizado:
+        abort(403)
+    texto = metricas.exportar(cache_respuestas=cache_respuestas.cache.estadisticas())
+    return Response(texto, mimetype='text/plain; version=0.0.4')
 
 @app.route('/logout_admin')
 def logout_admin():
@@ -582,49 +1010,103 @@ def logout_admin():
 
 # --- Virtual Library Routes ---
 @app.route('/biblioteca_virtual')
+@versiones.etag_por_version('biblioteca_virtual')
+@cache_respuestas.cachear('biblioteca_virtual')
 def biblioteca_virtual():
     if 'correo' not in session:
         return redirect(url_for('login'))
 
     search_query = request.args.get('search', '').strip()
-    curso_filter = request.args.get('curso', '').strip()
-    letra_filter = request.args.get('letra', '').strip().upper()[:1] if request.args.get('letra') else ''
+    curso_filter = facetas.normalizar_curso(request.args.get('curso'))
+    letra_filter = facetas.normalizar_letra(request.args.get('letra')) or ''
 
     conn = get_db_connection()
-    query = "SELECT * FROM biblioteca_virtual WHERE 1=1"
-    params = []
-
-    if search_query:
-        query += " AND titulo LIKE ?"
-        params.append(f'%{search_query}%')
+    consulta = busqueda.consulta_fts(search_query)
+    if consulta:
+        query = ("SELECT bv.* FROM biblioteca_virtual_fts "
+                 "JOIN biblioteca_virtual bv ON bv.id = biblioteca_virtual_fts.rowid "
+                 "WHERE biblioteca_virtual_fts MATCH ?")
+        params = [consulta]
+    else:
+        query = "SELECT bv.* FROM biblioteca_virtual bv WHERE 1=1"
+        params = []
 
     if curso_filter:
-        query += " AND curso = ?"
+        query += " AND bv.curso = ?"
         params.append(curso_filter)
 
     if letra_filter:
-        # coincidir letra única OR estar dentro del rango definido por admin (letra_from <= letra <= letra_to)
-        query += (" AND (UPPER(letra) = ? OR "
-                    "(letra_from IS NOT NULL AND letra_to IS NOT NULL AND UPPER(letra_from) <= ? AND UPPER(letra_to) >= ?))")
-        params.extend([letra_filter, letra_filter, letra_filter])
+        # letra única o dentro del rango letra_from-letra_to (expandido en biblioteca_virtual_letra)
+        query += " AND bv.id IN (SELECT documento_id FROM biblioteca_virtual_letra WHERE letra = ?)"
+        params.append(letra_filter)
 
-    query += " ORDER BY fecha_subida DESC"
+    if consulta:
+        query += " ORDER BY bm25(biblioteca_virtual_fts), bv.fecha_subida DESC LIMIT ?"
+        params.append(busqueda.LIMITE_RESULTADOS)
+    else:
+        query += " ORDER BY bv.fecha_subida DESC"
     documentos = conn.execute(query, params).fetchall()
-    conn.close()
     return render_template('biblioteca_virtual.html',
                             documentos=documentos,
                             page='biblioteca_virtual',
                             search=search_query,
                             curso=curso_filter,
-                            letra=letra_filter)
+                            letra=letra_filter,
+                            facetas=facetas.contar(conn, curso_filter, letra_filter))
+
+
+@app.route('/api/autocomplete')
+def api_autocomplete():
+    if 'correo' not in session and not session.get('admin'):
+        return jsonify([]), 401
+    alcance = request.args.get('scope', 'documentos')
+    if alcance not in autocompletar.ALCANCES:
+        return jsonify({'error': 'scope debe ser libros o documentos'}), 400
+    limite = request.args.get('limit', autocompletar.LIMITE_POR_DEFECTO, type=int)
+    limite = max(1, min(limite, autocompletar.LIMITE_MAXIMO))
+    indice = autocompletar.obtener_indice(get_db_connection(), alcance)
+    return jsonify(indice.buscar(request.args.get('q', ''), limite))
+
+@app.route('/admin/subidas', methods=['POST'])
+def admin_subida_iniciar():
+    if not session.get('admin'):
+        return jsonify({'error': 'no autorizado'}), 401
+    datos = request.get_json(silent=True) or {}
+    conn = get_db_connection()
+    try:
+        estado = subidas.iniciar(conn, app.config['UPLOAD_FOLDER'], datos.get('nombre'), datos.get('bytes'),
+                                 ALLOWED_EXT, app.config['UPLOAD_MAX_BYTES'], app.config['UPLOAD_CHUNK_BYTES'])
+    except subidas.ErrorSubida as e:
+        return jsonify({'error': str(e)}), e.estado
+    conn.commit()
+    return jsonify(estado), 201
 
+@app.route('/admin/subidas/<subida_id>')
+def admin_subida_estado(subida_id):
+    if not session.get('admin'):
+        return jsonify({'error': 'no autorizado'}), 401
+    try:
+        return jsonify(subidas.estado(get_db_connection(), subida_id))
+    except subidas.ErrorSubida as e:
+        return jsonify({'error': str(e)}), e.estado
 
-@app.route('/api/documentos/titulos')
-def documentos_titulos():
+@app.route('/admin/subidas/<subida_id>/<int:offset>', methods=['PUT'])
+def admin_subida_bloque(subida_id, offset):
+    if not session.get('admin'):
+        return jsonify({'error': 'no autorizado'}), 401
+    crc = request.headers.get('X-Chunk-Crc32')
+    if crc is not None and not crc.isdigit():
+        return jsonify({'error': 'X-Chunk-Crc32 debe ser un entero sin signo'}), 400
     conn = get_db_connection()
-    titulos = conn.execute("SELECT DISTINCT titulo FROM biblioteca_virtual").fetchall()
-    conn.close()
-    return jsonify([titulo['titulo'] for titulo in titulos])
+    try:
+        # el cuerpo se lee directo del stream y se escribe en su offset (ver subidas.escribir_bloque)
+        recibidos = subidas.escribir_bloque(conn, app.config['UPLOAD_FOLDER'], subida_id, offset,
+                                            request.content_length, int(crc) if crc else None, request.stream)
+    except subidas.ErrorSubida as e:
+        conn.rollback()
+        return jsonify({'error': str(e)}), e.estado
+    conn.commit()
+    return jsonify({'recibidos': recibidos})
 
 @app.route('/admin/biblioteca_virtual', methods=['GET', 'POST'])
 def admin_biblioteca_virtual():
@@ -634,32 +1116,28 @@ def admin_biblioteca_virtual():
     if request.method == 'POST':
         titulo = request.form.get('titulo','').strip()
         descripcion = request.form.get('descripcion','').strip()
-        curso = request.form.get('curso','').strip()
-        # admin puede indicar rango: letra_from y letra_to (opcionales)
-        letra_from = (request.form.get('letra_from') or '').strip().upper()[:1] or None
-        letra_to = (request.form.get('letra_to') or '').strip().upper()[:1] or None
-        # también conservar campo letra individual si se usa (compatibilidad)
-        letra = (request.form.get('letra') or '').strip().upper()[:1] or None
-
-        file = request.files.get('file')
-        if file and file.filename != '':
-            filename = save_file(file)
+        # admin puede indicar rango: letra_from y letra_to (opcionales), o una letra individual
+        curso, letra, letra_from, letra_to = facetas.normalizar(
+            request.form.get('curso'), request.form.get('letra'),
+            request.form.get('letra_from'), request.form.get('letra_to'))
+
+        filename = archivo_del_formulario()
+        if filename:
             fecha_subida = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             conn = get_db_connection()
-            conn.execute(
+            cursor = conn.execute(
                 'INSERT INTO biblioteca_virtual (titulo, descripcion, filename, fecha_subida, curso, letra, letra_from, letra_to) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
                 (titulo, descripcion, filename, fecha_subida, curso, letra, letra_from, letra_to)
             )
+            facetas.indexar(conn, cursor.lastrowid, letra, letra_from, letra_to)
             conn.commit()
-            conn.close()
             flash('Documento subido exitosamente.', 'success')
-        else:
+        elif not request.form.get('subida_id'):
             flash('No se seleccionó ningún archivo.', 'error')
         return redirect(url_for('admin_biblioteca_virtual'))
 
     conn = get_db_connection()
     documentos = conn.execute('SELECT * FROM biblioteca_virtual ORDER BY fecha_subida DESC').fetchall()
-    conn.close()
     return render_template('admin_biblioteca_virtual.html', documentos=documentos)
 
 @app.route('/admin/biblioteca_virtual/edit/<int:doc_id>', methods=['GET', 'POST'])
@@ -669,41 +1147,34 @@ def admin_edit_biblioteca_virtual(doc_id):
     conn = get_db_connection()
     doc = conn.execute('SELECT * FROM biblioteca_virtual WHERE id = ?', (doc_id,)).fetchone()
     if not doc:
-        conn.close()
         flash('Documento no encontrado.', 'error')
         return redirect(url_for('admin_biblioteca_virtual'))
 
     if request.method == 'POST':
         titulo = request.form.get('titulo','').strip()
         descripcion = request.form.get('descripcion','').strip()
-        curso = request.form.get('curso','').strip()
-        letra_from = (request.form.get('letra_from') or '').strip().upper()[:1] or None
-        letra_to = (request.form.get('letra_to') or '').strip().upper()[:1] or None
-        letra = (request.form.get('letra') or '').strip().upper()[:1] or None
+        curso, letra, letra_from, letra_to = facetas.normalizar(
+            request.form.get('curso'), request.form.get('letra'),
+            request.form.get('letra_from'), request.form.get('letra_to'))
 
-        file = request.files.get('file')
         filename = doc['filename']
-        if file and file.filename != '':
-            nuevo = save_file(file)
-            if nuevo:
-                try:
-                    old_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    if filename and os.path.exists(old_path):
-                        os.remove(old_path)
-                    static_copy = os.path.join(BASE_DIR, 'static', 'images', filename)
-                    if os.path.exists(static_copy):
-                        os.remove(static_copy)
-                except Exception:
-                    pass
-                filename = nuevo
+        huerfano = None
+        nuevo = archivo_del_formulario()
+        if nuevo is None and request.form.get('subida_id', '').strip():
+            # la subida por bloques no se pudo completar (el motivo ya está en el flash): no se guarda nada
+            conn.rollback()
+            return redirect(url_for('admin_edit_biblioteca_virtual', doc_id=doc_id))
+        if nuevo:
+            huerfano = almacenamiento.liberar(conn, filename)
+            filename = nuevo
         conn.execute('UPDATE biblioteca_virtual SET titulo = ?, descripcion = ?, filename = ?, curso = ?, letra = ?, letra_from = ?, letra_to = ? WHERE id = ?',
                     (titulo, descripcion, filename, curso, letra, letra_from, letra_to, doc_id))
+        facetas.indexar(conn, doc_id, letra, letra_from, letra_to)
         conn.commit()
-        conn.close()
+        delete_files(huerfano)
         flash('Documento actualizado.', 'success')
         return redirect(url_for('admin_biblioteca_virtual'))
 
-    conn.close()
     return render_template('admin_edit_biblioteca_virtual.html', doc=doc)
 
 @app.route('/admin/biblioteca_virtual/delete/<int:doc_id>', methods=['POST'])
@@ -713,34 +1184,69 @@ def admin_delete_biblioteca_virtual(doc_id):
     conn = get_db_connection()
     doc = conn.execute('SELECT * FROM biblioteca_virtual WHERE id = ?', (doc_id,)).fetchone()
     if not doc:
-        conn.close()
         flash('Documento no encontrado.', 'error')
         return redirect(url_for('admin_biblioteca_virtual'))
 
-    try:
-        if doc['filename']:
-            p = os.path.join(app.config['UPLOAD_FOLDER'], doc['filename'])
-            if os.path.exists(p):
-                os.remove(p)
-            static_copy = os.path.join(BASE_DIR, 'static', 'images', doc['filename'])
-            if os.path.exists(static_copy):
-                os.remove(static_copy)
-    except Exception:
-        pass
-
+    huerfanos = [almacenamiento.liberar(conn, doc['filename']),
+                 almacenamiento.liberar(conn, doc['cover_filename'])]
+    # foreign_keys no está activo: las letras no se borran en cascada
+    facetas.quitar(conn, doc_id)
     conn.execute('DELETE FROM biblioteca_virtual WHERE id = ?', (doc_id,))
     conn.commit()
-    conn.close()
+    delete_files(*huerfanos)
     flash('Documento eliminado correctamente.', 'success')
     return redirect(url_for('admin_biblioteca_virtual'))
 
+@app.route('/admin/almacenamiento', methods=['GET', 'POST'])
+def admin_almacenamiento():
+    if not session.get('admin'):
+        return redirect(url_for('admin_login'))
+    # GET solo informa; POST borra los huérfanos
+    simular = request.method == 'GET'
+    resumen = recolectar_subidas(simular=simular)
+    if not simular:
+        flash(f"{resumen['eliminados']} archivo(s) huérfanos eliminados.", 'success')
+    return render_template('admin_almacenamiento.html', resumen=resumen,
+                           gracia_horas=app.config['UPLOADS_GC_GRACE_HOURS'])
+
+@app.route('/admin/reportes/actualizar', methods=['POST'])
+def admin_actualizar_reportes():
+    if not session.get('admin'):
+        return redirect(url_for('admin_login'))
+    if not app.config['REPORT_SNAPSHOT']:
+        flash('No hay copia de reportes configurada (REPORT_SNAPSHOT).', 'error')
+    else:
+        segundos = actualizar_reportes()
+        flash(f'Copia de reportes actualizada en {segundos:.1f} s.', 'success')
+    return redirect(url_for('admin_panel'))
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    offload = app.config['UPLOADS_OFFLOAD']
+    if offload in ('x-accel-redirect', 'x-sendfile'):
+        # el proxy hace la transferencia (incluidos los rangos); el worker queda libre al instante
+        path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        if offload == 'x-accel-redirect':
+            response.headers['X-Accel-Redirect'] = app.config['UPLOADS_ACCEL_PREFIX'] + filename
+        else:
+            response.headers['X-Sendfile'] = os.path.abspath(path)
+    else:
+        # conditional=True responde Range con 206 y If-None-Match/If-Modified-Since con 304
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, conditional=True,
+                                       max_age=app.config['UPLOADS_MAX_AGE'])
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['UPLOADS_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
 
 if __name__ == '__main__':
-    # usar la ruta absoluta configurada
+    # servidor de desarrollo; en producción: gunicorn -c gunicorn.conf.py wsgi:application
+    create_app()
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    crear_tablas()
-    aplicar_migraciones()
+    with app.app_context():
+        preparar_base_de_datos()
     app.run(debug=True)
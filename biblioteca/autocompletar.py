@@ -0,0 +1,98 @@
+"""Índice en memoria para autocompletar títulos, autores y códigos.
+
+Cada worker mantiene, por alcance (``libros`` o ``documentos``), listas
+ordenadas de claves normalizadas (minúsculas, sin tildes) y busca el
+prefijo con ``bisect``. Se indexa el texto completo y también el comienzo
+de cada palabra, así "soledad" encuentra "Cien años de soledad". El índice se
+reconstruye solo cuando cambia su contador de versión (ver ``versiones``):
+el de libros ignora el stock, así los préstamos no lo invalidan.
+"""
+import bisect
+import re
+import threading
+import unicodedata
+
+import versiones
+
+LIMITE_POR_DEFECTO = 10
+LIMITE_MAXIMO = 50
+
+# alcance -> (contador de versión, consulta que devuelve (valor, tipo))
+ALCANCES = {
+    'libros': ('libro_textos', """
+        SELECT titulo, 'titulo' FROM libro
+        UNION SELECT autor, 'autor' FROM libro
+        UNION SELECT codigo_libro, 'codigo' FROM libro WHERE codigo_libro IS NOT NULL
+    """),
+    'documentos': ('biblioteca_virtual', """
+        SELECT DISTINCT titulo, 'titulo' FROM biblioteca_virtual WHERE titulo IS NOT NULL
+    """),
+}
+
+
+def normalizar(texto):
+    """Minúsculas y sin diacríticos: "Educación" -> "educacion"."""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).casefold()
+
+
+class IndicePrefijos:
+    """Dos listas ordenadas consultadas por prefijo con ``bisect``.
+
+    La primera tiene el texto completo normalizado y la segunda el resto del
+    texto a partir de cada palabra; los resultados de la primera van antes.
+    """
+
+    __slots__ = ('_niveles',)
+
+    def __init__(self, filas):
+        completos, palabras = [], []
+        for valor, tipo in filas:
+            if not valor:
+                continue
+            normal = normalizar(valor)
+            completos.append((normal, valor, tipo))
+            for m in re.finditer(r'\W+(?=\w)', normal):
+                palabras.append((normal[m.end():], valor, tipo))
+        self._niveles = []
+        for entradas in (completos, palabras):
+            entradas.sort()
+            self._niveles.append(([e[0] for e in entradas], entradas))
+
+    def buscar(self, prefijo, limite=LIMITE_POR_DEFECTO):
+        prefijo = normalizar(prefijo).strip()
+        if not prefijo:
+            return []
+        vistos = set()
+        resultados = []
+        for claves, entradas in self._niveles:
+            i = bisect.bisect_left(claves, prefijo)
+            while i < len(claves) and claves[i].startswith(prefijo):
+                _, valor, tipo = entradas[i]
+                i += 1
+                if (valor, tipo) in vistos:
+                    continue
+                vistos.add((valor, tipo))
+                resultados.append({'valor': valor, 'tipo': tipo})
+                if len(resultados) >= limite:
+                    return resultados
+        return resultados
+
+
+_indices = {}
+_lock = threading.Lock()
+
+
+def obtener_indice(conn, alcance):
+    """Índice del alcance, reconstruido si su contador cambió desde la última vez."""
+    contador, consulta = ALCANCES[alcance]
+    version = versiones.leer_versiones(conn, (contador,)).get(contador, 0)
+    actual = _indices.get(alcance)
+    if actual is not None and actual[0] == version:
+        return actual[1]
+    with _lock:
+        actual = _indices.get(alcance)
+        if actual is None or actual[0] != version:
+            actual = (version, IndicePrefijos(conn.execute(consulta).fetchall()))
+            _indices[alcance] = actual
+    return actual[1]
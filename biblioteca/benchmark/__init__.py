@@ -0,0 +1,15 @@
+"""Benchmarks de carga con datos sintéticos.
+
+Se ejecutan desde la carpeta ``biblioteca``::
+
+    python -m benchmark.generar /tmp/bench.db              # 50k libros, 2M préstamos...
+    python -m benchmark.generar /tmp/bench.db --escala 0.05
+    python -m benchmark.carga /tmp/bench.db --concurrencia 8 --salida resultados.json
+    python -m benchmark.carga /tmp/bench.db --comparar resultados.json
+
+``generar`` crea una base nueva con el esquema de ``migraciones`` y volúmenes
+realistas (popularidad de los libros con distribución de Zipf); con la misma
+semilla produce siempre los mismos datos. ``carga`` recorre las rutas de
+lectura y escribe un JSON con latencias p50/p95/p99, sentencias SQL por
+petición y RSS pico, para comparar una corrida con la anterior.
+"""
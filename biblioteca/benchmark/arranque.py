@@ -0,0 +1,124 @@
+"""Tiempo hasta la primera respuesta de cada worker, en frío y calentado.
+
+Reproduce lo que hace gunicorn con ``gunicorn.conf.py``: este proceso hace
+de maestro (importa la app y aplica migraciones con ``preparar_esquema``)
+y crea ``--workers`` procesos con ``fork``. Cada worker, desde el fork,
+opcionalmente ejecuta ``calentar()`` y atiende ``--ruta`` dos veces con el
+cliente de pruebas. Modos: ``frio`` (sin calentar), ``caliente`` (calentar
+solo en el worker) y ``precargado`` (plantillas compiladas en el maestro
+antes del fork, como ``on_starting``, más ``calentar`` en el worker). Se
+informan el calentamiento, la primera y la segunda petición y el total
+desde el fork hasta la primera respuesta, por worker y como mediana y
+máximo, en JSON::
+
+    python -m benchmark.arranque /tmp/bench.db --workers 4 --salida arranque.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+
+def _worker(app, calentar, ruta, cookie, escritura):
+    inicio = time.perf_counter()
+    resultado = {'pid': os.getpid(), 'calentamiento_ms': 0.0}
+    if calentar:
+        import app as biblioteca
+        biblioteca.calentar()
+        resultado['calentamiento_ms'] = (time.perf_counter() - inicio) * 1000
+    client = app.test_client()
+    client.set_cookie(*cookie)
+    for clave in ('primera_peticion_ms', 'segunda_peticion_ms'):
+        antes = time.perf_counter()
+        response = client.get(ruta)
+        response.get_data()
+        resultado[clave] = (time.perf_counter() - antes) * 1000
+        resultado['estado'] = response.status_code
+        if clave == 'primera_peticion_ms':
+            resultado['hasta_primera_respuesta_ms'] = (time.perf_counter() - inicio) * 1000
+    os.write(escritura, (json.dumps(resultado) + '\n').encode())
+
+
+def medir(ruta_db, workers=4, ruta='/dashboard', correo='benchmark@ensdbexcelencia.edu.co'):
+    """Devuelve ``{'frio': [...], 'caliente': [...], 'precargado': [...]}`` con una entrada por worker."""
+    import app as biblioteca
+
+    app = biblioteca.create_app({'DATABASE': ruta_db, 'SLOW_QUERY_MS': None,
+                                 'RESPONSE_CACHE_ENABLED': False})
+    inicio = time.perf_counter()
+    biblioteca.preparar_esquema()
+    esquema_ms = (time.perf_counter() - inicio) * 1000
+    cookie = (app.config['SESSION_COOKIE_NAME'],
+              app.session_interface.get_signing_serializer(app).dumps({'correo': correo, 'admin': True}))
+
+    resultados = {'esquema_maestro_ms': round(esquema_ms, 3)}
+    for modo, calentar in (('frio', False), ('caliente', True), ('precargado', True)):
+        if modo == 'precargado':
+            # como on_starting en gunicorn.conf.py: plantillas compiladas antes del fork
+            resultados['plantillas_maestro_ms'] = round(biblioteca.compilar_plantillas() * 1000, 3)
+        lectura, escritura = os.pipe()
+        hijos = []
+        for _ in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    os.close(lectura)
+                    _worker(app, calentar, ruta, cookie, escritura)
+                finally:
+                    os._exit(0)
+            hijos.append(pid)
+        os.close(escritura)
+        with os.fdopen(lectura) as f:
+            filas = [json.loads(linea) for linea in f]
+        for pid in hijos:
+            os.waitpid(pid, 0)
+        resultados[modo] = filas
+    return resultados
+
+
+def _resumen(filas, clave):
+    valores = [f[clave] for f in filas]
+    return {'mediana': round(statistics.median(valores), 3), 'max': round(max(valores), 3)} if valores else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('ruta_db', help='base de datos a usar (p. ej. una generada con benchmark.generar)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--ruta', default='/dashboard', help='ruta de la primera petición')
+    parser.add_argument('--salida', help='archivo JSON para guardar el resultado')
+    args = parser.parse_args(argv)
+    if not hasattr(os, 'fork'):
+        sys.exit('este benchmark necesita os.fork (Linux o macOS)')
+
+    medidas = medir(args.ruta_db, args.workers, args.ruta)
+    resultado = {
+        'meta': {'fecha': datetime.now().isoformat(timespec='seconds'), 'workers': args.workers,
+                 'ruta': args.ruta, 'esquema_maestro_ms': medidas.pop('esquema_maestro_ms'),
+                 'plantillas_maestro_ms': medidas.pop('plantillas_maestro_ms')},
+        'workers': medidas,
+        'resumen': {
+            modo: {clave: _resumen(filas, clave) for clave in
+                   ('calentamiento_ms', 'primera_peticion_ms', 'segunda_peticion_ms', 'hasta_primera_respuesta_ms')}
+            for modo, filas in medidas.items()
+        },
+    }
+    for modo, resumen in resultado['resumen'].items():
+        print(f"{modo:9} calentamiento {resumen['calentamiento_ms']['mediana']:8.2f} ms  "
+              f"primera petición {resumen['primera_peticion_ms']['mediana']:8.2f} ms  "
+              f"segunda {resumen['segunda_peticion_ms']['mediana']:8.2f} ms  "
+              f"fork->primera respuesta {resumen['hasta_primera_respuesta_ms']['mediana']:8.2f} ms "
+              f"(máx {resumen['hasta_primera_respuesta_ms']['max']:.2f})", file=sys.stderr)
+    texto = json.dumps(resultado, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto)
+    else:
+        print(texto)
+
+
+if __name__ == '__main__':
+    main()
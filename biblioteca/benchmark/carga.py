@@ -0,0 +1,266 @@
+"""Driver de carga por ruta sobre una base generada con ``benchmark.generar``.
+
+Cada escenario pide una ruta de lectura ``--peticiones`` veces repartidas en
+``--concurrencia`` hilos, con el cliente de pruebas de Flask o contra un
+servidor WSGI local (``--servidor``). Se informa por ruta la latencia
+p50/p95/p99, las sentencias SQL por petición (de ``metricas``) y el RSS pico
+del proceso; el JSON de salida sirve para comparar corridas con
+``--comparar``. La caché de respuestas queda apagada salvo con ``--cache``,
+para medir el trabajo real de cada vista.
+"""
+import argparse
+import http.client
+import json
+import logging
+import platform
+import random
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+
+# escenario -> (necesita admin, endpoint que lo atiende, url(rng, contexto))
+ESCENARIOS = {
+    'dashboard': (False, 'dashboard', lambda rng, ctx: '/dashboard'),
+    'dashboard_busqueda': (False, 'dashboard',
+                           lambda rng, ctx: f"/dashboard?search={quote(rng.choice(ctx['palabras']))}"),
+    'libro_detalle': (False, 'libro_detalle', lambda rng, ctx: f"/libro/{rng.choice(ctx['libros_populares'])}"),
+    'perfil': (False, 'perfil', lambda rng, ctx: '/perfil'),
+    'biblioteca_virtual': (False, 'biblioteca_virtual', lambda rng, ctx: '/biblioteca_virtual'),
+    'biblioteca_virtual_filtro': (False, 'biblioteca_virtual',
+                                  lambda rng, ctx: f"/biblioteca_virtual?curso={rng.randint(6, 11)}"
+                                                   f"&letra={rng.choice('ABCD')}"),
+    'autocompletar': (False, 'api_autocomplete',
+                      lambda rng, ctx: f"/api/autocomplete?scope=libros&q={quote(rng.choice(ctx['palabras'])[:3])}"),
+    'admin_libros': (True, 'admin_libros', lambda rng, ctx: '/admin_libros'),
+    'admin_prestamos': (True, 'admin_prestamos', lambda rng, ctx: '/admin_prestamos'),
+    'admin_vencidos': (True, 'admin_vencidos', lambda rng, ctx: '/admin_vencidos'),
+    'admin_historial': (True, 'admin_historial', lambda rng, ctx: '/admin_historial'),
+    'admin_historial_busqueda': (True, 'admin_historial',
+                                 lambda rng, ctx: f"/admin_historial?search={quote(rng.choice(ctx['apellidos']))}"),
+    'admin_estadisticas': (True, 'admin_estadisticas', lambda rng, ctx: '/admin_estadisticas'),
+}
+
+
+def _contexto(ruta_db):
+    """Datos de la base para armar URLs realistas: libros y usuarios más activos."""
+    from benchmark import generar
+    conn = sqlite3.connect(f'file:{ruta_db}?mode=ro', uri=True)
+    try:
+        populares = [r[0] for r in conn.execute(
+            'SELECT libro_id FROM libro_stats ORDER BY total_prestamos DESC LIMIT 200')]
+        usuarios = [r[0] for r in conn.execute(
+            'SELECT correo FROM prestamo GROUP BY correo ORDER BY COUNT(*) DESC LIMIT 50')]
+        conteos = {t: conn.execute(f'SELECT COUNT(*) FROM {t}').fetchone()[0] for t in generar.VOLUMENES}
+    finally:
+        conn.close()
+    return {'libros_populares': populares or [1], 'usuarios': usuarios or ['benchmark' + generar.DOMINIO],
+            'palabras': list(generar.PALABRAS), 'apellidos': list(generar.APELLIDOS), 'conteos': conteos}
+
+
+class _ClienteFlask:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, url, cookie):
+        self.client.set_cookie(*cookie)
+        response = self.client.get(url)
+        response.get_data()
+        return response.status_code
+
+
+class _ClienteHTTP:
+    def __init__(self, puerto):
+        self.puerto = puerto
+        self.conexion = None
+
+    def get(self, url, cookie):
+        for intento in range(2):
+            if self.conexion is None:
+                self.conexion = http.client.HTTPConnection('127.0.0.1', self.puerto, timeout=60)
+            try:
+                self.conexion.request('GET', url, headers={'Cookie': '='.join(cookie)})
+                response = self.conexion.getresponse()
+                response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.conexion.close()
+                    self.conexion = None
+                return response.status
+            except (http.client.HTTPException, ConnectionError):
+                self.conexion.close()
+                self.conexion = None
+                if intento:
+                    raise
+
+
+def _percentiles(muestras):
+    if len(muestras) < 2:
+        valor = muestras[0] if muestras else 0.0
+        return valor, valor, valor
+    cortes = statistics.quantiles(muestras, n=100, method='inclusive')
+    return cortes[49], cortes[94], cortes[98]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def ejecutar(ruta_db, escenarios=None, peticiones=200, concurrencia=4, calentamiento=10,
+             servidor=False, cache=False, semilla=1, progreso=print):
+    """Corre los escenarios y devuelve el resultado (dict serializable a JSON)."""
+    import app as aplicacion
+    import metricas
+
+    app = aplicacion.app
+    app.config['DATABASE'] = ruta_db
+    app.config['RESPONSE_CACHE_ENABLED'] = cache
+    metricas.umbral_lento = None
+    with app.app_context():
+        aplicacion.preparar_base_de_datos()
+
+    contexto = _contexto(ruta_db)
+    serializador = app.session_interface.get_signing_serializer(app)
+    nombre_cookie = app.config['SESSION_COOKIE_NAME']
+
+    def cookie(correo, admin):
+        datos = {'correo': correo}
+        if admin:
+            datos['admin'] = True
+        return nombre_cookie, serializador.dumps(datos)
+
+    servidor_wsgi = None
+    if servidor:
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        servidor_wsgi = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=servidor_wsgi.serve_forever, daemon=True).start()
+        fabrica = lambda: _ClienteHTTP(servidor_wsgi.server_port)  # noqa: E731
+    else:
+        fabrica = lambda: _ClienteFlask(app)  # noqa: E731
+
+    locales = threading.local()
+
+    def pedir(url, galleta):
+        if not hasattr(locales, 'cliente'):
+            locales.cliente = fabrica()
+        inicio = time.perf_counter()
+        estado = locales.cliente.get(url, galleta)
+        return time.perf_counter() - inicio, estado
+
+    resultados = {}
+    try:
+        for nombre in escenarios or ESCENARIOS:
+            admin, endpoint, armar_url = ESCENARIOS[nombre]
+            rng = random.Random(f'{semilla}:{nombre}')
+            pedidos = []
+            for _ in range(calentamiento + peticiones):
+                correo = rng.choice(contexto['usuarios'][:10]) if nombre == 'perfil' else contexto['usuarios'][0]
+                pedidos.append((armar_url(rng, contexto), cookie(correo, admin)))
+            with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+                list(pool.map(lambda p: pedir(*p), pedidos[:calentamiento]))
+                suma_sql, cuenta_sql = metricas.sql_sentencias.totales(endpoint)
+                inicio = time.perf_counter()
+                medidas = list(pool.map(lambda p: pedir(*p), pedidos[calentamiento:]))
+                duracion = time.perf_counter() - inicio
+            suma_sql_fin, cuenta_sql_fin = metricas.sql_sentencias.totales(endpoint)
+            latencias = [m[0] * 1000 for m in medidas]
+            p50, p95, p99 = _percentiles(latencias)
+            atendidas = cuenta_sql_fin - cuenta_sql
+            resultados[nombre] = {
+                'endpoint': endpoint,
+                'peticiones': len(medidas),
+                # una redirección (p. ej. al login) también es un error del escenario
+                'errores': sum(1 for _, estado in medidas if estado >= 300),
+                'p50_ms': round(p50, 3),
+                'p95_ms': round(p95, 3),
+                'p99_ms': round(p99, 3),
+                'media_ms': round(statistics.fmean(latencias), 3) if latencias else 0.0,
+                'max_ms': round(max(latencias), 3) if latencias else 0.0,
+                'peticiones_por_segundo': round(len(medidas) / duracion, 1) if duracion else None,
+                'sql_por_peticion': round((suma_sql_fin - suma_sql) / atendidas, 2) if atendidas else None,
+                'rss_pico_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            }
+            r = resultados[nombre]
+            progreso(f"{nombre:28} p50 {r['p50_ms']:9.2f} ms  p95 {r['p95_ms']:9.2f} ms  "
+                     f"p99 {r['p99_ms']:9.2f} ms  sql/pet {r['sql_por_peticion']}  errores {r['errores']}")
+    finally:
+        if servidor_wsgi is not None:
+            servidor_wsgi.shutdown()
+
+    return {
+        'meta': {
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'plataforma': platform.platform(),
+            'modo': 'servidor' if servidor else 'cliente_flask',
+            'concurrencia': concurrencia,
+            'peticiones': peticiones,
+            'calentamiento': calentamiento,
+            'cache_respuestas': cache,
+            'semilla': semilla,
+            'conteos': contexto['conteos'],
+        },
+        'rutas': resultados,
+        'rss_pico_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def comparar(anterior, actual, tolerancia=0.2):
+    """Lista las rutas cuyo p95 empeoró más que ``tolerancia`` (fracción)."""
+    regresiones = []
+    for nombre, r in actual['rutas'].items():
+        previo = anterior.get('rutas', {}).get(nombre)
+        if not previo or not previo.get('p95_ms'):
+            continue
+        cambio = r['p95_ms'] / previo['p95_ms'] - 1
+        print(f"{nombre:28} p95 {previo['p95_ms']:9.2f} -> {r['p95_ms']:9.2f} ms ({cambio:+.0%})  "
+              f"sql/pet {previo.get('sql_por_peticion')} -> {r['sql_por_peticion']}")
+        if cambio > tolerancia:
+            regresiones.append(nombre)
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('ruta_db', help='base generada con benchmark.generar')
+    parser.add_argument('--rutas', nargs='+', choices=sorted(ESCENARIOS), help='escenarios a correr (por defecto, todos)')
+    parser.add_argument('--peticiones', type=int, default=200, help='peticiones medidas por escenario')
+    parser.add_argument('--concurrencia', type=int, default=4)
+    parser.add_argument('--calentamiento', type=int, default=10, help='peticiones previas sin medir')
+    parser.add_argument('--servidor', action='store_true', help='usar un servidor WSGI local en vez del cliente de Flask')
+    parser.add_argument('--cache', action='store_true', help='dejar encendida la caché de respuestas')
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--salida', help='archivo JSON para guardar el resultado')
+    parser.add_argument('--comparar', help='JSON de una corrida anterior')
+    parser.add_argument('--tolerancia', type=float, default=0.2, help='aumento de p95 tolerado al comparar (0.2 = 20 %%)')
+    args = parser.parse_args(argv)
+
+    resultado = ejecutar(args.ruta_db, args.rutas, args.peticiones, args.concurrencia,
+                         args.calentamiento, args.servidor, args.cache, args.semilla)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+    else:
+        json.dump(resultado, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            regresiones = comparar(json.load(f), resultado, args.tolerancia)
+        if regresiones:
+            sys.exit(f"regresiones de p95: {', '.join(regresiones)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Rendimiento de ``circulacion`` con cientos de préstamos y devoluciones simultáneos.
+
+Crea una base WAL temporal con un solo libro de stock ``--stock`` y lanza
+``--hilos`` hilos que, liberados a la vez por una barrera, llaman a
+``circulacion.prestar_libro`` sobre ese libro, cada uno con su conexión del
+pool (mismos pragmas y ``busy_timeout`` que la aplicación); después, otras
+tantas devoluciones simultáneas del mismo préstamo. Informa operaciones por
+segundo y sale con código 1 si algún error escapa del reintento o si los
+préstamos por segundo quedan debajo de ``--minimo``::
+
+    python -m benchmark.concurrencia --hilos 300 --stock 50 --salida concurrencia.json
+
+La exactitud del stock bajo concurrencia la comprueba
+``tests/test_concurrencia.py``.
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import circulacion
+import db
+import migraciones
+
+
+def preparar(ruta, stock):
+    conn = sqlite3.connect(ruta, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    migraciones.migrar(conn)
+    libro_id = conn.execute("INSERT INTO libro (titulo, autor, editorial, stock, seccion, codigo_libro) "
+                            "VALUES ('Libro disputado', 'Autor', 'Editorial', ?, 'Prueba', 'PRU-001')",
+                            (stock,)).lastrowid
+    conn.close()
+    return libro_id
+
+
+def _en_paralelo(pool, hilos, operacion):
+    """Ejecuta ``operacion(conn, i)`` en ``hilos`` hilos a la vez. Devuelve (resultados, errores, segundos)."""
+    barrera = threading.Barrier(hilos + 1)
+    resultados = [None] * hilos
+    errores = []
+    lock = threading.Lock()
+
+    def trabajador(i):
+        conn = pool.acquire()
+        try:
+            barrera.wait()
+            resultados[i] = operacion(conn, i)
+        except Exception as e:  # cualquier error que escape del reintento es una falla
+            with lock:
+                errores.append(f'{type(e).__name__}: {e}')
+        finally:
+            pool.release(conn)
+
+    threads = [threading.Thread(target=trabajador, args=(i,)) for i in range(hilos)]
+    for t in threads:
+        t.start()
+    barrera.wait()
+    inicio = time.perf_counter()
+    for t in threads:
+        t.join()
+    return resultados, errores, time.perf_counter() - inicio
+
+
+def medir(ruta, hilos=300, stock=50):
+    libro_id = preparar(ruta, stock)
+    pool = db.ConnectionPool(ruta, size=hilos + 1, timeout=60)
+    hoy = datetime.now().strftime('%Y-%m-%d')
+
+    prestamos, errores_prestar, segundos_prestar = _en_paralelo(
+        pool, hilos, lambda conn, i: circulacion.prestar_libro(
+            conn, libro_id, f'Estudiante {i}', '10', 'A', 7, f'e{i}@ensdbexcelencia.edu.co', hoy))
+
+    # devoluciones simultáneas de un mismo préstamo (doble clic multiplicado)
+    prestamo_id = next((p for p in prestamos if p is not None), None)
+    devoluciones, errores_devolver, segundos_devolver = ([], [], 0.0)
+    if prestamo_id is not None:
+        devoluciones, errores_devolver, segundos_devolver = _en_paralelo(
+            pool, hilos, lambda conn, i: circulacion.devolver_prestamo(conn, prestamo_id, hoy))
+    pool.close_all()
+
+    return {
+        'prestar': {
+            'hilos': hilos, 'stock_inicial': stock, 'concedidos': sum(p is not None for p in prestamos),
+            'errores': errores_prestar, 'segundos': round(segundos_prestar, 3),
+            'por_segundo': round(hilos / segundos_prestar, 1),
+        },
+        'devolver': {
+            'hilos': hilos if prestamo_id is not None else 0, 'prestamo_id': prestamo_id,
+            'reponen_stock': sum(d is not None for d in devoluciones), 'errores': errores_devolver,
+            'segundos': round(segundos_devolver, 3),
+            'por_segundo': round(hilos / segundos_devolver, 1) if segundos_devolver else None,
+        },
+    }
+
+
+def verificar(resultado, minimo):
+    """Devuelve la lista de fallas (vacía si todo está bien)."""
+    p, d = resultado['prestar'], resultado['devolver']
+    fallas = []
+    for nombre, errores in (('prestar', p['errores']), ('devolver', d['errores'])):
+        if errores:
+            fallas.append(f'{len(errores)} error(es) al {nombre}, p. ej. {errores[0]}')
+    if p['por_segundo'] < minimo:
+        fallas.append(f"{p['por_segundo']} préstamos/s, por debajo del mínimo de {minimo}")
+    return fallas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hilos', type=int, default=300)
+    parser.add_argument('--stock', type=int, default=50)
+    # piso holgado: en 1 CPU da entre 60 y 260/s según cuántos hilos consiguen stock; un
+    # reintento roto que serializa por busy_timeout baja a pocas operaciones por segundo
+    parser.add_argument('--minimo', type=float, default=25.0,
+                        help='operaciones de préstamo por segundo por debajo de las cuales la prueba falla')
+    parser.add_argument('--salida', help='archivo JSON para guardar el resultado')
+    args = parser.parse_args(argv)
+
+    directorio = tempfile.mkdtemp(prefix='concurrencia-')
+    try:
+        resultado = medir(os.path.join(directorio, 'concurrencia.db'), args.hilos, args.stock)
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+    fallas = verificar(resultado, args.minimo)
+    resultado['fallas'] = fallas
+    texto = json.dumps(resultado, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            f.write(texto)
+    else:
+        print(texto)
+    p = resultado['prestar']
+    d = resultado['devolver']
+    print(f"prestar: {p['concedidos']}/{p['hilos']} concedidos, {p['por_segundo']} préstamos/s; "
+          f"devolver: {d['por_segundo']} devoluciones/s", file=sys.stderr)
+    if fallas:
+        sys.exit('FALLA: ' + '; '.join(fallas))
+
+
+if __name__ == '__main__':
+    main()
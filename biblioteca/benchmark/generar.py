@@ -0,0 +1,188 @@
+"""Generador reproducible de una base de datos de prueba a escala.
+
+Volúmenes con ``--escala 1``: 50 000 libros, 2 000 000 préstamos,
+300 000 reseñas y 20 000 documentos de la biblioteca virtual. Los préstamos
+y reseñas se concentran en pocos libros (Zipf, exponente ``ZIPF_S``) y en
+los estudiantes más activos, como en la base real; las fechas cubren
+``AÑOS`` años y los ids crecen con la fecha del préstamo.
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+import agregados
+import estadisticas
+import facetas
+import migraciones
+
+VOLUMENES = {'libro': 50_000, 'prestamo': 2_000_000, 'reseña': 300_000, 'biblioteca_virtual': 20_000}
+ESTUDIANTES = 6_000
+AÑOS = 8
+ZIPF_S = 1.1
+TAMANO_LOTE = 10_000
+DOMINIO = '@ensdbexcelencia.edu.co'
+
+SECCIONES = ('Literatura', 'Ciencias', 'Historia', 'Matemáticas', 'Filosofía', 'Arte',
+             'Misterio', 'Infantil', 'Idiomas', 'Tecnología', 'Geografía', 'Escuela')
+PALABRAS = ('sombra', 'río', 'ciudad', 'memoria', 'viento', 'cielo', 'tiempo', 'noche',
+            'jardín', 'camino', 'mar', 'fuego', 'silencio', 'luz', 'montaña', 'isla',
+            'guerra', 'amor', 'canción', 'historia', 'viaje', 'secreto', 'casa', 'sol',
+            'educación', 'química', 'física', 'álgebra', 'biología', 'lenguaje',
+            'soledad', 'otoño', 'invierno', 'espejo', 'laberinto', 'reino', 'hierro')
+ARTICULOS = ('El', 'La', 'Los', 'Las', 'Un', 'Una', 'Del', 'Sobre la', 'Guía de', 'Manual de')
+NOMBRES = ('Ana', 'Juan', 'María', 'Carlos', 'Lucía', 'Andrés', 'Valentina', 'Santiago',
+           'Camila', 'Diego', 'Sofía', 'Mateo', 'Isabella', 'Samuel', 'Laura', 'Daniel')
+APELLIDOS = ('García', 'Rodríguez', 'Martínez', 'López', 'González', 'Pérez', 'Sánchez',
+             'Ramírez', 'Torres', 'Flórez', 'Vanegas', 'Castro', 'Ortiz', 'Rojas', 'Moreno')
+EDITORIALES = ('Norma', 'Planeta', 'Santillana', 'Alfaguara', 'Anagrama', 'Debolsillo',
+               'Panamericana', 'Siglo XXI', 'Fondo de Cultura Económica', 'Salamandra')
+GRADOS = tuple(str(g) for g in range(6, 12))
+CURSOS = ('A', 'B', 'C', 'D')
+LETRAS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+COMENTARIOS = (None, None, 'Muy bueno.', 'Me gustó bastante.', 'Aburrido al final.',
+               'Lo recomiendo para el colegio.', 'Difícil de leer.', 'Excelente.')
+
+
+def _pesos_zipf(n, s=ZIPF_S):
+    return list(itertools.accumulate(1 / (k ** s) for k in range(1, n + 1)))
+
+
+def _titulo(rng):
+    palabras = rng.sample(PALABRAS, rng.randint(1, 3))
+    return f"{rng.choice(ARTICULOS)} {' y '.join(palabras)}".capitalize()
+
+
+def _persona(rng):
+    return f'{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)}'
+
+
+def _en_lotes(filas, conn, sql):
+    while True:
+        lote = list(itertools.islice(filas, TAMANO_LOTE))
+        if not lote:
+            return
+        conn.executemany(sql, lote)
+
+
+def generar(ruta, escala=1.0, semilla=2024, hoy=None, progreso=print):
+    """Crea ``ruta`` (que no debe existir) y la llena. Devuelve los conteos."""
+    if os.path.exists(ruta):
+        raise FileExistsError(ruta)
+    rng = random.Random(semilla)
+    hoy = hoy or date.today()
+    volumen = {t: max(1, int(n * escala)) for t, n in VOLUMENES.items()}
+    n_estudiantes = max(10, int(ESTUDIANTES * min(1.0, escala * 10)))
+
+    conn = sqlite3.connect(ruta, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    migraciones.migrar(conn)
+
+    # libros en orden de popularidad descendente mezclado con el id
+    ids_libro = list(range(1, volumen['libro'] + 1))
+    rng.shuffle(ids_libro)
+    acumulado_libros = _pesos_zipf(len(ids_libro))
+    estudiantes = [(_persona(rng), f'estudiante{n:05d}{DOMINIO}', rng.choice(GRADOS), rng.choice(CURSOS))
+                   for n in range(n_estudiantes)]
+    acumulado_estudiantes = _pesos_zipf(n_estudiantes, 0.6)
+    inicio = hoy - timedelta(days=365 * AÑOS)
+    dias_total = (hoy - inicio).days
+
+    def elegir_libros(k):
+        return rng.choices(ids_libro, cum_weights=acumulado_libros, k=k)
+
+    conn.execute('BEGIN')
+    t0 = time.perf_counter()
+
+    def libros():
+        for libro_id in range(1, volumen['libro'] + 1):
+            seccion = rng.choice(SECCIONES)
+            stock = 0 if rng.random() < 0.1 else rng.randint(1, 12)
+            yield (libro_id, _titulo(rng), _persona(rng), rng.choice(EDITORIALES), stock, seccion,
+                   f'{seccion[:3].upper()}-{libro_id:03d}')
+    _en_lotes(libros(), conn, 'INSERT INTO libro (id, titulo, autor, editorial, stock, seccion, codigo_libro) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?)')
+    progreso(f"libro: {volumen['libro']} filas ({time.perf_counter() - t0:.1f} s)")
+
+    def prestamos():
+        n = volumen['prestamo']
+        for inicio_lote in range(0, n, TAMANO_LOTE):
+            k = min(TAMANO_LOTE, n - inicio_lote)
+            elegidos = zip(elegir_libros(k),
+                           rng.choices(estudiantes, cum_weights=acumulado_estudiantes, k=k))
+            for i, (libro_id, (nombre, correo, grado, curso)) in enumerate(elegidos, start=inicio_lote):
+                fecha = inicio + timedelta(days=i * dias_total // n)
+                dias = rng.choice((3, 5, 7, 7, 14, 15))
+                vence = fecha + timedelta(days=dias)
+                # los recientes siguen prestados; de los viejos, 1 % quedó sin devolver
+                devuelto = rng.random() < (0.2 if vence >= hoy else 0.99)
+                devolucion = min(hoy, fecha + timedelta(days=rng.randint(0, dias + 5))) if devuelto else None
+                yield (nombre, grado, curso, libro_id, dias, correo, fecha.isoformat(), int(devuelto),
+                       int(devuelto and rng.random() < 0.15),
+                       devolucion.isoformat() if devolucion else None, vence.isoformat())
+    _en_lotes(prestamos(), conn,
+              'INSERT INTO prestamo (nombre, grado, curso, libro_id, dias, correo, fecha_prestamo, devuelto, '
+              'reseñado, fecha_devolucion, fecha_vencimiento) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)')
+    progreso(f"prestamo: {volumen['prestamo']} filas ({time.perf_counter() - t0:.1f} s)")
+
+    def reseñas():
+        for libro_id in elegir_libros(volumen['reseña']):
+            _, correo, _, _ = rng.choice(estudiantes)
+            fecha = inicio + timedelta(days=rng.randrange(dias_total))
+            calificacion = rng.choices((1, 2, 3, 4, 5), weights=(5, 8, 17, 35, 35))[0]
+            yield (libro_id, correo, calificacion, rng.choice(COMENTARIOS), fecha.isoformat())
+    _en_lotes(reseñas(), conn,
+              'INSERT INTO reseña (libro_id, correo, calificacion, comentario, fecha) VALUES (?, ?, ?, ?, ?)')
+    progreso(f"reseña: {volumen['reseña']} filas ({time.perf_counter() - t0:.1f} s)")
+
+    def documentos():
+        for n in range(1, volumen['biblioteca_virtual'] + 1):
+            subida = inicio + timedelta(days=rng.randrange(dias_total), seconds=rng.randrange(86400))
+            if rng.random() < 0.2:
+                desde, hasta = sorted(rng.sample(LETRAS[:8], 2))
+                letra = None
+            else:
+                desde = hasta = None
+                letra = rng.choice(CURSOS)
+            yield (_titulo(rng), f'Material de apoyo {n}', f'documento-{n:05d}.pdf',
+                   rng.choice(GRADOS), letra, desde, hasta, subida.strftime('%Y-%m-%d %H:%M:%S'))
+    _en_lotes(documentos(), conn,
+              'INSERT INTO biblioteca_virtual (titulo, descripcion, filename, curso, letra, letra_from, '
+              'letra_to, fecha_subida) VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+    facetas.normalizar_existentes(conn)
+    progreso(f"biblioteca_virtual: {volumen['biblioteca_virtual']} filas ({time.perf_counter() - t0:.1f} s)")
+
+    agregados.recalcular(conn)
+    estadisticas.recalcular(conn)
+    conn.execute('COMMIT')
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conteos = {t: conn.execute(f'SELECT COUNT(*) FROM {t}').fetchone()[0] for t in VOLUMENES}
+    conn.close()
+    progreso(f'listo en {time.perf_counter() - t0:.1f} s')
+    return conteos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('ruta', help='archivo de la base a crear')
+    parser.add_argument('--escala', type=float, default=1.0, help='multiplica los volúmenes (1 = 2M préstamos)')
+    parser.add_argument('--semilla', type=int, default=2024)
+    parser.add_argument('--hoy', type=date.fromisoformat, default=None,
+                        help='fecha de referencia AAAA-MM-DD (por defecto, hoy)')
+    args = parser.parse_args(argv)
+    try:
+        conteos = generar(args.ruta, args.escala, args.semilla, args.hoy)
+    except FileExistsError:
+        sys.exit(f'{args.ruta} ya existe')
+    for tabla, n in conteos.items():
+        print(f'{tabla}: {n}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""Índices de texto completo (FTS5) para el catálogo y la biblioteca virtual.
+
+Las tablas FTS son de contenido externo: guardan solo el índice y leen el
+texto de ``libro`` / ``biblioteca_virtual``. Los triggers las mantienen al día
+en cada INSERT, DELETE o UPDATE de las columnas indexadas.
+"""
+import re
+
+# máximo de resultados devueltos por una búsqueda
+LIMITE_RESULTADOS = 100
+
+TABLAS_FTS = ('libro_fts', 'biblioteca_virtual_fts')
+
+
+def reconstruir_indices(conn):
+    """Regenera los índices FTS a partir de las tablas de contenido. No hace commit."""
+    for tabla in TABLAS_FTS:
+        conn.execute(f"INSERT INTO {tabla}({tabla}) VALUES ('rebuild')")
+
+
+def consulta_fts(texto):
+    """Convierte lo que escribe el usuario en una consulta FTS5 por prefijos.
+
+    Cada palabra se cita (para que la sintaxis FTS5 no se interprete) y se
+    busca como prefijo; las palabras se combinan con AND. Devuelve ``None``
+    si el texto no tiene ninguna palabra buscable.
+    """
+    palabras = re.findall(r'\w+', texto or '')
+    if not palabras:
+        return None
+    return ' '.join(f'"{p}"*' for p in palabras)
@@ -0,0 +1,141 @@
+"""Caché en memoria de páginas renderizadas para las rutas de lectura más usadas.
+
+La clave es el endpoint con sus argumentos de ruta y los parámetros de la
+consulta normalizados (ordenados, sin valores vacíos). El HTML se guarda sin
+las partes propias de cada usuario: las plantillas muestran el correo con
+``correo_sesion()``, que en las vistas cacheadas escribe una marca en ese
+lugar y se rellena al servir (el resto de la página, p. ej. una búsqueda que
+repite el correo, no se toca). No se cachea ni se sirve desde caché mientras
+haya mensajes flash pendientes.
+
+Cada entrada recuerda las versiones de datos (``versiones``) de sus tablas
+(etiquetas); si una escritura cambió alguna, la entrada se descarta. Así la
+invalidación funciona entre workers sin mensajes adicionales. Además hay un
+LRU acotado y un TTL.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from markupsafe import Markup, escape
+
+import db
+import versiones
+
+MARCA_CORREO = '\x00correo\x00'
+
+
+class CacheRespuestas:
+    def __init__(self, max_entradas=256, ttl=60):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidadas = 0
+        self.expiradas = 0
+        self.desalojadas = 0
+
+    def obtener(self, clave, etiquetas):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            expira, versiones_guardadas, html = entrada
+            if expira < time.monotonic():
+                del self._entradas[clave]
+                self.expiradas += 1
+                self.fallos += 1
+                return None
+            if versiones_guardadas != etiquetas:
+                del self._entradas[clave]
+                self.invalidadas += 1
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return html
+
+    def guardar(self, clave, etiquetas, html):
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl, etiquetas, html)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self.desalojadas += 1
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'entradas': len(self._entradas),
+                'max_entradas': self.max_entradas,
+                'ttl': self.ttl,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'invalidadas': self.invalidadas,
+                'expiradas': self.expiradas,
+                'desalojadas': self.desalojadas,
+                'tasa_aciertos': round(self.aciertos / consultas, 4) if consultas else 0.0,
+            }
+
+
+cache = CacheRespuestas()
+
+
+def init_app(app):
+    cache.max_entradas = app.config.get('RESPONSE_CACHE_SIZE', cache.max_entradas)
+    cache.ttl = app.config.get('RESPONSE_CACHE_TTL', cache.ttl)
+    app.add_template_global(correo_sesion)
+
+
+def correo_sesion():
+    """Correo del usuario para la cabecera; en una vista cacheada, la marca que se rellena al servir."""
+    if g.get('_marca_correo'):
+        return Markup(MARCA_CORREO)
+    return session.get('correo', '')
+
+
+def _rellenar(html, correo):
+    return html.replace(MARCA_CORREO, str(escape(correo)))
+
+
+def _clave():
+    parametros = tuple(sorted((k, v) for k, v in request.args.items(multi=True) if v))
+    return (request.endpoint, tuple(sorted((request.view_args or {}).items())), parametros)
+
+
+def cachear(*tablas):
+    """Decorador: sirve el HTML desde la caché mientras ``tablas`` no cambien."""
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            correo = session.get('correo')
+            if (not current_app.config.get('RESPONSE_CACHE_ENABLED', True)
+                    or not correo or session.get('_flashes')):
+                return vista(*args, **kwargs)
+            etiquetas = tuple(sorted(versiones.leer_versiones(db.get_connection(), tablas).items()))
+            clave = _clave()
+            html = cache.obtener(clave, etiquetas)
+            if html is not None:
+                return _rellenar(html, correo)
+
+            g._marca_correo = True
+            try:
+                response = make_response(vista(*args, **kwargs))
+            finally:
+                g._marca_correo = False
+            if response.is_streamed or response.mimetype != 'text/html':
+                return response
+            html = response.get_data(as_text=True)
+            # solo páginas completas y sin mensajes consumidos durante el render
+            if response.status_code == 200 and not session.get('_flashes'):
+                cache.guardar(clave, etiquetas, html)
+            response.set_data(_rellenar(html, correo))
+            return response
+        return envoltura
+    return decorador
@@ -0,0 +1,159 @@
+"""Foto del catálogo en memoria para las lecturas de ``libro``.
+
+Cada worker guarda una ``Foto`` inmutable del catálogo: los libros como
+tuplas compactas (``Libro``), ya ordenados por sección y título, la lista de
+secciones y el índice por id. La foto no incluye el stock y se reconstruye
+solo cuando cambia el contador ``libro_catalogo`` (INSERT, DELETE o UPDATE
+de las columnas de texto y portada, ver ``versiones``): los préstamos y
+devoluciones no la invalidan.
+
+El stock se superpone en cada petición (``Vista``): ``libro_detalle`` y
+``prestar`` lo leen con una consulta por clave y el listado del dashboard
+usa un mapa ``id -> stock`` (``Existencias``) que se vuelve a leer cuando
+cambia la versión de ``libro``, sin reconstruir la foto.
+"""
+import json
+import threading
+from collections import namedtuple
+
+import versiones
+
+CAMPOS = ('id', 'titulo', 'autor', 'editorial', 'stock', 'seccion', 'codigo_libro', 'portada_filename')
+
+
+class Libro(namedtuple('_Libro', CAMPOS)):
+    """Fila de ``libro`` como tupla; acepta ``libro['titulo']`` igual que ``sqlite3.Row``."""
+
+    __slots__ = ()
+
+    def __getitem__(self, clave):
+        if isinstance(clave, str):
+            return getattr(self, clave)
+        return super().__getitem__(clave)
+
+    def keys(self):
+        return self._fields
+
+
+class Foto:
+    """Catálogo de una versión dada, sin stock; no se modifica después de construido."""
+
+    __slots__ = ('version', 'libros', 'secciones', 'por_seccion', '_por_id')
+
+    def __init__(self, version, filas):
+        self.version = version
+        # mismo orden que "ORDER BY seccion, titulo" del dashboard; stock se completa en Vista
+        self.libros = tuple(Libro(*fila) for fila in filas)
+        por_seccion = {}
+        for libro in self.libros:
+            por_seccion.setdefault(libro.seccion, []).append(libro)
+        self.por_seccion = {seccion: tuple(libros) for seccion, libros in por_seccion.items()}
+        self.secciones = tuple(sorted(self.por_seccion))
+        self._por_id = {libro.id: libro for libro in self.libros}
+
+
+class Existencias:
+    """Stock de todos los libros en una versión de ``libro`` y los disponibles agrupados por sección.
+
+    Con ``anterior`` (misma foto, versión previa) solo se rearman las
+    secciones con algún libro cuyo stock cambió: un préstamo toca una.
+    """
+
+    __slots__ = ('version', 'foto', 'stock', 'por_seccion')
+
+    def __init__(self, version, foto, stock, anterior=None):
+        self.version = version
+        self.foto = foto
+        self.stock = stock
+        if anterior is not None and anterior.foto is foto:
+            por_seccion = dict(anterior.por_seccion)
+            viejo = anterior.stock
+            secciones = {foto._por_id[i].seccion for i, cantidad in stock.items()
+                         if viejo.get(i) != cantidad and i in foto._por_id}
+        else:
+            por_seccion = {}
+            secciones = foto.por_seccion
+        for seccion in secciones:
+            libros = tuple(libro._replace(stock=stock[libro.id]) for libro in foto.por_seccion[seccion]
+                           if stock.get(libro.id, 0) > 0)
+            if libros:
+                por_seccion[seccion] = libros
+            else:
+                por_seccion.pop(seccion, None)
+        self.por_seccion = por_seccion
+
+
+class Vista:
+    """La foto vigente con el stock de esta petición; misma interfaz que usan las rutas."""
+
+    __slots__ = ('foto', 'version', '_conn')
+
+    def __init__(self, foto, version, conn):
+        self.foto = foto
+        self.version = version
+        self._conn = conn
+
+    @property
+    def secciones(self):
+        return self.foto.secciones
+
+    def _stock(self, ids):
+        existencias = _existencias
+        if existencias is not None and existencias.version == self.version and existencias.foto is self.foto:
+            return {i: existencias.stock[i] for i in ids if i in existencias.stock}
+        return dict(self._conn.execute('SELECT id, stock FROM libro WHERE id IN (SELECT value FROM json_each(?))',
+                                       (json.dumps(list(ids)),)).fetchall())
+
+    def libro(self, libro_id):
+        libro = self.foto._por_id.get(libro_id)
+        if libro is None:
+            return None
+        stock = self._stock([libro_id])
+        return libro._replace(stock=stock[libro_id]) if libro_id in stock else None
+
+    def disponibles_por_seccion(self, seccion=None):
+        """``{seccion: (libros con stock...)}``; solo esa sección si se indica."""
+        por_seccion = _obtener_existencias(self).por_seccion
+        if seccion is None:
+            return por_seccion
+        libros = por_seccion.get(seccion)
+        return {seccion: libros} if libros else {}
+
+    def disponibles(self, ids):
+        """Los libros con stock de ``ids``, en ese orden (los que falten se omiten)."""
+        ids = [i for i in ids if i in self.foto._por_id]
+        stock = self._stock(ids)
+        return [self.foto._por_id[i]._replace(stock=stock[i]) for i in ids if stock.get(i, 0) > 0]
+
+
+_foto = None
+_existencias = None
+_lock = threading.Lock()
+
+
+def _obtener_existencias(vista):
+    global _existencias
+    actual = _existencias
+    if actual is not None and actual.version == vista.version and actual.foto is vista.foto:
+        return actual
+    with _lock:
+        if _existencias is None or _existencias.version != vista.version or _existencias.foto is not vista.foto:
+            stock = dict(vista._conn.execute('SELECT id, stock FROM libro').fetchall())
+            _existencias = Existencias(vista.version, vista.foto, stock, _existencias)
+        return _existencias
+
+
+def obtener(conn):
+    """Vista del catálogo: la foto, reconstruida solo si cambió ``libro_catalogo``, más el stock actual."""
+    global _foto
+    leidas = versiones.leer_versiones(conn, ('libro', 'libro_catalogo'))
+    version = leidas.get('libro_catalogo', 0)
+    actual = _foto
+    if actual is None or actual.version != version:
+        with _lock:
+            if _foto is None or _foto.version != version:
+                filas = conn.execute(f"SELECT {', '.join(CAMPOS)} FROM libro "
+                                     "ORDER BY seccion, titulo, id").fetchall()
+                _foto = Foto(version, filas)
+            actual = _foto
+    return Vista(actual, leidas.get('libro', 0), conn)
@@ -0,0 +1,275 @@
+"""Préstamo y devolución seguros ante concurrencia.
+
+Cada operación abre la transacción con ``BEGIN IMMEDIATE`` (toma el lock de
+escritura de entrada, sin la promoción de lectura a escritura que provoca
+deadlocks) y reserva el stock con un único UPDATE condicional, de modo que el
+stock nunca queda negativo aunque un curso entero pida el mismo libro a la
+vez. Si la base sigue ocupada después de ``busy_timeout`` se reintenta unas
+pocas veces con espera exponencial.
+"""
+import json
+import random
+import sqlite3
+import time
+
+import agregados
+import estadisticas
+
+REINTENTOS = 5
+ESPERA_INICIAL = 0.05  # segundos; se duplica en cada reintento
+
+
+def _ocupada(error):
+    codigo = getattr(error, 'sqlite_errorcode', None)
+    if codigo is not None:
+        return codigo & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    mensaje = str(error).lower()
+    return 'locked' in mensaje or 'busy' in mensaje
+
+
+def en_transaccion_inmediata(conn, operacion):
+    """Ejecuta ``operacion(conn)`` dentro de BEGIN IMMEDIATE ... COMMIT.
+
+    Reintenta con backoff cuando SQLite responde SQLITE_BUSY; cualquier otro
+    error deshace la transacción y se propaga.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    espera = ESPERA_INICIAL
+    for intento in range(REINTENTOS + 1):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                resultado = operacion(conn)
+                conn.commit()
+                return resultado
+            except BaseException:
+                conn.rollback()
+                raise
+        except sqlite3.OperationalError as e:
+            if not _ocupada(e) or intento == REINTENTOS:
+                raise
+            time.sleep(espera * (1 + random.random()))
+            espera *= 2
+
+
+def prestar_libro(conn, libro_id, nombre, grado, curso, dias, correo, fecha_prestamo):
+    """Reserva una unidad y registra el préstamo. Devuelve su id, o None sin stock."""
+    def operacion(conn):
+        reservado = conn.execute(
+            'UPDATE libro SET stock = stock - 1 WHERE id = ? AND stock > 0', (libro_id,))
+        if reservado.rowcount == 0:
+            return None
+        cursor = conn.execute(
+            "INSERT INTO prestamo (nombre, grado, curso, libro_id, dias, correo, fecha_prestamo, fecha_vencimiento) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, date(?, '+' || ? || ' days'))",
+            (nombre, grado, curso, libro_id, dias, correo, fecha_prestamo, fecha_prestamo, dias)
+        )
+        agregados.registrar_prestamo(conn, libro_id)
+        estadisticas.registrar_prestamo(conn, cursor.lastrowid)
+        return cursor.lastrowid
+    return en_transaccion_inmediata(conn, operacion)
+
+
+def devolver_prestamo(conn, prestamo_id, fecha_devolucion):
+    """Marca el préstamo como devuelto y repone el stock.
+
+    Devuelve el ``libro_id``, o None si el préstamo no existe o ya estaba
+    devuelto (una segunda devolución no vuelve a sumar stock).
+    """
+    def operacion(conn):
+        prestamo = conn.execute(
+            'SELECT libro_id FROM prestamo WHERE id = ? AND devuelto = 0', (prestamo_id,)).fetchone()
+        if prestamo is None:
+            return None
+        conn.execute('UPDATE prestamo SET devuelto = 1, fecha_devolucion = ? WHERE id = ?',
+                     (fecha_devolucion, prestamo_id))
+        conn.execute('UPDATE libro SET stock = stock + 1 WHERE id = ?', (prestamo['libro_id'],))
+        estadisticas.registrar_devolucion(conn, prestamo_id)
+        return prestamo['libro_id']
+    return en_transaccion_inmediata(conn, operacion)
+
+
+# Operaciones por lote (mostrador): cada entrada es un código de libro escaneado o, con
+# "#", un id (de préstamo al devolver, de libro al prestar). Las listas van como un único
+# parámetro JSON (json_each): el texto de la sentencia no cambia con la cantidad y se
+# reutiliza desde la caché de sentencias.
+
+def leer_entradas(items):
+    """Normaliza las entradas a ``[('id', int) | ('codigo', str)]``, en el orden recibido.
+
+    ``items`` puede ser el texto del lector (una entrada por línea o separadas
+    por comas) o una lista (enteros = ids, ``"#12"`` = id, el resto códigos).
+    """
+    if isinstance(items, str):
+        items = items.replace(',', '\n').splitlines()
+    entradas = []
+    for item in items:
+        if isinstance(item, bool):
+            continue
+        if isinstance(item, int):
+            entradas.append(('id', item))
+            continue
+        texto = str(item).strip()
+        if texto.startswith('#') and texto[1:].strip().isdigit():
+            entradas.append(('id', int(texto[1:])))
+        elif texto:
+            entradas.append(('codigo', texto))
+    return entradas
+
+
+def _listas(entradas):
+    ids = sorted({valor for tipo, valor in entradas if tipo == 'id'})
+    codigos = sorted({valor for tipo, valor in entradas if tipo == 'codigo'})
+    return json.dumps(ids), json.dumps(codigos)
+
+
+def _texto(entrada):
+    tipo, valor = entrada
+    return f'#{valor}' if tipo == 'id' else valor
+
+
+def devolver_lote(conn, entradas, fecha_devolucion, grado=None, curso=None):
+    """Devuelve de una vez los préstamos de ``entradas`` (ver ``leer_entradas``).
+
+    Un código devuelve el préstamo activo más antiguo de ese libro que no haya
+    tomado otra entrada del lote; con ``grado``/``curso`` solo los de ese
+    curso. Todo va en una transacción: una consulta resuelve las entradas,
+    un UPDATE marca los préstamos y otro, agrupado por libro, repone el stock.
+    Devuelve un resultado por entrada, en orden: ``{'entrada', 'estado',
+    'prestamo_id', 'libro_id', 'titulo'}`` con estado ``devuelto``,
+    ``sin_prestamo_activo`` o ``repetido`` (el mismo préstamo, o un código
+    leído más veces que préstamos activos tiene ese libro).
+    """
+    ids, codigos = _listas(entradas)
+    filtro = ''
+    params = []
+    if grado:
+        filtro += ' AND p.grado = ?'
+        params.append(grado)
+    if curso:
+        filtro += ' AND p.curso = ?'
+        params.append(curso)
+
+    def operacion(conn):
+        # por id (clave primaria) y por código (idx_libro_codigo + idx_prestamo_activo_libro)
+        filas = conn.execute(f"""
+            SELECT p.id AS id, p.libro_id AS libro_id, l.titulo AS titulo, NULL AS codigo,
+                   p.fecha_prestamo AS fecha_prestamo
+            FROM prestamo p JOIN libro l ON l.id = p.libro_id
+            WHERE p.id IN (SELECT value FROM json_each(?)) AND p.devuelto = 0{filtro}
+            UNION ALL
+            SELECT p.id, p.libro_id, l.titulo, l.codigo_libro, p.fecha_prestamo
+            FROM libro l JOIN prestamo p ON p.libro_id = l.id AND p.devuelto = 0
+            WHERE l.codigo_libro IN (SELECT value FROM json_each(?)){filtro}
+            ORDER BY fecha_prestamo, id
+        """, [ids, *params, codigos, *params]).fetchall()
+        por_id = {}
+        por_codigo = {}
+        for fila in filas:
+            if fila['codigo'] is None:
+                por_id[fila['id']] = fila
+            else:
+                por_codigo.setdefault(fila['codigo'], []).append(fila)
+
+        tomados = set()
+        resultados = []
+        for entrada in entradas:
+            tipo, valor = entrada
+            if tipo == 'id':
+                fila = por_id.get(valor)
+                estado = 'repetido' if fila is not None and fila['id'] in tomados else None
+            else:
+                candidatos = por_codigo.get(valor, ())
+                fila = next((f for f in candidatos if f['id'] not in tomados), None)
+                estado = 'repetido' if fila is None and candidatos else None
+            if fila is not None and estado is None:
+                tomados.add(fila['id'])
+                estado = 'devuelto'
+            resultados.append({'entrada': _texto(entrada), 'estado': estado or 'sin_prestamo_activo',
+                               'prestamo_id': fila['id'] if fila is not None else None,
+                               'libro_id': fila['libro_id'] if fila is not None else None,
+                               'titulo': fila['titulo'] if fila is not None else None})
+        if tomados:
+            devueltos = json.dumps(sorted(tomados))
+            conn.execute('UPDATE prestamo SET devuelto = 1, fecha_devolucion = ? '
+                         'WHERE id IN (SELECT value FROM json_each(?)) AND devuelto = 0',
+                         (fecha_devolucion, devueltos))
+            conn.execute("""
+                UPDATE libro SET stock = stock + d.n
+                FROM (SELECT libro_id, COUNT(*) AS n FROM prestamo
+                      WHERE id IN (SELECT value FROM json_each(?)) GROUP BY libro_id) AS d
+                WHERE libro.id = d.libro_id
+            """, (devueltos,))
+            estadisticas.registrar_devoluciones(conn, sorted(tomados))
+        return resultados
+    return en_transaccion_inmediata(conn, operacion)
+
+
+def prestar_lote(conn, entradas, nombre, grado, curso, dias, correo, fecha_prestamo):
+    """Presta de una vez una unidad por entrada (préstamo de un curso completo).
+
+    Una consulta resuelve códigos e ids de libro; dentro de la misma
+    transacción se reservan las unidades con un UPDATE agrupado por libro
+    (nunca más que el stock) y se insertan los préstamos con un solo INSERT.
+    Devuelve un resultado por entrada con estado ``prestado``,
+    ``sin_stock`` o ``no_encontrado``.
+    """
+    ids, codigos = _listas(entradas)
+
+    def operacion(conn):
+        libros = conn.execute("""
+            SELECT id, titulo, codigo_libro, stock FROM libro
+            WHERE id IN (SELECT value FROM json_each(?))
+            UNION
+            SELECT id, titulo, codigo_libro, stock FROM libro
+            WHERE codigo_libro IN (SELECT value FROM json_each(?))
+        """, (ids, codigos)).fetchall()
+        por_id = {libro['id']: libro for libro in libros}
+        por_codigo = {}
+        for libro in sorted(libros, key=lambda l: l['id']):
+            por_codigo.setdefault(libro['codigo_libro'], libro)
+
+        disponibles = {libro['id']: libro['stock'] for libro in libros}
+        reservas = {}
+        resultados = []
+        for entrada in entradas:
+            tipo, valor = entrada
+            libro = por_id.get(valor) if tipo == 'id' else por_codigo.get(valor)
+            if libro is None:
+                estado = 'no_encontrado'
+            elif disponibles[libro['id']] > 0:
+                disponibles[libro['id']] -= 1
+                reservas[libro['id']] = reservas.get(libro['id'], 0) + 1
+                estado = 'prestado'
+            else:
+                estado = 'sin_stock'
+            resultados.append({'entrada': _texto(entrada), 'estado': estado, 'prestamo_id': None,
+                               'libro_id': libro['id'] if libro is not None else None,
+                               'titulo': libro['titulo'] if libro is not None else None})
+        if not reservas:
+            return resultados
+        pares = json.dumps(sorted(reservas.items()))
+        conn.execute("""
+            UPDATE libro SET stock = stock - d.n
+            FROM (SELECT json_extract(value, '$[0]') AS libro_id, json_extract(value, '$[1]') AS n
+                  FROM json_each(?)) AS d
+            WHERE libro.id = d.libro_id
+        """, (pares,))
+        unidades = json.dumps([r['libro_id'] for r in resultados if r['estado'] == 'prestado'])
+        creados = conn.execute("""
+            INSERT INTO prestamo (nombre, grado, curso, libro_id, dias, correo, fecha_prestamo, fecha_vencimiento)
+            SELECT ?, ?, ?, value, ?, ?, ?, date(?, '+' || ? || ' days') FROM json_each(?) ORDER BY key
+            RETURNING id, libro_id
+        """, (nombre, grado, curso, dias, correo, fecha_prestamo, fecha_prestamo, dias, unidades)).fetchall()
+        # RETURNING no garantiza orden: se reparten los ids por libro, en orden creciente
+        nuevos = {}
+        for fila in sorted(creados, key=lambda f: f['id']):
+            nuevos.setdefault(fila['libro_id'], []).append(fila['id'])
+        for resultado in resultados:
+            if resultado['estado'] == 'prestado':
+                resultado['prestamo_id'] = nuevos[resultado['libro_id']].pop(0)
+        agregados.registrar_prestamos(conn, reservas)
+        estadisticas.registrar_prestamos(conn, sorted(f['id'] for f in creados))
+        return resultados
+    return en_transaccion_inmediata(conn, operacion)
@@ -0,0 +1,178 @@
+"""Capa de conexión a SQLite.
+
+Mantiene un pool acotado de conexiones por proceso (modo WAL y pragmas
+ajustados) y entrega una sola conexión por contexto de aplicación de Flask.
+La conexión vuelve al pool en ``teardown_appcontext``; las rutas ya no
+necesitan llamar a ``conn.close()``.
+"""
+import os
+import queue
+import sqlite3
+import threading
+
+from flask import current_app, g
+
+import metricas
+
+# pragmas aplicados a cada conexión nueva del pool
+PRAGMAS = (
+    ('journal_mode', 'WAL'),       # lectores no bloquean al escritor y viceversa
+    ('synchronous', 'NORMAL'),     # seguro con WAL, evita fsync en cada commit
+    ('cache_size', -16000),        # ~16 MB de caché de páginas por conexión
+    ('mmap_size', 134217728),      # 128 MB mapeados en memoria
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),        # esperar hasta 5 s antes de "database is locked"
+)
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_STATEMENT_CACHE = 256
+
+
+class ConnectionPool:
+    """Pool acotado de conexiones SQLite reutilizables dentro de un proceso."""
+
+    def __init__(self, database, size=DEFAULT_POOL_SIZE, timeout=10.0,
+                 cached_statements=DEFAULT_STATEMENT_CACHE, adjuntos=None):
+        self.database = database
+        # {alias: ruta} de bases adjuntadas a cada conexión (p. ej. el archivo de préstamos)
+        self.adjuntos = dict(adjuntos or {})
+        self.size = size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # check_same_thread=False: una conexión puede pasar de un hilo a otro
+        # entre peticiones, pero nunca la usan dos hilos a la vez.
+        conn = sqlite3.connect(self.database, timeout=self.timeout,
+                               cached_statements=self.cached_statements,
+                               check_same_thread=False, factory=metricas.ConexionMedida)
+        conn.row_factory = sqlite3.Row
+        # cursor sin medir: abrir una conexión no cuenta como SQL de la petición
+        cursor = conn.cursor(sqlite3.Cursor)
+        for nombre, valor in PRAGMAS:
+            cursor.execute(f'PRAGMA {nombre} = {valor}')
+        for alias, ruta in self.adjuntos.items():
+            cursor.execute('ATTACH DATABASE ? AS ' + alias, (ruta,))
+            cursor.execute(f'PRAGMA {alias}.journal_mode = WAL')
+            cursor.execute(f'PRAGMA {alias}.synchronous = NORMAL')
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                crear = True
+            else:
+                crear = False
+        if crear:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        # pool agotado: esperar a que otra petición devuelva su conexión
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError('pool de conexiones agotado')
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (sqlite3.Error, queue.Full):
+            self._discard(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(app=None):
+    """Devuelve el pool del proceso actual para la app (lo crea si hace falta).
+
+    Tras un ``fork`` el pool heredado se descarta: las conexiones SQLite no
+    deben compartirse entre procesos.
+    """
+    app = app or current_app._get_current_object()
+    database = app.config['DATABASE']
+    with _pools_lock:
+        pool = _pools.get(database)
+        if pool is None or pool.pid != os.getpid():
+            archivo = app.config.get('ARCHIVE_DATABASE')
+            pool = ConnectionPool(database,
+                                  size=app.config.get('DB_POOL_SIZE', DEFAULT_POOL_SIZE),
+                                  adjuntos={'historico': archivo} if archivo else None)
+            _pools[database] = pool
+        return pool
+
+
+def get_connection():
+    """Conexión asociada al contexto de aplicación actual."""
+    if '_db_conn' not in g:
+        g._db_conn = get_pool().acquire()
+    return g._db_conn
+
+
+def conexion_propia(app=None):
+    """Conexión nueva fuera del pool, con los mismos pragmas y adjuntos; la cierra quien la pide.
+
+    Para respuestas que siguen leyendo un cursor después del teardown (las
+    transmitidas con ``stream_template``): la conexión del contexto ya volvió
+    al pool y otra petición podría estar usándola.
+    """
+    return get_pool(app)._connect()
+
+
+def release_connection(exc=None):
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def precalentar(app, conexiones=1):
+    """Abre ``conexiones`` del pool del proceso y carga el esquema en cada una."""
+    pool = get_pool(app)
+    abiertas = []
+    try:
+        for _ in range(min(conexiones, pool.size)):
+            conn = pool.acquire()
+            abiertas.append(conn)
+            # la primera sentencia de cada conexión lee y analiza el esquema
+            conn.cursor(sqlite3.Cursor).execute('SELECT COUNT(*) FROM sqlite_master').fetchall()
+    finally:
+        for conn in abiertas:
+            pool.release(conn)
+
+
+def init_app(app):
+    if 'db' in app.extensions:
+        return
+    app.extensions['db'] = True
+    app.teardown_appcontext(release_connection)
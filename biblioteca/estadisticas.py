@@ -0,0 +1,216 @@
+"""Resúmenes diarios de préstamos para ``admin_estadisticas``.
+
+``estadistica_diaria`` guarda, por día y por dimensión (``total``,
+``seccion`` del libro y ``curso`` = "grado-curso" del estudiante), cuántos
+préstamos empezaron ese día, cuántos de ellos ya se devolvieron (y cuántos a
+tiempo), los días pedidos y los días que duraron realmente. Las devoluciones
+se suman en el día del préstamo: las tasas de un rango de fechas se refieren
+a los préstamos que empezaron en ese rango. ``usuario_stats`` lleva el total
+de préstamos por correo.
+
+``prestar_libro`` y ``devolver_prestamo`` (ver ``circulacion``) actualizan
+estas tablas en su transacción; ``recalcular`` las reconstruye desde
+``prestamo``. Cualquier rango de fechas se responde sumando filas diarias,
+sin recorrer los préstamos.
+"""
+import json
+from datetime import date, timedelta
+
+DIMENSIONES = ('total', 'seccion', 'curso')
+
+# granularidad -> expresión del periodo sobre la fecha (AAAA-MM-DD)
+GRANULARIDADES = {
+    'dia': 'fecha',
+    'semana': "strftime('%Y-W%W', fecha)",
+    'mes': 'substr(fecha, 1, 7)',
+}
+
+RANGO_POR_DEFECTO = 30  # días
+
+_UPSERT = """
+    INSERT INTO estadistica_diaria (dimension, valor, fecha, prestamos, devueltos, a_tiempo,
+                                    dias_pedidos, dias_prestados)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(dimension, fecha, valor) DO UPDATE SET
+        prestamos = prestamos + excluded.prestamos,
+        devueltos = devueltos + excluded.devueltos,
+        a_tiempo = a_tiempo + excluded.a_tiempo,
+        dias_pedidos = dias_pedidos + excluded.dias_pedidos,
+        dias_prestados = dias_prestados + excluded.dias_prestados
+"""
+
+# columnas de un préstamo reducidas a lo que suman los resúmenes
+_SQL_PRESTAMO = """
+    SELECT date(p.fecha_prestamo) AS fecha, l.seccion, p.grado || '-' || p.curso AS curso,
+           p.dias, p.devuelto, p.correo, p.nombre,
+           date(p.fecha_devolucion) <= p.fecha_vencimiento AS a_tiempo,
+           CAST(julianday(p.fecha_devolucion) - julianday(date(p.fecha_prestamo)) AS INTEGER) AS duracion
+    FROM {prestamos} p JOIN libro l ON l.id = p.libro_id
+"""
+
+
+def _sumar(conn, fila, prestamos=0, devueltos=0, a_tiempo=0, dias_pedidos=0, dias_prestados=0):
+    valores = (prestamos, devueltos, a_tiempo, dias_pedidos, dias_prestados)
+    conn.executemany(_UPSERT, [('total', '', fila['fecha'], *valores),
+                               ('seccion', fila['seccion'], fila['fecha'], *valores),
+                               ('curso', fila['curso'], fila['fecha'], *valores)])
+
+
+def registrar_prestamo(conn, prestamo_id):
+    """Suma un préstamo nuevo a su día, sección y curso. No hace commit."""
+    fila = conn.execute(_SQL_PRESTAMO.format(prestamos='prestamo') + ' WHERE p.id = ?', (prestamo_id,)).fetchone()
+    _sumar(conn, fila, prestamos=1, dias_pedidos=fila['dias'])
+    conn.execute("""
+        INSERT INTO usuario_stats (correo, nombre, total_prestamos) VALUES (?, ?, 1)
+        ON CONFLICT(correo) DO UPDATE SET total_prestamos = total_prestamos + 1, nombre = excluded.nombre
+    """, (fila['correo'], fila['nombre']))
+
+
+def registrar_devolucion(conn, prestamo_id):
+    """Suma la devolución (ya guardada en ``prestamo``) al día del préstamo. No hace commit."""
+    fila = conn.execute(_SQL_PRESTAMO.format(prestamos='prestamo') + ' WHERE p.id = ?', (prestamo_id,)).fetchone()
+    _sumar(conn, fila, devueltos=1, a_tiempo=int(bool(fila['a_tiempo'])),
+           dias_prestados=max(fila['duracion'] or 0, 0))
+
+
+def _filas_lote(conn, prestamo_ids):
+    return conn.execute(_SQL_PRESTAMO.format(prestamos='prestamo')
+                        + ' WHERE p.id IN (SELECT value FROM json_each(?))',
+                        (json.dumps(list(prestamo_ids)),)).fetchall()
+
+
+def _sumar_lote(conn, sumas):
+    conn.executemany(_UPSERT, [(*clave, *valores) for clave, valores in sorted(sumas.items())])
+
+
+def _acumular(sumas, fila, valores):
+    for clave in (('total', '', fila['fecha']), ('seccion', fila['seccion'], fila['fecha']),
+                  ('curso', fila['curso'], fila['fecha'])):
+        actual = sumas.get(clave, (0, 0, 0, 0, 0))
+        sumas[clave] = tuple(a + b for a, b in zip(actual, valores))
+
+
+def registrar_prestamos(conn, prestamo_ids):
+    """Como ``registrar_prestamo`` para un lote, con una fila por día, sección y curso. No hace commit."""
+    sumas = {}
+    usuarios = {}
+    for fila in _filas_lote(conn, prestamo_ids):
+        _acumular(sumas, fila, (1, 0, 0, fila['dias'], 0))
+        nombre, total = usuarios.get(fila['correo'], (fila['nombre'], 0))
+        usuarios[fila['correo']] = (fila['nombre'], total + 1)
+    _sumar_lote(conn, sumas)
+    conn.executemany("""
+        INSERT INTO usuario_stats (correo, nombre, total_prestamos) VALUES (?, ?, ?)
+        ON CONFLICT(correo) DO UPDATE SET total_prestamos = total_prestamos + excluded.total_prestamos,
+                                          nombre = excluded.nombre
+    """, [(correo, nombre, total) for correo, (nombre, total) in sorted(usuarios.items())])
+
+
+def registrar_devoluciones(conn, prestamo_ids):
+    """Como ``registrar_devolucion`` para un lote ya guardado en ``prestamo``. No hace commit."""
+    sumas = {}
+    for fila in _filas_lote(conn, prestamo_ids):
+        _acumular(sumas, fila, (0, 1, int(bool(fila['a_tiempo'])), 0, max(fila['duracion'] or 0, 0)))
+    _sumar_lote(conn, sumas)
+
+
+def recalcular(conn, prestamos='prestamo'):
+    """Reconstruye los resúmenes desde ``prestamo`` (backfill). No hace commit.
+
+    ``prestamos`` puede ser ``historico.fuente(conn)`` para incluir los archivados.
+    """
+    conn.execute('DELETE FROM estadistica_diaria')
+    conn.execute('DELETE FROM usuario_stats')
+    conn.execute(f"""
+        WITH base AS MATERIALIZED (
+            SELECT fecha, seccion, curso, COUNT(*) AS prestamos,
+                   SUM(devuelto) AS devueltos,
+                   SUM(devuelto AND COALESCE(a_tiempo, 0)) AS a_tiempo,
+                   SUM(dias) AS dias_pedidos,
+                   SUM(CASE WHEN devuelto THEN MAX(COALESCE(duracion, 0), 0) ELSE 0 END) AS dias_prestados
+            FROM ({_SQL_PRESTAMO.format(prestamos=prestamos)})
+            GROUP BY fecha, seccion, curso
+        )
+        INSERT INTO estadistica_diaria (dimension, valor, fecha, prestamos, devueltos, a_tiempo,
+                                        dias_pedidos, dias_prestados)
+        SELECT 'total', '', fecha, SUM(prestamos), SUM(devueltos), SUM(a_tiempo),
+               SUM(dias_pedidos), SUM(dias_prestados) FROM base GROUP BY fecha
+        UNION ALL
+        SELECT 'seccion', seccion, fecha, SUM(prestamos), SUM(devueltos), SUM(a_tiempo),
+               SUM(dias_pedidos), SUM(dias_prestados) FROM base GROUP BY fecha, seccion
+        UNION ALL
+        SELECT 'curso', curso, fecha, SUM(prestamos), SUM(devueltos), SUM(a_tiempo),
+               SUM(dias_pedidos), SUM(dias_prestados) FROM base GROUP BY fecha, curso
+    """)
+    # nombre del préstamo más reciente de cada correo
+    conn.execute(f"""
+        INSERT INTO usuario_stats (correo, nombre, total_prestamos)
+        SELECT correo, nombre, total FROM (
+            SELECT correo, nombre, MAX(id), COUNT(*) AS total FROM {prestamos} GROUP BY correo)
+    """)
+
+
+def rango(desde, hasta, hoy=None):
+    """Interpreta ``desde``/``hasta`` (AAAA-MM-DD); por defecto, los últimos 30 días."""
+    hoy = hoy or date.today()
+    try:
+        fin = date.fromisoformat(hasta) if hasta else hoy
+    except ValueError:
+        fin = hoy
+    try:
+        inicio = date.fromisoformat(desde) if desde else fin - timedelta(days=RANGO_POR_DEFECTO - 1)
+    except ValueError:
+        inicio = fin - timedelta(days=RANGO_POR_DEFECTO - 1)
+    if inicio > fin:
+        inicio, fin = fin, inicio
+    return inicio.isoformat(), fin.isoformat()
+
+
+def _metricas(fila):
+    prestamos, devueltos = fila['prestamos'] or 0, fila['devueltos'] or 0
+    return {
+        'prestamos': prestamos,
+        'devueltos': devueltos,
+        'tasa_devolucion': round(100 * devueltos / prestamos, 1) if prestamos else None,
+        'tasa_a_tiempo': round(100 * (fila['a_tiempo'] or 0) / devueltos, 1) if devueltos else None,
+        'duracion_promedio': round((fila['dias_prestados'] or 0) / devueltos, 1) if devueltos else None,
+        'dias_pedidos_promedio': round((fila['dias_pedidos'] or 0) / prestamos, 1) if prestamos else None,
+    }
+
+
+_SUMAS = ('SUM(prestamos) AS prestamos, SUM(devueltos) AS devueltos, SUM(a_tiempo) AS a_tiempo, '
+          'SUM(dias_pedidos) AS dias_pedidos, SUM(dias_prestados) AS dias_prestados')
+
+
+def resumen(conn, desde, hasta):
+    fila = conn.execute(f"SELECT {_SUMAS} FROM estadistica_diaria "
+                        "WHERE dimension = 'total' AND fecha BETWEEN ? AND ?", (desde, hasta)).fetchone()
+    return _metricas(fila)
+
+
+def serie(conn, desde, hasta, granularidad='dia'):
+    """Préstamos por periodo (día, semana o mes) dentro del rango."""
+    periodo = GRANULARIDADES[granularidad]
+    filas = conn.execute(f"""
+        SELECT {periodo} AS periodo, {_SUMAS} FROM estadistica_diaria
+        WHERE dimension = 'total' AND fecha BETWEEN ? AND ?
+        GROUP BY periodo ORDER BY periodo
+    """, (desde, hasta)).fetchall()
+    return [dict(_metricas(f), periodo=f['periodo']) for f in filas]
+
+
+def por_dimension(conn, dimension, desde, hasta):
+    """Métricas por sección o por curso dentro del rango, de mayor a menor préstamos."""
+    if dimension not in DIMENSIONES:
+        raise ValueError(dimension)
+    filas = conn.execute(f"""
+        SELECT valor, {_SUMAS} FROM estadistica_diaria
+        WHERE dimension = ? AND fecha BETWEEN ? AND ?
+        GROUP BY valor ORDER BY prestamos DESC, valor
+    """, (dimension, desde, hasta)).fetchall()
+    return [dict(_metricas(f), valor=f['valor']) for f in filas]
+
+
+def total_prestamos(conn):
+    return conn.execute("SELECT COALESCE(SUM(prestamos), 0) FROM estadistica_diaria "
+                        "WHERE dimension = 'total'").fetchone()[0]
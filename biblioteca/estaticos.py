@@ -0,0 +1,158 @@
+"""Archivos estáticos con huella de contenido y variantes precomprimidas.
+
+``construir`` copia cada archivo de ``static/`` a ``STATIC_BUILD_FOLDER``
+con el hash de su contenido en el nombre (``css/styles.3fa2b1c4d5e6.css``)
+y escribe al lado las variantes comprimidas que salgan más chicas: ``.gz``
+y ``.br`` (o ``.zz`` con zlib/deflate si el paquete ``brotli`` no está
+instalado). El resultado queda en ``manifest.json``::
+
+    flask construir-estaticos
+
+Al arrancar, ``init_app`` lee el manifiesto una vez. ``url_for('static',
+filename='css/styles.css')`` devuelve entonces el nombre con huella, y la
+vista ``static`` lo sirve con la mejor codificación que acepte el navegador
+(``Accept-Encoding``), ``Vary: Accept-Encoding`` y ``Cache-Control:
+immutable`` por un año: si el contenido cambia, cambia el nombre. Sin
+manifiesto (o con ``STATIC_FINGERPRINT = False``) todo sigue como antes.
+Después de editar un archivo de ``static/`` hay que volver a construir.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import zlib
+
+from flask import current_app, request, send_file
+
+try:
+    import brotli
+except ImportError:  # opcional: sin brotli se genera deflate
+    brotli = None
+
+MANIFIESTO = 'manifest.json'
+UN_ANIO = 365 * 24 * 3600
+LARGO_HUELLA = 12
+
+# vale la pena comprimir texto; imágenes y PDF ya vienen comprimidos
+COMPRIMIBLES = {'.css', '.js', '.svg', '.html', '.txt', '.json', '.xml', '.ico', '.map'}
+
+# codificación -> (extensión, compresor), en orden de preferencia al servir
+CODIFICACIONES = {}
+if brotli is not None:
+    CODIFICACIONES['br'] = ('.br', lambda datos: brotli.compress(datos, quality=11))
+CODIFICACIONES['gzip'] = ('.gz', lambda datos: gzip.compress(datos, 9, mtime=0))
+if brotli is None:
+    CODIFICACIONES['deflate'] = ('.zz', lambda datos: zlib.compress(datos, 9))
+
+
+def nombre_con_huella(ruta, datos):
+    base, ext = os.path.splitext(ruta)
+    return f'{base}.{hashlib.sha256(datos).hexdigest()[:LARGO_HUELLA]}{ext}'
+
+
+def _escribir(ruta, datos):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = ruta + '.tmp'
+    with open(temporal, 'wb') as f:
+        f.write(datos)
+    os.replace(temporal, ruta)
+
+
+def construir(origen, destino):
+    """Genera los archivos con huella, sus variantes y el manifiesto.
+
+    Devuelve el manifiesto: ``{ruta original: {'archivo', 'bytes',
+    'codificaciones': {codificación: bytes}}}``. Los archivos de versiones
+    anteriores no se borran (workers viejos pueden seguir pidiéndolos).
+    """
+    manifiesto = {}
+    for carpeta, _, archivos in os.walk(origen):
+        for nombre in sorted(archivos):
+            completo = os.path.join(carpeta, nombre)
+            ruta = os.path.relpath(completo, origen).replace(os.sep, '/')
+            with open(completo, 'rb') as f:
+                datos = f.read()
+            archivo = nombre_con_huella(ruta, datos)
+            entrada = {'archivo': archivo, 'bytes': len(datos), 'codificaciones': {}}
+            _escribir(os.path.join(destino, archivo), datos)
+            if os.path.splitext(nombre)[1].lower() in COMPRIMIBLES:
+                for codificacion, (ext, comprimir) in CODIFICACIONES.items():
+                    comprimido = comprimir(datos)
+                    if len(comprimido) < len(datos):
+                        _escribir(os.path.join(destino, archivo + ext), comprimido)
+                        entrada['codificaciones'][codificacion] = len(comprimido)
+            manifiesto[ruta] = entrada
+    _escribir(os.path.join(destino, MANIFIESTO),
+              json.dumps(manifiesto, indent=2, sort_keys=True).encode('utf-8'))
+    return manifiesto
+
+
+class Manifiesto:
+    def __init__(self, destino, entradas):
+        self.destino = destino
+        self.urls = {ruta: e['archivo'] for ruta, e in entradas.items()}
+        # nombre con huella -> (ruta original, codificaciones disponibles en orden de preferencia)
+        self.archivos = {e['archivo']: (ruta, [c for c in CODIFICACIONES if c in e['codificaciones']])
+                         for ruta, e in entradas.items()}
+
+    @classmethod
+    def cargar(cls, destino):
+        try:
+            with open(os.path.join(destino, MANIFIESTO), encoding='utf-8') as f:
+                return cls(destino, json.load(f))
+        except FileNotFoundError:
+            return None
+
+
+def _manifiesto():
+    return current_app.extensions.get('estaticos')
+
+
+def _url_con_huella(endpoint, values):
+    if endpoint != 'static' or 'filename' not in values:
+        return
+    manifiesto = _manifiesto()
+    if manifiesto is not None:
+        values['filename'] = manifiesto.urls.get(values['filename'], values['filename'])
+
+
+def _elegir_codificacion(disponibles):
+    aceptadas = request.accept_encodings
+    for codificacion in disponibles:
+        if aceptadas[codificacion]:
+            return codificacion
+    return None
+
+
+def init_app(app):
+    """Carga el manifiesto (si existe) y engancha ``url_for('static')`` y la vista ``static``."""
+    app.extensions['estaticos'] = (Manifiesto.cargar(app.config['STATIC_BUILD_FOLDER'])
+                                   if app.config.get('STATIC_FINGERPRINT', True) else None)
+    if app.extensions.get('estaticos_vista'):
+        return
+    vista_original = app.view_functions['static']
+    app.extensions['estaticos_vista'] = vista_original
+
+    def static(filename):
+        manifiesto = _manifiesto()
+        encontrado = manifiesto.archivos.get(filename) if manifiesto is not None else None
+        if encontrado is None:
+            return vista_original(filename=filename)
+        ruta, disponibles = encontrado
+        codificacion = _elegir_codificacion(disponibles)
+        path = os.path.join(manifiesto.destino, filename)
+        if codificacion:
+            path += CODIFICACIONES[codificacion][0]
+        response = send_file(path, mimetype=mimetypes.guess_type(ruta)[0] or 'application/octet-stream',
+                             conditional=True, max_age=UN_ANIO)
+        if codificacion:
+            response.headers['Content-Encoding'] = codificacion
+        if disponibles:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    app.view_functions['static'] = static
+    app.url_defaults(_url_con_huella)
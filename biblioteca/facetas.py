@@ -0,0 +1,124 @@
+"""Curso y letra de los documentos de la biblioteca virtual, y sus facetas.
+
+La letra y el rango (``letra_from``–``letra_to``) se normalizan al guardar
+(mayúscula, sin tildes, solo letras del alfabeto) y cada documento se
+expande en ``biblioteca_virtual_letra``: una fila por letra que cubre. Así
+el filtro por letra es una búsqueda en la clave primaria de esa tabla en
+lugar de comparar ``UPPER(...)`` fila por fila.
+
+``contar`` devuelve cuántos documentos hay por curso y por letra (cada
+faceta restringida por el filtro de la otra) en una sola consulta; el
+resultado se guarda en memoria hasta que cambia la versión de
+``biblioteca_virtual`` (subida, edición o borrado, ver ``versiones``).
+"""
+import threading
+import unicodedata
+
+import versiones
+
+ALFABETO = 'ABCDEFGHIJKLMNÑOPQRSTUVWXYZ'
+
+
+def normalizar_letra(valor):
+    """``' á '`` -> ``'A'``; ``'ñ'`` -> ``'Ñ'``; None si no es una letra."""
+    letra = (valor or '').strip()[:1].upper()
+    if letra != 'Ñ':
+        letra = unicodedata.normalize('NFKD', letra)[:1]
+    return letra if letra and letra in ALFABETO else None
+
+
+def normalizar_curso(valor):
+    return ' '.join((valor or '').split()).upper()
+
+
+def normalizar(curso, letra, letra_from, letra_to):
+    """Valores tal como se guardan: ``(curso, letra, letra_from, letra_to)``.
+
+    Un rango necesita ambos extremos (se ordenan si vienen invertidos); si
+    solo llega uno, cuenta como letra individual.
+    """
+    letra = normalizar_letra(letra)
+    desde, hasta = normalizar_letra(letra_from), normalizar_letra(letra_to)
+    if desde and hasta:
+        if ALFABETO.index(desde) > ALFABETO.index(hasta):
+            desde, hasta = hasta, desde
+    else:
+        letra = letra or desde or hasta
+        desde = hasta = None
+    return normalizar_curso(curso), letra, desde, hasta
+
+
+def letras_cubiertas(letra, letra_from, letra_to):
+    letras = set()
+    if letra:
+        letras.add(letra)
+    if letra_from and letra_to:
+        letras.update(ALFABETO[ALFABETO.index(letra_from):ALFABETO.index(letra_to) + 1])
+    return sorted(letras, key=ALFABETO.index)
+
+
+def indexar(conn, documento_id, letra, letra_from, letra_to):
+    """Reemplaza las letras del documento en la tabla de búsqueda. No hace commit."""
+    conn.execute('DELETE FROM biblioteca_virtual_letra WHERE documento_id = ?', (documento_id,))
+    conn.executemany('INSERT INTO biblioteca_virtual_letra (letra, documento_id) VALUES (?, ?)',
+                     [(l, documento_id) for l in letras_cubiertas(letra, letra_from, letra_to)])
+
+
+def quitar(conn, documento_id):
+    """Borra las letras de un documento eliminado. No hace commit."""
+    conn.execute('DELETE FROM biblioteca_virtual_letra WHERE documento_id = ?', (documento_id,))
+
+
+def normalizar_existentes(conn):
+    """Normaliza las filas guardadas y reconstruye la tabla de letras. No hace commit."""
+    filas = conn.execute('SELECT id, curso, letra, letra_from, letra_to FROM biblioteca_virtual').fetchall()
+    conn.execute('DELETE FROM biblioteca_virtual_letra')
+    for documento_id, *valores in filas:
+        curso, letra, desde, hasta = normalizar(*valores)
+        if (curso, letra, desde, hasta) != tuple(valores):
+            conn.execute('UPDATE biblioteca_virtual SET curso = ?, letra = ?, letra_from = ?, letra_to = ? '
+                         'WHERE id = ?', (curso, letra, desde, hasta, documento_id))
+        indexar(conn, documento_id, letra, desde, hasta)
+
+
+_conteos = {}
+_lock = threading.Lock()
+
+
+def contar(conn, curso='', letra=''):
+    """``{'cursos': [(curso, n)], 'letras': [(letra, n)]}`` en orden de curso y alfabeto.
+
+    Los conteos por curso respetan el filtro de ``letra`` y los conteos por
+    letra respetan el de ``curso``.
+    """
+    version = versiones.leer_versiones(conn, ('biblioteca_virtual',)).get('biblioteca_virtual', 0)
+    clave = (curso, letra)
+    with _lock:
+        if _conteos.get('version') != version:
+            _conteos.clear()
+            _conteos['version'] = version
+        elif clave in _conteos:
+            return _conteos[clave]
+
+    sql_cursos = "SELECT 'curso', bv.curso, COUNT(*) FROM biblioteca_virtual bv"
+    sql_letras = "SELECT 'letra', l.letra, COUNT(*) FROM biblioteca_virtual_letra l"
+    params = []
+    if letra:
+        sql_cursos += " JOIN biblioteca_virtual_letra l ON l.documento_id = bv.id AND l.letra = ?"
+        params.append(letra)
+    sql_cursos += " WHERE bv.curso IS NOT NULL AND bv.curso <> '' GROUP BY bv.curso"
+    if curso:
+        sql_letras += " JOIN biblioteca_virtual bv ON bv.id = l.documento_id AND bv.curso = ?"
+        params.append(curso)
+    sql_letras += " GROUP BY l.letra"
+
+    resultado = {'cursos': [], 'letras': []}
+    for faceta, valor, total in conn.execute(f'{sql_cursos} UNION ALL {sql_letras}', params):
+        resultado['cursos' if faceta == 'curso' else 'letras'].append((valor, total))
+    # cursos numéricos en orden numérico ("6" antes que "10")
+    resultado['cursos'].sort(key=lambda c: (not c[0].isdigit(), int(c[0]) if c[0].isdigit() else 0, c[0]))
+    resultado['letras'].sort(key=lambda l: ALFABETO.index(l[0]))
+    with _lock:
+        if _conteos.get('version') == version:
+            _conteos[clave] = resultado
+    return resultado
@@ -0,0 +1,39 @@
+"""Configuración de gunicorn para la biblioteca.
+
+- ``preload_app``: la aplicación se importa una sola vez en el maestro y los
+  workers la heredan ya cargada.
+- ``on_starting``: el maestro aplica las migraciones antes de crear workers
+  (y cierra sus conexiones: no deben cruzar el fork) y compila las
+  plantillas, que los workers heredan.
+- ``post_fork``: cada worker abre sus conexiones (y compila cualquier
+  plantilla que faltara) antes de aceptar peticiones.
+
+Variables: BIBLIOTECA_BIND, WEB_CONCURRENCY (procesos), BIBLIOTECA_THREADS
+(hilos por worker) y las BIBLIOTECA_* de la aplicación.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIBLIOTECA_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('BIBLIOTECA_THREADS', 4))
+worker_class = 'gthread' if threads > 1 else 'sync'
+preload_app = True
+timeout = 60
+
+
+def on_starting(server):
+    import app as biblioteca
+    biblioteca.preparar_esquema()
+    segundos = biblioteca.compilar_plantillas()
+    server.log.info('plantillas compiladas en el maestro en %.1f ms', segundos * 1000)
+
+
+def post_fork(server, worker):
+    import app as biblioteca
+    # una conexión por hilo del worker (calentar no pasa del tamaño del pool)
+    config = biblioteca.app.config
+    config['DB_POOL_WARM'] = max(config.get('DB_POOL_WARM', 1), threads)
+    tiempos = biblioteca.calentar()
+    server.log.info('worker %s caliente: conexiones %.1f ms, plantillas %.1f ms', worker.pid,
+                    tiempos['conexiones'] * 1000, tiempos['plantillas'] * 1000)
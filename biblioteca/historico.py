@@ -0,0 +1,135 @@
+"""Préstamos devueltos antiguos en una base SQLite aparte.
+
+Con ``ARCHIVE_DATABASE`` configurada, cada conexión del pool adjunta ese
+archivo como ``historico`` (``ATTACH DATABASE``, ver ``db``). ``archivar``
+mueve los préstamos devueltos antes de una fecha de corte de
+``main.prestamo`` a ``historico.prestamo`` en lotes cortos, cada uno en su
+propia transacción BEGIN IMMEDIATE: el candado de escritura se suelta entre
+lotes y las peticiones siguen atendiéndose mientras se archiva.
+
+Es reanudable: un lote copia con ``INSERT OR IGNORE`` y después borra de
+``main``; si el proceso se corta, la siguiente corrida sigue por los que
+quedan. Con WAL una transacción sobre dos bases es atómica en cada base
+pero no entre ambas, por eso la copia no falla si la fila ya estaba
+archivada.
+
+Las consultas de préstamos activos y del historial reciente solo leen
+``main.prestamo``. Las que piden datos viejos usan ``union`` o ``fuente``,
+que agregan ``historico.prestamo`` con ``UNION ALL``. Los ids no chocan:
+``prestamo.id`` es AUTOINCREMENT y nunca se reutiliza.
+"""
+import time
+
+import circulacion
+import migraciones
+
+ALIAS = 'historico'
+
+# columnas copiadas, en un orden fijo (no depende del orden físico de main.prestamo)
+COLUMNAS = ('id', 'nombre', 'grado', 'curso', 'libro_id', 'dias', 'correo', 'fecha_prestamo',
+            'devuelto', 'reseñado', 'fecha_devolucion', 'fecha_vencimiento')
+
+# sin FOREIGN KEY a libro: no puede cruzar de una base a otra
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {ALIAS}.prestamo (
+    id INTEGER PRIMARY KEY,
+    nombre TEXT NOT NULL,
+    grado TEXT NOT NULL,
+    curso TEXT NOT NULL,
+    libro_id INTEGER NOT NULL,
+    dias INTEGER NOT NULL,
+    correo TEXT NOT NULL,
+    fecha_prestamo TEXT NOT NULL,
+    devuelto INTEGER DEFAULT 0,
+    reseñado INTEGER DEFAULT 0,
+    fecha_devolucion TEXT,
+    fecha_vencimiento TEXT
+);
+CREATE INDEX IF NOT EXISTS {ALIAS}.idx_prestamo_correo_fecha ON prestamo(correo, fecha_prestamo);
+CREATE INDEX IF NOT EXISTS {ALIAS}.idx_prestamo_fecha ON prestamo(fecha_prestamo, id);
+CREATE INDEX IF NOT EXISTS {ALIAS}.idx_prestamo_libro ON prestamo(libro_id);
+"""
+
+LOTE = 500
+PAUSA = 0.05  # segundos entre lotes para que pasen las escrituras de las peticiones
+
+
+def adjuntado(conn):
+    return any(fila[1] == ALIAS for fila in conn.execute('PRAGMA database_list'))
+
+
+def preparar(conn):
+    """Crea las tablas del archivo si está adjuntado. No hace commit."""
+    if adjuntado(conn):
+        migraciones.ejecutar_script(conn, SCHEMA)
+
+
+def _parte(sql, tabla, archivado):
+    return sql.replace('{prestamo}', tabla).replace('{archivado}', archivado)
+
+
+def union(sql, incluir=True):
+    """``sql`` sobre ``main.prestamo`` y, si ``incluir``, también sobre el archivo con ``UNION ALL``.
+
+    En ``sql``, ``{prestamo}`` es la tabla y ``{archivado}`` vale 0 o 1
+    según la parte. Devuelve el SQL y cuántas veces hay que repetir los
+    parámetros. Un ``ORDER BY`` agregado después debe usar nombres de
+    columnas del resultado.
+    """
+    if not incluir:
+        return _parte(sql, 'main.prestamo', '0'), 1
+    return (_parte(sql, 'main.prestamo', '0') + '\nUNION ALL\n'
+            + _parte(sql, f'{ALIAS}.prestamo', '1')), 2
+
+
+def fuente(conn):
+    """Expresión de tabla con todos los préstamos (activos y archivados) para usar en un FROM."""
+    if not adjuntado(conn):
+        return 'prestamo'
+    columnas = ', '.join(COLUMNAS)
+    return (f'(SELECT {columnas} FROM main.prestamo '
+            f'UNION ALL SELECT {columnas} FROM {ALIAS}.prestamo)')
+
+
+def pendientes(conn, antes_de):
+    return conn.execute('SELECT COUNT(*) FROM main.prestamo WHERE devuelto = 1 AND fecha_prestamo < ? '
+                        'AND fecha_devolucion < ?', (antes_de, antes_de)).fetchone()[0]
+
+
+def archivar(conn, antes_de, lote=LOTE, pausa=PAUSA, progreso=None):
+    """Mueve al archivo los préstamos devueltos antes de ``antes_de`` (AAAA-MM-DD).
+
+    Cada lote es una transacción corta; ``progreso(movidos)`` se llama
+    después de cada una. Devuelve la cantidad movida.
+    """
+    if not adjuntado(conn):
+        raise RuntimeError('ARCHIVE_DATABASE no está configurada: no hay base de archivo adjunta')
+    columnas = ', '.join(COLUMNAS)
+
+    def mover_lote(conn):
+        # devuelto antes del corte implica prestado antes del corte: usa idx_prestamo_devuelto_fecha
+        ids = [fila[0] for fila in conn.execute(
+            'SELECT id FROM main.prestamo WHERE devuelto = 1 AND fecha_prestamo < ? AND fecha_devolucion < ? '
+            'LIMIT ?', (antes_de, antes_de, lote))]
+        if not ids:
+            return 0
+        marcas = ', '.join('?' * len(ids))
+        conn.execute(f'INSERT OR IGNORE INTO {ALIAS}.prestamo ({columnas}) '
+                     f'SELECT {columnas} FROM main.prestamo WHERE id IN ({marcas})', ids)
+        conn.execute(f'DELETE FROM main.prestamo WHERE id IN ({marcas})', ids)
+        return len(ids)
+
+    movidos = 0
+    while True:
+        n = circulacion.en_transaccion_inmediata(conn, mover_lote)
+        if not n:
+            if movidos:
+                # estadísticas del archivo para el planificador (sin ellas ordena el UNION ALL en memoria)
+                conn.execute(f'ANALYZE {ALIAS}')
+                conn.commit()
+            return movidos
+        movidos += n
+        if progreso:
+            progreso(movidos)
+        if pausa:
+            time.sleep(pausa)
@@ -0,0 +1,157 @@
+"""Importación masiva del catálogo desde CSV.
+
+El archivo se lee como flujo, fila por fila. Columnas: ``titulo``,
+``autor``, ``editorial``, ``stock``, ``seccion`` y, opcional, ``portada``
+(nombre de un archivo de imagen entregado junto con el CSV). Las filas
+válidas se escriben con ``executemany`` en lotes dentro de una sola
+transacción ``BEGIN IMMEDIATE``. Los ids se reservan al comienzo, así el
+``codigo_libro`` se calcula antes del INSERT y no hace falta el UPDATE por
+fila de ``admin_libros()``. Las filas con errores no se importan y quedan
+en el informe.
+"""
+import csv
+import itertools
+import os
+
+from werkzeug.datastructures import FileStorage
+
+import almacenamiento
+
+COLUMNAS_OBLIGATORIAS = ('titulo', 'autor', 'editorial', 'stock', 'seccion')
+TAMANO_LOTE = 500
+EXTENSIONES_PORTADA = {'png', 'jpg', 'jpeg', 'gif'}
+
+
+class ErrorImportacion(Exception):
+    """El archivo no se puede procesar (p. ej. faltan columnas)."""
+
+
+class PortadasEnDirectorio:
+    """Portadas disponibles en una carpeta local (importación por CLI)."""
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+
+    def _ruta(self, nombre):
+        return os.path.join(self.directorio, os.path.basename(nombre))
+
+    def __contains__(self, nombre):
+        return os.path.isfile(self._ruta(nombre))
+
+    def __getitem__(self, nombre):
+        return FileStorage(open(self._ruta(nombre), 'rb'), filename=nombre)
+
+
+def _lector(flujo_texto):
+    # el separador (coma o punto y coma, según cómo exporte la hoja de cálculo)
+    # se detecta en el encabezado; el resto del archivo se sigue leyendo como flujo
+    encabezado = flujo_texto.readline()
+    try:
+        dialecto = csv.Sniffer().sniff(encabezado, delimiters=',;\t')
+    except csv.Error:
+        dialecto = csv.excel
+    lector = csv.DictReader(itertools.chain([encabezado], flujo_texto), dialect=dialecto)
+    columnas = [(c or '').strip().lower() for c in (lector.fieldnames or [])]
+    faltan = [c for c in COLUMNAS_OBLIGATORIAS if c not in columnas]
+    if faltan:
+        raise ErrorImportacion(f"Faltan columnas en el CSV: {', '.join(faltan)}")
+    lector.fieldnames = columnas
+    return lector
+
+
+def _validar(fila):
+    valores = {c: (fila.get(c) or '').strip() for c in COLUMNAS_OBLIGATORIAS + ('portada',)}
+    vacias = [c for c in COLUMNAS_OBLIGATORIAS if not valores[c]]
+    if vacias:
+        raise ValueError(f"campos vacíos: {', '.join(vacias)}")
+    try:
+        stock = int(valores['stock'])
+    except ValueError:
+        raise ValueError(f"stock no es un número: {valores['stock']!r}")
+    if stock < 0:
+        raise ValueError('stock negativo')
+    valores['stock'] = stock
+    if valores['portada'] and valores['portada'].rsplit('.', 1)[-1].lower() not in EXTENSIONES_PORTADA:
+        raise ValueError(f"portada no es una imagen: {valores['portada']!r}")
+    return valores
+
+
+def importar_csv(conn, flujo_texto, generar_codigo, portadas=None, directorio_subidas=None,
+                 dry_run=False):
+    """Importa libros desde ``flujo_texto`` (texto CSV).
+
+    ``generar_codigo(conn, seccion, libro_id)`` calcula el código de cada
+    libro. ``portadas`` relaciona nombres de archivo con objetos tipo
+    ``FileStorage``; cada portada usada se guarda con ``almacenamiento``
+    en ``directorio_subidas``. Con ``dry_run`` se valida y se calculan los
+    códigos, pero se deshace la transacción y no se guardan portadas.
+
+    Devuelve el informe: una lista de dicts ``{fila, titulo, codigo, error}``
+    (``fila`` es el número de línea del CSV, contando el encabezado).
+    """
+    portadas = portadas or {}
+    lector = _lector(flujo_texto)
+    informe = []
+    lote = []
+    guardadas = {}  # nombre de portada en el CSV -> blob, para portadas repetidas
+
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # con el lock de escritura tomado, los ids siguientes son nuestros
+        siguiente_id = conn.execute("""
+            SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'libro'), 0),
+                       COALESCE((SELECT MAX(id) FROM libro), 0)) + 1
+        """).fetchone()[0]
+        for numero, fila in enumerate(lector, start=2):
+            try:
+                valores = _validar(fila)
+                if valores['portada'] and valores['portada'] not in portadas:
+                    raise ValueError(f"no se entregó la portada {valores['portada']!r}")
+            except ValueError as e:
+                informe.append({'fila': numero, 'titulo': (fila.get('titulo') or '').strip(),
+                                'codigo': None, 'error': str(e)})
+                continue
+            libro_id = siguiente_id
+            siguiente_id += 1
+            codigo = generar_codigo(conn, valores['seccion'], libro_id)
+            portada = None
+            if valores['portada'] and not dry_run:
+                portada = guardadas.get(valores['portada'])
+                if portada:
+                    almacenamiento.referenciar(conn, portada)
+                else:
+                    archivo = portadas[valores['portada']]
+                    try:
+                        portada = almacenamiento.guardar(conn, directorio_subidas, archivo)
+                    finally:
+                        archivo.close()
+                    guardadas[valores['portada']] = portada
+            lote.append((libro_id, valores['titulo'], valores['autor'], valores['editorial'],
+                         valores['stock'], valores['seccion'], codigo, portada))
+            informe.append({'fila': numero, 'titulo': valores['titulo'], 'codigo': codigo, 'error': None})
+            if len(lote) >= TAMANO_LOTE:
+                _insertar(conn, lote)
+                lote = []
+        _insertar(conn, lote)
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return informe
+
+
+def _insertar(conn, lote):
+    if lote:
+        conn.executemany(
+            'INSERT INTO libro (id, titulo, autor, editorial, stock, seccion, codigo_libro, portada_filename) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', lote)
+
+
+def resumen(informe):
+    errores = sum(1 for r in informe if r['error'])
+    return {'total': len(informe), 'importados': len(informe) - errores, 'errores': errores}
@@ -0,0 +1,247 @@
+"""Instrumentación: latencia por endpoint, SQL, plantillas y subidas.
+
+Las métricas viven en memoria de cada proceso (cada worker expone las
+suyas) y se publican en formato de texto de Prometheus en ``/metrics``.
+
+- Latencia de cada petición por endpoint, método y estado.
+- Cantidad de sentencias SQL y tiempo total de SQL por petición: las
+  conexiones del pool son ``ConexionMedida`` (ver ``db``), que cronometra
+  cada ``execute``/``executemany``. Se mide la ejecución de la sentencia,
+  no el ``fetchall`` posterior.
+- Tiempo de render de cada plantilla (señales de Jinja en Flask).
+- Bytes y latencia de las subidas guardadas con ``save_file``.
+- Arranque del worker: duración del calentamiento y tiempo desde el fork
+  (o el inicio del proceso) hasta la primera respuesta.
+
+Las sentencias que tardan más de ``SLOW_QUERY_MS`` se registran en el
+logger ``biblioteca.sql_lento`` (y en ``SLOW_QUERY_LOG`` si se configura)
+con el SQL, la forma de los parámetros (tipos, nunca valores) y la duración.
+"""
+import bisect
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from flask import before_render_template, current_app, g, has_app_context, request, template_rendered
+
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_SENTENCIAS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BUCKETS_BYTES = (10_000, 100_000, 1_000_000, 10_000_000, 50_000_000, 100_000_000)
+
+log_lento = logging.getLogger('biblioteca.sql_lento')
+
+# umbral en segundos; None desactiva el registro de consultas lentas
+umbral_lento = None
+
+
+class Histograma:
+    """Histograma acumulativo con etiquetas, al estilo de Prometheus."""
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(buckets)
+        self._series = {}  # valores de etiquetas -> [conteos por bucket, suma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores_etiquetas):
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(valores_etiquetas)
+            if serie is None:
+                serie = self._series[valores_etiquetas] = [[0] * len(self.buckets), 0.0, 0]
+            if i < len(self.buckets):
+                serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def totales(self, *valores_etiquetas):
+        """``(suma, cantidad)`` observadas para esas etiquetas."""
+        with self._lock:
+            serie = self._series.get(valores_etiquetas)
+            return (serie[1], serie[2]) if serie else (0.0, 0)
+
+    def exportar(self):
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} histogram']
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        for valores, (conteos, suma, total) in series:
+            base = [f'{e}="{_escapar(v)}"' for e, v in zip(self.etiquetas, valores)]
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, conteos):
+                acumulado += conteo
+                etiquetas = ','.join(base + ['le="%g"' % limite])
+                lineas.append(f'{self.nombre}_bucket{{{etiquetas}}} {acumulado}')
+            etiquetas = ','.join(base + ['le="+Inf"'])
+            lineas.append(f'{self.nombre}_bucket{{{etiquetas}}} {total}')
+            sufijo = '{' + ','.join(base) + '}' if base else ''
+            lineas.append(f'{self.nombre}_sum{sufijo} {suma:.6f}')
+            lineas.append(f'{self.nombre}_count{sufijo} {total}')
+        return lineas
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+peticiones = Histograma('biblioteca_http_request_duration_seconds',
+                        'Duración de las peticiones HTTP (hasta armar la respuesta).',
+                        ('endpoint', 'method', 'status'))
+sql_sentencias = Histograma('biblioteca_sql_statements_per_request',
+                            'Sentencias SQL ejecutadas por petición.',
+                            ('endpoint',), BUCKETS_SENTENCIAS)
+sql_segundos = Histograma('biblioteca_sql_seconds_per_request',
+                          'Tiempo total de SQL por petición.', ('endpoint',))
+plantillas = Histograma('biblioteca_template_render_seconds',
+                        'Tiempo de render de cada plantilla Jinja.', ('template',))
+subidas_bytes = Histograma('biblioteca_upload_bytes', 'Tamaño de los archivos subidos.',
+                           buckets=BUCKETS_BYTES)
+subidas_segundos = Histograma('biblioteca_upload_seconds',
+                              'Tiempo de guardar un archivo subido (hash y escritura).')
+HISTOGRAMAS = (peticiones, sql_sentencias, sql_segundos, plantillas, subidas_bytes, subidas_segundos)
+
+_consultas_lentas = 0
+_lock_lentas = threading.Lock()
+
+# arranque del proceso (o del worker, tras el fork): tiempo hasta la primera respuesta
+arranque = {'inicio': time.perf_counter(), 'calentamiento_segundos': None, 'primera_peticion_segundos': None}
+
+
+def _reiniciar_arranque():
+    arranque.update(inicio=time.perf_counter(), calentamiento_segundos=None, primera_peticion_segundos=None)
+
+
+os.register_at_fork(after_in_child=_reiniciar_arranque)
+
+
+def _forma(parametros):
+    """Describe los parámetros sin exponer sus valores: ``(int, str)``, ``{correo}``."""
+    if parametros is None:
+        return '()'
+    if isinstance(parametros, dict):
+        return '{' + ', '.join(sorted(parametros)) + '}'
+    try:
+        return '(' + ', '.join(type(p).__name__ for p in parametros) + ')'
+    except TypeError:
+        return type(parametros).__name__
+
+
+def registrar_sql(sql, parametros, segundos, filas=None):
+    """Suma la sentencia a la petición en curso y registra si fue lenta.
+
+    ``filas`` es la cantidad de juegos de parámetros en un ``executemany``.
+    """
+    global _consultas_lentas
+    if has_app_context():
+        g._sql_sentencias = g.get('_sql_sentencias', 0) + 1
+        g._sql_segundos = g.get('_sql_segundos', 0.0) + segundos
+    if umbral_lento is not None and segundos >= umbral_lento:
+        with _lock_lentas:
+            _consultas_lentas += 1
+        forma = f'executemany[{filas}]' if filas is not None else _forma(parametros)
+        log_lento.warning('%.1f ms | %s | parámetros %s', segundos * 1000,
+                          re.sub(r'\s+', ' ', sql).strip(), forma)
+
+
+class CursorMedido(sqlite3.Cursor):
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            registrar_sql(sql, parametros, time.perf_counter() - inicio)
+
+    def executemany(self, sql, secuencia):
+        secuencia = secuencia if isinstance(secuencia, (list, tuple)) else list(secuencia)
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, secuencia)
+        finally:
+            registrar_sql(sql, None, time.perf_counter() - inicio, filas=len(secuencia))
+
+
+class ConexionMedida(sqlite3.Connection):
+    """Conexión cuyas sentencias se cronometran (``factory`` de ``sqlite3.connect``)."""
+
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, secuencia):
+        return self.cursor().executemany(sql, secuencia)
+
+
+def observar_subida(bytes_, segundos):
+    subidas_bytes.observar(bytes_)
+    subidas_segundos.observar(segundos)
+
+
+def _inicio_peticion():
+    g._inicio_peticion = time.perf_counter()
+
+
+def _fin_peticion(response):
+    inicio = g.pop('_inicio_peticion', None)
+    if inicio is not None:
+        endpoint = request.endpoint or 'sin_endpoint'
+        peticiones.observar(time.perf_counter() - inicio, endpoint, request.method,
+                            str(response.status_code))
+        sql_sentencias.observar(g.get('_sql_sentencias', 0), endpoint)
+        sql_segundos.observar(g.get('_sql_segundos', 0.0), endpoint)
+    if arranque['primera_peticion_segundos'] is None:
+        arranque['primera_peticion_segundos'] = time.perf_counter() - arranque['inicio']
+        current_app.logger.info('worker %d: primera respuesta a los %.3f s del arranque',
+                                os.getpid(), arranque['primera_peticion_segundos'])
+    return response
+
+
+def _antes_de_render(sender, template, context, **extra):
+    if has_app_context():
+        g.setdefault('_renders', []).append(time.perf_counter())
+
+
+def _despues_de_render(sender, template, context, **extra):
+    if has_app_context() and g.get('_renders'):
+        plantillas.observar(time.perf_counter() - g._renders.pop(), template.name or '?')
+
+
+def init_app(app):
+    global umbral_lento
+    ms = app.config.get('SLOW_QUERY_MS')
+    umbral_lento = ms / 1000 if ms is not None else None
+    ruta = app.config.get('SLOW_QUERY_LOG')
+    if ruta and not any(getattr(h, 'baseFilename', None) == ruta for h in log_lento.handlers):
+        manejador = logging.FileHandler(ruta, encoding='utf-8')
+        manejador.setFormatter(logging.Formatter('%(asctime)s %(process)d %(message)s'))
+        log_lento.addHandler(manejador)
+    if 'metricas' in app.extensions:
+        return
+    app.extensions['metricas'] = True
+    app.before_request(_inicio_peticion)
+    app.after_request(_fin_peticion)
+    before_render_template.connect(_antes_de_render, app)
+    template_rendered.connect(_despues_de_render, app)
+
+
+def exportar(**grupos):
+    """Texto de Prometheus con los histogramas y, como gauges, los contadores
+    de ``grupos`` (p. ej. ``cache_respuestas=cache.estadisticas()``)."""
+    lineas = []
+    for histograma in HISTOGRAMAS:
+        lineas.extend(histograma.exportar())
+    lineas += ['# HELP biblioteca_sql_slow_queries Sentencias que superaron SLOW_QUERY_MS.',
+               '# TYPE biblioteca_sql_slow_queries counter',
+               f'biblioteca_sql_slow_queries {_consultas_lentas}']
+    grupos = dict(grupos, worker={k: v for k, v in arranque.items() if k != 'inicio' and v is not None})
+    for grupo, valores in grupos.items():
+        for clave, valor in valores.items():
+            if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+                nombre = f'biblioteca_{grupo}_{clave}'
+                lineas += [f'# TYPE {nombre} gauge', f'{nombre} {valor}']
+    return '\n'.join(lineas) + '\n'
@@ -0,0 +1,410 @@
+"""Migraciones versionadas del esquema.
+
+La versión aplicada se guarda en ``PRAGMA user_version``. Cada paso de
+``MIGRACIONES`` se ejecuta una sola vez, en orden, dentro de su propia
+transacción (``BEGIN IMMEDIATE``) junto con el cambio de versión; si falla,
+no queda aplicado a medias. Con el esquema al día, el arranque se reduce a
+leer ``user_version``.
+
+Para cambiar el esquema se agrega una función al final de la lista; nunca se
+modifican ni reordenan los pasos ya publicados. Por eso cada paso lleva su
+propio SQL escrito en el paso y no ejecuta constantes de otros módulos: si
+esas cambiaran, una base migrada antes y una nueva llegarían al mismo
+``user_version`` con esquemas distintos.
+"""
+import sqlite3
+
+import agregados
+import busqueda
+import estadisticas
+import facetas
+
+
+def ejecutar_script(conn, script):
+    """Ejecuta varias sentencias sin el COMMIT implícito de ``executescript``."""
+    sentencia = ''
+    for linea in script.splitlines(keepends=True):
+        sentencia += linea
+        if sqlite3.complete_statement(sentencia):
+            conn.execute(sentencia)
+            sentencia = ''
+    if sentencia.strip():
+        conn.execute(sentencia)
+
+
+def _columnas(conn, tabla):
+    return {r[1] for r in conn.execute(f'PRAGMA table_info({tabla})')}
+
+
+def _agregar_columnas(conn, tabla, columnas):
+    existentes = _columnas(conn, tabla)
+    for nombre, tipo in columnas:
+        if nombre not in existentes:
+            conn.execute(f'ALTER TABLE {tabla} ADD COLUMN {nombre} {tipo}')
+
+
+def m001_esquema_base(conn):
+    """Tablas principales y columnas que versiones viejas agregaban al arrancar."""
+    ejecutar_script(conn, """
+        CREATE TABLE IF NOT EXISTS libro (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            titulo TEXT NOT NULL,
+            autor TEXT NOT NULL,
+            editorial TEXT NOT NULL,
+            stock INTEGER NOT NULL,
+            seccion TEXT NOT NULL,
+            codigo_libro TEXT,
+            portada_filename TEXT
+        );
+        CREATE TABLE IF NOT EXISTS prestamo (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre TEXT NOT NULL,
+            grado TEXT NOT NULL,
+            curso TEXT NOT NULL,
+            libro_id INTEGER NOT NULL,
+            dias INTEGER NOT NULL,
+            correo TEXT NOT NULL,
+            fecha_prestamo TEXT NOT NULL,
+            devuelto INTEGER DEFAULT 0,
+            reseñado INTEGER DEFAULT 0,
+            fecha_devolucion TEXT,
+            FOREIGN KEY(libro_id) REFERENCES libro(id)
+        );
+        CREATE TABLE IF NOT EXISTS reseña (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            libro_id INTEGER NOT NULL,
+            correo TEXT NOT NULL,
+            calificacion INTEGER NOT NULL,
+            comentario TEXT,
+            fecha TEXT NOT NULL,
+            FOREIGN KEY(libro_id) REFERENCES libro(id)
+        );
+        CREATE TABLE IF NOT EXISTS biblioteca_virtual (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            titulo TEXT,
+            descripcion TEXT,
+            filename TEXT,
+            cover_filename TEXT,
+            curso TEXT,
+            letra TEXT,
+            letra_from TEXT,
+            letra_to TEXT,
+            fecha_subida TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    # bases creadas por versiones anteriores pueden no tener estas columnas
+    _agregar_columnas(conn, 'libro', [('codigo_libro', 'TEXT'), ('portada_filename', 'TEXT')])
+    _agregar_columnas(conn, 'prestamo', [('reseñado', 'INTEGER DEFAULT 0'), ('fecha_devolucion', 'TEXT')])
+    _agregar_columnas(conn, 'biblioteca_virtual', [
+        ('cover_filename', 'TEXT'), ('curso', 'TEXT'), ('letra', 'TEXT'),
+        ('letra_from', 'TEXT'), ('letra_to', 'TEXT'),
+    ])
+    # libros sin código: mismo formato que generar_codigo_libro()
+    for libro_id, seccion in conn.execute(
+            'SELECT id, seccion FROM libro WHERE codigo_libro IS NULL').fetchall():
+        conn.execute('UPDATE libro SET codigo_libro = ? WHERE id = ?',
+                     (f'{seccion[:3].upper()}-{libro_id:03d}', libro_id))
+
+
+def m002_indices_secundarios(conn):
+    """Índices para las consultas de perfil, préstamos, reseñas y listados."""
+    ejecutar_script(conn, """
+        -- perfil(): préstamos de un usuario (activos e historial por fecha)
+        CREATE INDEX IF NOT EXISTS idx_prestamo_correo_fecha ON prestamo(correo, fecha_prestamo);
+        -- admin_prestamos(): activos ordenados por fecha
+        CREATE INDEX IF NOT EXISTS idx_prestamo_devuelto_fecha ON prestamo(devuelto, fecha_prestamo);
+        -- admin_eliminar_libro() y agregados por libro
+        CREATE INDEX IF NOT EXISTS idx_prestamo_libro ON prestamo(libro_id);
+        -- admin_historial(): paginación por (fecha_prestamo, id)
+        CREATE INDEX IF NOT EXISTS idx_prestamo_fecha ON prestamo(fecha_prestamo, id);
+        -- libro_detalle(): reseñas del libro por fecha
+        CREATE INDEX IF NOT EXISTS idx_resena_libro_fecha ON reseña(libro_id, fecha);
+        -- admin_libros(): paginación por (seccion, codigo_libro); también SELECT DISTINCT seccion
+        CREATE INDEX IF NOT EXISTS idx_libro_seccion_codigo ON libro(seccion, codigo_libro);
+        -- biblioteca_virtual(): filtro por curso, más recientes primero
+        CREATE INDEX IF NOT EXISTS idx_bv_curso_fecha ON biblioteca_virtual(curso, fecha_subida);
+        CREATE INDEX IF NOT EXISTS idx_bv_fecha ON biblioteca_virtual(fecha_subida);
+    """)
+
+
+def m003_busqueda_fts(conn):
+    """Índices FTS5 del catálogo y la biblioteca virtual."""
+    ejecutar_script(conn, """
+        CREATE VIRTUAL TABLE IF NOT EXISTS libro_fts USING fts5(
+            titulo, autor, codigo_libro,
+            content='libro', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        );
+        CREATE TRIGGER IF NOT EXISTS libro_fts_ai AFTER INSERT ON libro BEGIN
+            INSERT INTO libro_fts(rowid, titulo, autor, codigo_libro)
+            VALUES (new.id, new.titulo, new.autor, new.codigo_libro);
+        END;
+        CREATE TRIGGER IF NOT EXISTS libro_fts_ad AFTER DELETE ON libro BEGIN
+            INSERT INTO libro_fts(libro_fts, rowid, titulo, autor, codigo_libro)
+            VALUES ('delete', old.id, old.titulo, old.autor, old.codigo_libro);
+        END;
+        CREATE TRIGGER IF NOT EXISTS libro_fts_au AFTER UPDATE OF titulo, autor, codigo_libro ON libro BEGIN
+            INSERT INTO libro_fts(libro_fts, rowid, titulo, autor, codigo_libro)
+            VALUES ('delete', old.id, old.titulo, old.autor, old.codigo_libro);
+            INSERT INTO libro_fts(rowid, titulo, autor, codigo_libro)
+            VALUES (new.id, new.titulo, new.autor, new.codigo_libro);
+        END;
+
+        CREATE VIRTUAL TABLE IF NOT EXISTS biblioteca_virtual_fts USING fts5(
+            titulo,
+            content='biblioteca_virtual', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        );
+        CREATE TRIGGER IF NOT EXISTS biblioteca_virtual_fts_ai AFTER INSERT ON biblioteca_virtual BEGIN
+            INSERT INTO biblioteca_virtual_fts(rowid, titulo) VALUES (new.id, new.titulo);
+        END;
+        CREATE TRIGGER IF NOT EXISTS biblioteca_virtual_fts_ad AFTER DELETE ON biblioteca_virtual BEGIN
+            INSERT INTO biblioteca_virtual_fts(biblioteca_virtual_fts, rowid, titulo)
+            VALUES ('delete', old.id, old.titulo);
+        END;
+        CREATE TRIGGER IF NOT EXISTS biblioteca_virtual_fts_au AFTER UPDATE OF titulo ON biblioteca_virtual BEGIN
+            INSERT INTO biblioteca_virtual_fts(biblioteca_virtual_fts, rowid, titulo)
+            VALUES ('delete', old.id, old.titulo);
+            INSERT INTO biblioteca_virtual_fts(rowid, titulo) VALUES (new.id, new.titulo);
+        END;
+    """)
+    busqueda.reconstruir_indices(conn)
+
+
+def m004_libro_stats(conn):
+    """Agregados por libro (préstamos y calificaciones)."""
+    ejecutar_script(conn, """
+        CREATE TABLE IF NOT EXISTS libro_stats (
+            libro_id INTEGER PRIMARY KEY REFERENCES libro(id) ON DELETE CASCADE,
+            total_prestamos INTEGER NOT NULL DEFAULT 0,
+            suma_calificaciones INTEGER NOT NULL DEFAULT 0,
+            num_calificaciones INTEGER NOT NULL DEFAULT 0,
+            promedio REAL,
+            estrellas_1 INTEGER NOT NULL DEFAULT 0,
+            estrellas_2 INTEGER NOT NULL DEFAULT 0,
+            estrellas_3 INTEGER NOT NULL DEFAULT 0,
+            estrellas_4 INTEGER NOT NULL DEFAULT 0,
+            estrellas_5 INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_libro_stats_prestamos ON libro_stats(total_prestamos DESC);
+        CREATE INDEX IF NOT EXISTS idx_libro_stats_promedio ON libro_stats(promedio DESC)
+            WHERE num_calificaciones > 0;
+    """)
+    agregados.recalcular(conn)
+
+
+def m005_fecha_vencimiento(conn):
+    """Fecha de vencimiento guardada en el préstamo, indexada junto a ``devuelto``."""
+    _agregar_columnas(conn, 'prestamo', [('fecha_vencimiento', 'TEXT')])
+    conn.execute("""
+        UPDATE prestamo SET fecha_vencimiento = date(fecha_prestamo, '+' || dias || ' days')
+        WHERE fecha_vencimiento IS NULL
+    """)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_prestamo_devuelto_vencimiento '
+                 'ON prestamo(devuelto, fecha_vencimiento)')
+
+
+def m006_archivos(conn):
+    """Registro de archivos subidos direccionados por contenido."""
+    ejecutar_script(conn, """
+        CREATE TABLE IF NOT EXISTS archivo (
+            hash TEXT PRIMARY KEY,
+            filename TEXT NOT NULL UNIQUE,
+            bytes INTEGER NOT NULL,
+            referencias INTEGER NOT NULL DEFAULT 0,
+            fecha_subida TEXT NOT NULL
+        );
+    """)
+
+
+def m007_version_datos(conn):
+    """Contadores de versión por tabla, incrementados por triggers."""
+    ejecutar_script(conn, """
+        CREATE TABLE IF NOT EXISTS version_datos (
+            tabla TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+        INSERT OR IGNORE INTO version_datos (tabla, version) VALUES ('libro', 0);
+        INSERT OR IGNORE INTO version_datos (tabla, version) VALUES ('prestamo', 0);
+        INSERT OR IGNORE INTO version_datos (tabla, version) VALUES ('reseña', 0);
+        INSERT OR IGNORE INTO version_datos (tabla, version) VALUES ('biblioteca_virtual', 0);
+        CREATE TRIGGER IF NOT EXISTS version_libro_insert AFTER INSERT ON libro BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'libro';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_libro_update AFTER UPDATE ON libro BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'libro';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_libro_delete AFTER DELETE ON libro BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'libro';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_prestamo_insert AFTER INSERT ON prestamo BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'prestamo';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_prestamo_update AFTER UPDATE ON prestamo BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'prestamo';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_prestamo_delete AFTER DELETE ON prestamo BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'prestamo';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_reseña_insert AFTER INSERT ON reseña BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'reseña';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_reseña_update AFTER UPDATE ON reseña BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'reseña';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_reseña_delete AFTER DELETE ON reseña BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'reseña';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_biblioteca_virtual_insert AFTER INSERT ON biblioteca_virtual BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'biblioteca_virtual';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_biblioteca_virtual_update AFTER UPDATE ON biblioteca_virtual BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'biblioteca_virtual';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_biblioteca_virtual_delete AFTER DELETE ON biblioteca_virtual BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'biblioteca_virtual';
+        END;
+    """)
+
+
+def m008_letras_biblioteca_virtual(conn):
+    """Curso y letras normalizados y tabla de búsqueda por letra (rangos expandidos)."""
+    ejecutar_script(conn, """
+        CREATE TABLE IF NOT EXISTS biblioteca_virtual_letra (
+            letra TEXT NOT NULL,
+            documento_id INTEGER NOT NULL REFERENCES biblioteca_virtual(id) ON DELETE CASCADE,
+            PRIMARY KEY (letra, documento_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_bv_letra_documento ON biblioteca_virtual_letra(documento_id);
+    """)
+    facetas.normalizar_existentes(conn)
+
+
+def m009_estadistica_diaria(conn):
+    """Resúmenes diarios de préstamos y totales por usuario para las estadísticas."""
+    ejecutar_script(conn, """
+        CREATE TABLE IF NOT EXISTS estadistica_diaria (
+            dimension TEXT NOT NULL,
+            valor TEXT NOT NULL,
+            fecha TEXT NOT NULL,
+            prestamos INTEGER NOT NULL DEFAULT 0,
+            devueltos INTEGER NOT NULL DEFAULT 0,
+            a_tiempo INTEGER NOT NULL DEFAULT 0,
+            dias_pedidos INTEGER NOT NULL DEFAULT 0,
+            dias_prestados INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dimension, fecha, valor)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS usuario_stats (
+            correo TEXT PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            total_prestamos INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_usuario_stats_prestamos ON usuario_stats(total_prestamos DESC);
+    """)
+    estadisticas.recalcular(conn)
+
+
+def m010_subidas_por_bloques(conn):
+    """Estado de las subidas por bloques reanudables de la biblioteca virtual."""
+    ejecutar_script(conn, """
+        CREATE TABLE IF NOT EXISTS subida_parcial (
+            id TEXT PRIMARY KEY,
+            nombre TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            tamano_bloque INTEGER NOT NULL,
+            creada TEXT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS subida_bloque (
+            subida_id TEXT NOT NULL REFERENCES subida_parcial(id) ON DELETE CASCADE,
+            indice INTEGER NOT NULL,
+            crc32 INTEGER NOT NULL,
+            PRIMARY KEY (subida_id, indice)
+        ) WITHOUT ROWID;
+    """)
+
+
+def m011_indices_circulacion_por_lote(conn):
+    """Índices para resolver códigos escaneados: libro por código y préstamos activos por libro."""
+    ejecutar_script(conn, """
+        CREATE INDEX IF NOT EXISTS idx_libro_codigo ON libro(codigo_libro);
+        CREATE INDEX IF NOT EXISTS idx_prestamo_activo_libro ON prestamo(libro_id, fecha_prestamo)
+            WHERE devuelto = 0;
+    """)
+
+
+def m012_versiones_por_columnas(conn):
+    """Contador ``libro_textos`` para autocompletar: solo cambia con los textos de ``libro``, no con el stock."""
+    ejecutar_script(conn, """
+        INSERT OR IGNORE INTO version_datos (tabla, version) VALUES ('libro_textos', 0);
+        CREATE TRIGGER IF NOT EXISTS version_libro_textos_insert AFTER INSERT ON libro BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'libro_textos';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_libro_textos_delete AFTER DELETE ON libro BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'libro_textos';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_libro_textos_update AFTER UPDATE OF titulo, autor, codigo_libro ON libro BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'libro_textos';
+        END;
+    """)
+
+
+def m013_version_catalogo(conn):
+    """Contador ``libro_catalogo`` para la foto del catálogo, que no cambia con el stock."""
+    ejecutar_script(conn, """
+        INSERT OR IGNORE INTO version_datos (tabla, version) VALUES ('libro_catalogo', 0);
+        CREATE TRIGGER IF NOT EXISTS version_libro_catalogo_insert AFTER INSERT ON libro BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'libro_catalogo';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_libro_catalogo_delete AFTER DELETE ON libro BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'libro_catalogo';
+        END;
+        CREATE TRIGGER IF NOT EXISTS version_libro_catalogo_update
+        AFTER UPDATE OF titulo, autor, editorial, seccion, codigo_libro, portada_filename ON libro BEGIN
+            UPDATE version_datos SET version = version + 1 WHERE tabla = 'libro_catalogo';
+        END;
+    """)
+
+
+MIGRACIONES = [
+    m001_esquema_base,
+    m002_indices_secundarios,
+    m003_busqueda_fts,
+    m004_libro_stats,
+    m005_fecha_vencimiento,
+    m006_archivos,
+    m007_version_datos,
+    m008_letras_biblioteca_virtual,
+    m009_estadistica_diaria,
+    m010_subidas_por_bloques,
+    m011_indices_circulacion_por_lote,
+    m012_versiones_por_columnas,
+    m013_version_catalogo,
+]
+
+
+def version_actual(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrar(conn):
+    """Aplica los pasos pendientes. Devuelve la lista de pasos aplicados."""
+    if version_actual(conn) >= len(MIGRACIONES):
+        return []
+    aplicadas = []
+    if conn.in_transaction:
+        conn.commit()
+    for numero, paso in enumerate(MIGRACIONES, start=1):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # otro proceso pudo aplicarla mientras esperábamos el lock
+            if version_actual(conn) >= numero:
+                conn.rollback()
+                continue
+            paso(conn)
+            conn.execute(f'PRAGMA user_version = {numero}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        aplicadas.append(paso.__name__)
+    return aplicadas
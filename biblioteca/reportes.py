@@ -0,0 +1,117 @@
+"""Copia de solo lectura de la base para las consultas pesadas de reportes.
+
+Con ``REPORT_SNAPSHOT`` configurada, ``actualizar`` copia la base principal
+a ese archivo con la API de backup en línea de SQLite
+(``Connection.backup``) de a ``PAGINAS`` páginas, con una pausa corta entre
+pasos. El origen se lee dentro de una única transacción de lectura: en modo
+WAL no bloquea a ``prestar`` ni a ``devolver_prestamo``, la copia es una
+foto coherente de un instante y no se reinicia cada vez que otra conexión
+escribe (sin esa transacción, un backup por pasos vuelve a empezar con cada
+escritura y bajo carga no termina nunca). La copia se arma en un archivo
+temporal y reemplaza a la anterior con ``os.replace``; las peticiones que
+la estén leyendo siguen con la versión vieja hasta terminar.
+
+Se actualiza a pedido (``flask actualizar-reportes`` o el botón del panel)
+o periódicamente (``flask actualizar-reportes --cada 600`` o cron).
+``admin_estadisticas`` y ``admin_historial`` leen con ``conexion()``: la
+copia si existe, la base principal si no hay copia configurada o todavía
+no se generó. El archivo de préstamos (ver ``historico``) se adjunta en
+solo lectura.
+"""
+import os
+import sqlite3
+import time
+
+from flask import current_app, g
+
+import db
+import metricas
+
+PAGINAS = 1024
+PAUSA = 0.005  # segundos entre pasos del backup
+
+
+def ruta(app=None):
+    return (app or current_app).config.get('REPORT_SNAPSHOT')
+
+
+def edad(app=None):
+    """Segundos desde la última actualización de la copia, o None si no hay copia."""
+    destino = ruta(app)
+    if not destino:
+        return None
+    try:
+        return max(0.0, time.time() - os.path.getmtime(destino))
+    except OSError:
+        return None
+
+
+def actualizar(origen, destino, paginas=PAGINAS, pausa=PAUSA, progreso=None):
+    """Copia ``origen`` a ``destino`` por pasos sin bloquear a los escritores. Devuelve los segundos."""
+    inicio = time.perf_counter()
+    temporal = f'{destino}.tmp-{os.getpid()}'
+    fuente = sqlite3.connect(origen, isolation_level=None)
+    copia = sqlite3.connect(temporal)
+    try:
+        # transacción de lectura abierta durante toda la copia (ver docstring del módulo)
+        fuente.execute('BEGIN')
+        fuente.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        fuente.backup(copia, pages=paginas, sleep=pausa,
+                      progress=(lambda estado, restantes, total: progreso(total - restantes, total))
+                      if progreso else None)
+        fuente.execute('COMMIT')
+        # la copia se abre con immutable=1: sin WAL
+        copia.execute('PRAGMA journal_mode = DELETE')
+        copia.close()
+        os.replace(temporal, destino)
+    except BaseException:
+        copia.close()
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    finally:
+        fuente.close()
+    return time.perf_counter() - inicio
+
+
+def _conectar(app, destino):
+    # immutable=1: el archivo nunca se modifica en su lugar (se reemplaza entero), no hacen falta locks
+    conn = sqlite3.connect(f'file:{destino}?mode=ro&immutable=1', uri=True, check_same_thread=False,
+                           factory=metricas.ConexionMedida)
+    conn.row_factory = sqlite3.Row
+    archivo = app.config.get('ARCHIVE_DATABASE')
+    if archivo:
+        conn.cursor(sqlite3.Cursor).execute('ATTACH DATABASE ? AS historico', (f'file:{archivo}?mode=ro',))
+    return conn
+
+
+def abrir(app=None):
+    """Conexión nueva a la copia, no ligada al contexto (la cierra quien la pide); None si no hay copia."""
+    app = app or current_app._get_current_object()
+    destino = ruta(app)
+    if destino and os.path.exists(destino):
+        return _conectar(app, destino)
+    return None
+
+
+def conexion():
+    """Conexión para reportes: la copia de solo lectura si existe, si no la base principal."""
+    if '_reportes_conn' not in g:
+        conn = abrir()
+        if conn is None:
+            return db.get_connection()
+        g._reportes_conn = conn
+    return g._reportes_conn
+
+
+def _cerrar(exc=None):
+    conn = g.pop('_reportes_conn', None)
+    if conn is not None:
+        conn.close()
+
+
+def init_app(app):
+    if 'reportes' in app.extensions:
+        return
+    app.extensions['reportes'] = True
+    app.teardown_appcontext(_cerrar)
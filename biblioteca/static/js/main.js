@@ -5,23 +5,39 @@ document.addEventListener('DOMContentLoaded', function(){
     el.style.animationDelay = (i * 60) + 'ms';
   });
 
-  // Autocompletado para biblioteca virtual (datalist)
-  const datalist = document.getElementById('titulos-list');
-  const inputSearch = document.getElementById('doc-search');
-  if (datalist && inputSearch) {
-    fetch('/api/documentos/titulos')
-      .then(res => res.ok ? res.json() : Promise.reject(res.status))
-      .then(titulos => {
-        datalist.innerHTML = titulos.map(t => `<option value="${escapeHtml(t)}">`).join('');
-      })
-      .catch(() => {
-        // silencioso si falla (no rompe la página)
-      });
+  // Autocompletado (datalist): pide al servidor solo las coincidencias del prefijo escrito
+  document.querySelectorAll('input[data-autocomplete]').forEach(input => {
+    const datalist = document.getElementById(input.getAttribute('list'));
+    if (!datalist) return;
+    let timer = null;
+    let controller = null;
 
-    // helper para evitar inyección en opciones
-    function escapeHtml(str) {
-      return String(str).replace(/[&<>"']/g, (s) => ({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'}[s]));
-    }
+    input.addEventListener('input', () => {
+      clearTimeout(timer);
+      const q = input.value.trim();
+      if (q.length < 2) {
+        datalist.innerHTML = '';
+        return;
+      }
+      timer = setTimeout(() => {
+        if (controller) controller.abort();
+        controller = new AbortController();
+        const params = new URLSearchParams({ q: q, scope: input.dataset.autocomplete, limit: 10 });
+        fetch('/api/autocomplete?' + params, { signal: controller.signal })
+          .then(res => res.ok ? res.json() : Promise.reject(res.status))
+          .then(items => {
+            datalist.innerHTML = items.map(i => `<option value="${escapeHtml(i.valor)}">`).join('');
+          })
+          .catch(() => {
+            // silencioso si falla (no rompe la página)
+          });
+      }, 150);
+    });
+  });
+
+  // helper para evitar inyección en opciones
+  function escapeHtml(str) {
+    return String(str).replace(/[&<>"']/g, (s) => ({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'}[s]));
   }
 });
 
@@ -37,4 +53,135 @@ function uploadWithProgress(formElement, progressBarElement, onComplete){
   });
   xhr.addEventListener('load', () => onComplete(xhr));
   xhr.send(formData);
-}
\ No newline at end of file
+}
+
+// Subida por bloques reanudable (biblioteca virtual). El archivo se parte en bloques de
+// tamano_bloque que se envían con PUT, hasta BLOQUES_EN_VUELO a la vez, cada uno con su
+// CRC-32; los que fallan se reintentan. El id de la subida se guarda en localStorage: si
+// se corta la conexión o se recarga la página, al elegir el mismo archivo solo se envían
+// los bloques que faltan. Al terminar, el formulario se envía con subida_id en lugar del archivo.
+const BLOQUES_EN_VUELO = 3;
+const REINTENTOS_BLOQUE = 4;
+
+const TABLA_CRC32 = (() => {
+  const tabla = new Uint32Array(256);
+  for (let n = 0; n < 256; n++) {
+    let c = n;
+    for (let k = 0; k < 8; k++) c = c & 1 ? 0xEDB88320 ^ (c >>> 1) : c >>> 1;
+    tabla[n] = c >>> 0;
+  }
+  return tabla;
+})();
+
+function crc32(bytes) {
+  let crc = 0xFFFFFFFF;
+  for (let i = 0; i < bytes.length; i++) crc = TABLA_CRC32[(crc ^ bytes[i]) & 0xFF] ^ (crc >>> 8);
+  return (crc ^ 0xFFFFFFFF) >>> 0;
+}
+
+function claveSubida(file) {
+  return 'subida:' + [file.name, file.size, file.lastModified].join(':');
+}
+
+async function pedirJson(url, opciones) {
+  const res = await fetch(url, Object.assign({ credentials: 'same-origin' }, opciones));
+  const datos = await res.json().catch(() => ({}));
+  if (!res.ok) {
+    const error = new Error(datos.error || ('HTTP ' + res.status));
+    error.status = res.status;
+    throw error;
+  }
+  return datos;
+}
+
+async function iniciarOReanudar(base, file) {
+  const guardado = localStorage.getItem(claveSubida(file));
+  if (guardado) {
+    try {
+      return await pedirJson(base + '/' + guardado);
+    } catch (e) {
+      localStorage.removeItem(claveSubida(file));  // vencida o ya finalizada
+    }
+  }
+  const estado = await pedirJson(base, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ nombre: file.name, bytes: file.size }),
+  });
+  localStorage.setItem(claveSubida(file), estado.id);
+  return estado;
+}
+
+async function enviarBloque(base, estado, file, indice) {
+  const inicio = indice * estado.tamano_bloque;
+  const bytes = new Uint8Array(await file.slice(inicio, inicio + estado.tamano_bloque).arrayBuffer());
+  for (let intento = 0; ; intento++) {
+    try {
+      return await pedirJson(base + '/' + estado.id + '/' + inicio, {
+        method: 'PUT',
+        headers: { 'Content-Type': 'application/octet-stream', 'X-Chunk-Crc32': String(crc32(bytes)) },
+        body: bytes,
+      });
+    } catch (e) {
+      // 4xx distinto de CRC (422) no se arregla reintentando
+      if (intento >= REINTENTOS_BLOQUE || (e.status && e.status < 500 && e.status !== 422)) throw e;
+      await new Promise(r => setTimeout(r, 500 * 2 ** intento));
+    }
+  }
+}
+
+async function subirPorBloques(base, file, alProgresar) {
+  const estado = await iniciarOReanudar(base, file);
+  const recibidos = new Set(estado.recibidos);
+  const pendientes = [];
+  for (let i = 0; i < estado.bloques; i++) if (!recibidos.has(i)) pendientes.push(i);
+  let completos = recibidos.size;
+  alProgresar(completos / estado.bloques);
+  const trabajador = async () => {
+    while (pendientes.length) {
+      await enviarBloque(base, estado, file, pendientes.shift());
+      alProgresar(++completos / estado.bloques);
+    }
+  };
+  await Promise.all(Array.from({ length: Math.min(BLOQUES_EN_VUELO, pendientes.length) }, trabajador));
+  return estado.id;
+}
+
+document.addEventListener('DOMContentLoaded', function(){
+  document.querySelectorAll('form[data-subida-bloques]').forEach(form => {
+    const input = form.querySelector('input[type=file][name=file]');
+    const barra = form.querySelector('.upload-progress');
+    const mensaje = form.querySelector('.upload-status');
+    if (!input || !window.fetch || !window.localStorage) return;  // queda el envío clásico
+
+    form.addEventListener('submit', async (ev) => {
+      const file = input.files[0];
+      if (!file || form.dataset.enviando) return;
+      ev.preventDefault();
+      form.dataset.enviando = '1';
+      const boton = form.querySelector('button[type=submit]');
+      if (boton) boton.disabled = true;
+      if (barra) barra.parentElement.hidden = false;
+      try {
+        const subidaId = await subirPorBloques(form.dataset.subidaBloques, file, fraccion => {
+          if (barra) barra.style.width = Math.round(fraccion * 100) + '%';
+        });
+        localStorage.removeItem(claveSubida(file));
+        let oculto = form.querySelector('input[name=subida_id]');
+        if (!oculto) {
+          oculto = document.createElement('input');
+          oculto.type = 'hidden';
+          oculto.name = 'subida_id';
+          form.appendChild(oculto);
+        }
+        oculto.value = subidaId;
+        input.disabled = true;  // el archivo ya está en el servidor: no se vuelve a enviar
+        form.submit();
+      } catch (e) {
+        delete form.dataset.enviando;
+        if (boton) boton.disabled = false;
+        if (mensaje) mensaje.textContent = 'La subida se interrumpió (' + e.message + '). Vuelve a enviar para continuar donde quedó.';
+      }
+    });
+  });
+});
@@ -0,0 +1,154 @@
+"""Subidas por bloques, reanudables, para los PDF grandes de la biblioteca virtual.
+
+Protocolo (rutas en ``app.py``, solo admin):
+
+1. ``POST /admin/subidas`` con ``{"nombre", "bytes"}``: valida extensión y
+   tamaño (``UPLOAD_MAX_BYTES``), crea ``.parcial-<id>`` en la carpeta de
+   subidas con su tamaño final (disperso) y devuelve el id, el tamaño de
+   bloque y los bloques ya recibidos.
+2. ``PUT /admin/subidas/<id>/<offset>`` con el bloque como cuerpo
+   (``application/octet-stream``) y su CRC-32 en ``X-Chunk-Crc32``. El
+   offset debe ser múltiplo del tamaño de bloque y el cuerpo medir
+   exactamente lo que corresponde; se escribe con ``os.pwrite`` en su
+   lugar del archivo final, leyendo la petición de a 64 KB (sin parser
+   multipart ni copias temporales). Si el CRC no coincide el bloque no se
+   marca y el cliente lo reintenta. Los bloques pueden llegar en cualquier
+   orden y en paralelo, incluso a workers distintos: el estado vive en la
+   base.
+3. ``GET /admin/subidas/<id>``: bloques recibidos, para reanudar tras un
+   corte.
+4. El formulario del documento se envía con ``subida_id`` en lugar del
+   archivo; ``finalizar`` comprueba que estén todos los bloques, pasa el
+   archivo al almacenamiento por contenido (``almacenamiento.adoptar``) y
+   devuelve el nombre del blob, en la misma transacción que crea el
+   documento.
+
+Las subidas abandonadas las borra ``recolectar`` (prefijo ``.parcial-``)
+y ``purgar`` elimina sus filas.
+"""
+import os
+import secrets
+import zlib
+from datetime import datetime
+
+import almacenamiento
+
+TAMANO_BLOQUE = 8 * 1024 * 1024
+TAMANO_LECTURA = 64 * 1024
+PREFIJO = '.parcial-'
+
+
+class ErrorSubida(ValueError):
+    """Petición de subida inválida; ``estado`` es el código HTTP a responder."""
+
+    def __init__(self, mensaje, estado=400):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+def ruta_parcial(directorio, subida_id):
+    return os.path.join(directorio, PREFIJO + subida_id)
+
+
+def bloques_totales(subida):
+    return max(1, -(-subida['bytes'] // subida['tamano_bloque']))
+
+
+def obtener(conn, subida_id):
+    subida = conn.execute('SELECT * FROM subida_parcial WHERE id = ?', (subida_id,)).fetchone()
+    if subida is None:
+        raise ErrorSubida('subida inexistente o vencida', 404)
+    return subida
+
+
+def recibidos(conn, subida_id):
+    return [fila[0] for fila in conn.execute(
+        'SELECT indice FROM subida_bloque WHERE subida_id = ? ORDER BY indice', (subida_id,))]
+
+
+def estado(conn, subida_id):
+    subida = obtener(conn, subida_id)
+    return {'id': subida['id'], 'bytes': subida['bytes'], 'tamano_bloque': subida['tamano_bloque'],
+            'bloques': bloques_totales(subida), 'recibidos': recibidos(conn, subida_id)}
+
+
+def iniciar(conn, directorio, nombre, bytes_, extensiones, maximo, tamano_bloque=TAMANO_BLOQUE):
+    """Registra una subida y crea su archivo parcial. No hace commit."""
+    nombre = os.path.basename(nombre or '')
+    if '.' not in nombre or nombre.rsplit('.', 1)[1].lower() not in extensiones:
+        raise ErrorSubida('tipo de archivo no permitido')
+    if not isinstance(bytes_, int) or bytes_ <= 0:
+        raise ErrorSubida('tamaño inválido')
+    if maximo is not None and bytes_ > maximo:
+        raise ErrorSubida(f'el archivo supera el máximo de {maximo} bytes', 413)
+    os.makedirs(directorio, exist_ok=True)
+    subida_id = secrets.token_hex(16)
+    with open(ruta_parcial(directorio, subida_id), 'wb') as f:
+        f.truncate(bytes_)
+    conn.execute('INSERT INTO subida_parcial (id, nombre, bytes, tamano_bloque, creada) VALUES (?, ?, ?, ?, ?)',
+                 (subida_id, nombre, bytes_, tamano_bloque, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    return estado(conn, subida_id)
+
+
+def escribir_bloque(conn, directorio, subida_id, offset, largo, crc_esperado, flujo):
+    """Escribe un bloque desde ``flujo`` en su posición del archivo parcial. No hace commit.
+
+    ``largo`` es el Content-Length de la petición; se valida contra el
+    tamaño que le toca a ese offset antes de leer nada.
+    """
+    subida = obtener(conn, subida_id)
+    tamano_bloque = subida['tamano_bloque']
+    if offset < 0 or offset % tamano_bloque or offset >= subida['bytes']:
+        raise ErrorSubida('offset inválido')
+    esperado = min(tamano_bloque, subida['bytes'] - offset)
+    if largo != esperado:
+        raise ErrorSubida(f'el bloque debe medir {esperado} bytes', 413 if (largo or 0) > esperado else 400)
+    ruta = ruta_parcial(directorio, subida_id)
+    crc = 0
+    escritos = 0
+    fd = os.open(ruta, os.O_WRONLY)
+    try:
+        while escritos < esperado:
+            datos = flujo.read(min(TAMANO_LECTURA, esperado - escritos))
+            if not datos:
+                break
+            os.pwrite(fd, datos, offset + escritos)
+            crc = zlib.crc32(datos, crc)
+            escritos += len(datos)
+    finally:
+        os.close(fd)
+    if escritos != esperado:
+        raise ErrorSubida('bloque incompleto')
+    if crc_esperado is not None and crc != crc_esperado:
+        raise ErrorSubida('el CRC-32 del bloque no coincide', 422)
+    conn.execute('INSERT OR REPLACE INTO subida_bloque (subida_id, indice, crc32) VALUES (?, ?, ?)',
+                 (subida_id, offset // tamano_bloque, crc))
+    return len(recibidos(conn, subida_id))
+
+
+def finalizar(conn, directorio, subida_id):
+    """Pasa la subida completa al almacenamiento por contenido. Devuelve el nombre del blob.
+
+    No hace commit: la referencia queda confirmada con la fila que la usa.
+    """
+    subida = obtener(conn, subida_id)
+    faltan = bloques_totales(subida) - len(recibidos(conn, subida_id))
+    if faltan:
+        raise ErrorSubida(f'faltan {faltan} bloque(s)', 409)
+    filename = almacenamiento.adoptar(conn, directorio, ruta_parcial(directorio, subida_id), subida['nombre'])
+    _borrar(conn, [subida_id])
+    return filename
+
+
+def purgar(conn, directorio):
+    """Elimina las filas de subidas cuyo archivo parcial ya no existe. No hace commit."""
+    vencidas = [fila[0] for fila in conn.execute('SELECT id FROM subida_parcial')
+                if not os.path.exists(ruta_parcial(directorio, fila[0]))]
+    _borrar(conn, vencidas)
+    return len(vencidas)
+
+
+def _borrar(conn, ids):
+    # sin foreign_keys activo en las conexiones, los bloques no se borran en cascada
+    conn.executemany('DELETE FROM subida_bloque WHERE subida_id = ?', [(i,) for i in ids])
+    conn.executemany('DELETE FROM subida_parcial WHERE id = ?', [(i,) for i in ids])
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# los módulos de la app se importan por nombre desde la carpeta biblioteca (import app, import db...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def aplicacion(tmp_path, monkeypatch):
+    """La app con base y carpeta de subidas temporales, migrada; cierra su pool al terminar."""
+    import app as biblioteca
+    import db
+    monkeypatch.setitem(biblioteca.app.config, 'DATABASE', str(tmp_path / 'biblioteca.db'))
+    monkeypatch.setitem(biblioteca.app.config, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setitem(biblioteca.app.config, 'REPORT_SNAPSHOT', None)
+    monkeypatch.setitem(biblioteca.app.config, 'TESTING', True)
+    with biblioteca.app.app_context():
+        biblioteca.preparar_base_de_datos()
+    yield biblioteca.app
+    db.get_pool(biblioteca.app).close_all()
+
+
+@pytest.fixture
+def cliente_admin(aplicacion):
+    cliente = aplicacion.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion['admin'] = True
+    return cliente
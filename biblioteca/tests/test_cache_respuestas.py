@@ -0,0 +1,37 @@
+import pytest
+
+import cache_respuestas
+
+
+@pytest.fixture
+def cliente(aplicacion, monkeypatch):
+    monkeypatch.setitem(aplicacion.config, 'RESPONSE_CACHE_ENABLED', True)
+    cache_respuestas.cache._entradas.clear()
+
+    def para(correo):
+        cliente = aplicacion.test_client()
+        with cliente.session_transaction() as sesion:
+            sesion['correo'] = correo
+        return cliente
+    return para
+
+
+def test_solo_la_cabecera_lleva_el_correo_del_que_mira(cliente):
+    ana, beto = 'ana@ensdbexcelencia.edu.co', 'beto@ensdbexcelencia.edu.co'
+    url = f'/dashboard?search={ana}'
+    primera = cliente(ana).get(url).get_data(as_text=True)
+    aciertos = cache_respuestas.cache.aciertos
+    segunda = cliente(beto).get(url).get_data(as_text=True)
+
+    assert cache_respuestas.cache.aciertos == aciertos + 1
+    assert f'<span>{ana}</span>' in primera
+    assert f'<span>{beto}</span>' in segunda
+    # el cuadro de búsqueda repite lo que se buscó, no el correo de quien mira
+    assert f'value="{ana}"' in primera and f'value="{ana}"' in segunda
+    assert cache_respuestas.MARCA_CORREO not in primera + segunda
+
+
+def test_correo_sesion_sin_cache(aplicacion, cliente, monkeypatch):
+    monkeypatch.setitem(aplicacion.config, 'RESPONSE_CACHE_ENABLED', False)
+    html = cliente('ana@ensdbexcelencia.edu.co').get('/dashboard').get_data(as_text=True)
+    assert '<span>ana@ensdbexcelencia.edu.co</span>' in html
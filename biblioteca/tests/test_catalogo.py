@@ -0,0 +1,45 @@
+import sqlite3
+
+import catalogo
+import migraciones
+
+
+def _base():
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    migraciones.migrar(conn)
+    conn.executemany("INSERT INTO libro (titulo, autor, editorial, stock, seccion, codigo_libro) VALUES (?, ?, ?, ?, ?, ?)",
+                     [('Rayuela', 'Cortázar', 'Sudamericana', 1, 'Novela', 'NOV-001'),
+                      ('Ficciones', 'Borges', 'Sur', 2, 'Cuento', 'CUE-001')])
+    catalogo._foto = catalogo._existencias = None
+    return conn
+
+
+def test_un_prestamo_no_reconstruye_la_foto():
+    conn = _base()
+    vista = catalogo.obtener(conn)
+    assert [l.titulo for l in vista.disponibles_por_seccion()['Novela']] == ['Rayuela']
+    conn.execute("UPDATE libro SET stock = 0 WHERE codigo_libro = 'NOV-001'")
+    despues = catalogo.obtener(conn)
+    assert despues.foto is vista.foto
+    assert despues.libro(1).stock == 0
+    assert 'Novela' not in despues.disponibles_por_seccion()
+    assert despues.disponibles([1, 2]) == [despues.libro(2)]
+
+
+def test_editar_el_titulo_reconstruye_la_foto():
+    conn = _base()
+    vista = catalogo.obtener(conn)
+    conn.execute("UPDATE libro SET titulo = 'Rayuela (ed. crítica)' WHERE id = 1")
+    despues = catalogo.obtener(conn)
+    assert despues.foto is not vista.foto
+    assert despues.libro(1).titulo == 'Rayuela (ed. crítica)'
+    assert despues.libro(1).stock == 1
+
+
+def test_libro_borrado_o_inexistente():
+    conn = _base()
+    catalogo.obtener(conn)
+    conn.execute('DELETE FROM libro WHERE id = 2')
+    vista = catalogo.obtener(conn)
+    assert vista.libro(2) is None and vista.libro(99) is None
+    assert vista.secciones == ('Novela',)
@@ -0,0 +1,121 @@
+"""Préstamos y devoluciones simultáneos sobre un mismo libro: el stock queda exacto.
+
+Cada hilo usa su propia conexión del pool (mismos pragmas y ``busy_timeout``
+que la aplicación) y todos arrancan a la vez detrás de una barrera. La base
+de prueba tiene un trigger que aborta cualquier UPDATE que deje el stock
+negativo, así una reserva mal serializada aparece como error y no depende
+de muestrear en el momento justo. Las cifras de rendimiento están en
+``benchmark/concurrencia.py``.
+"""
+import sqlite3
+import threading
+
+import pytest
+
+import circulacion
+import db
+import migraciones
+
+HILOS = 100
+STOCK = 20
+HOY = '2026-03-02'
+
+
+@pytest.fixture
+def base(tmp_path):
+    ruta = str(tmp_path / 'concurrencia.db')
+    conn = sqlite3.connect(ruta, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    migraciones.migrar(conn)
+    migraciones.ejecutar_script(conn, """
+        CREATE TRIGGER prueba_stock_no_negativo BEFORE UPDATE OF stock ON libro
+        WHEN NEW.stock < 0 BEGIN
+            SELECT RAISE(ABORT, 'stock negativo');
+        END;
+    """)
+    libro_id = conn.execute("INSERT INTO libro (titulo, autor, editorial, stock, seccion, codigo_libro) "
+                            "VALUES ('Libro disputado', 'Autor', 'Editorial', ?, 'Prueba', 'PRU-001')",
+                            (STOCK,)).lastrowid
+    conn.close()
+    pool = db.ConnectionPool(ruta, size=HILOS, timeout=60)
+    yield pool, libro_id
+    pool.close_all()
+
+
+def _en_paralelo(pool, operacion):
+    """``operacion(conn, i)`` en ``HILOS`` hilos liberados a la vez. Devuelve (resultados, errores)."""
+    barrera = threading.Barrier(HILOS)
+    resultados = [None] * HILOS
+    errores = []
+
+    def trabajador(i):
+        conn = pool.acquire()
+        try:
+            barrera.wait()
+            resultados[i] = operacion(conn, i)
+        except Exception as e:
+            errores.append(f'{type(e).__name__}: {e}')
+        finally:
+            pool.release(conn)
+
+    hilos = [threading.Thread(target=trabajador, args=(i,)) for i in range(HILOS)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return resultados, errores
+
+
+def _leer(pool, sql, *params):
+    conn = pool.acquire()
+    try:
+        return conn.execute(sql, params).fetchone()[0]
+    finally:
+        pool.release(conn)
+
+
+def _prestar_todos(pool, libro_id):
+    return _en_paralelo(pool, lambda conn, i: circulacion.prestar_libro(
+        conn, libro_id, f'Estudiante {i}', '10', 'A', 7, f'e{i}@ensdbexcelencia.edu.co', HOY))
+
+
+def test_prestamos_simultaneos_no_sobrepasan_el_stock(base):
+    pool, libro_id = base
+    prestamos, errores = _prestar_todos(pool, libro_id)
+    assert errores == []
+    concedidos = [p for p in prestamos if p is not None]
+    assert len(concedidos) == len(set(concedidos)) == STOCK
+    assert _leer(pool, 'SELECT stock FROM libro WHERE id = ?', libro_id) == 0
+    assert _leer(pool, 'SELECT COUNT(*) FROM prestamo WHERE libro_id = ? AND devuelto = 0', libro_id) == STOCK
+
+
+def test_devoluciones_simultaneas_del_mismo_prestamo_reponen_una_vez(base):
+    pool, libro_id = base
+    prestamos, _ = _prestar_todos(pool, libro_id)
+    prestamo_id = next(p for p in prestamos if p is not None)
+    devoluciones, errores = _en_paralelo(pool, lambda conn, i: circulacion.devolver_prestamo(conn, prestamo_id, HOY))
+    assert errores == []
+    assert sum(d is not None for d in devoluciones) == 1
+    assert _leer(pool, 'SELECT stock FROM libro WHERE id = ?', libro_id) == 1
+
+
+def test_prestamos_y_devoluciones_mezclados(base):
+    pool, libro_id = base
+    prestamos, _ = _prestar_todos(pool, libro_id)
+    activos = [p for p in prestamos if p is not None]
+
+    # la mitad de los hilos devuelve préstamos distintos, la otra mitad intenta prestar
+    def operacion(conn, i):
+        if i < len(activos):
+            return circulacion.devolver_prestamo(conn, activos[i], HOY)
+        return circulacion.prestar_libro(conn, libro_id, f'Otro {i}', '11', 'B', 7,
+                                         f'o{i}@ensdbexcelencia.edu.co', HOY)
+    resultados, errores = _en_paralelo(pool, operacion)
+    assert errores == []
+    devueltos = sum(r is not None for r in resultados[:len(activos)])
+    nuevos = sum(r is not None for r in resultados[len(activos):])
+    assert devueltos == STOCK
+    stock = _leer(pool, 'SELECT stock FROM libro WHERE id = ?', libro_id)
+    activos_ahora = _leer(pool, 'SELECT COUNT(*) FROM prestamo WHERE libro_id = ? AND devuelto = 0', libro_id)
+    assert stock == STOCK - nuevos >= 0
+    assert activos_ahora == nuevos
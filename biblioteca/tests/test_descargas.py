@@ -0,0 +1,143 @@
+"""Descargas de /uploads: rangos, caché inmutable y delegación al proxy.
+
+``ProxyStub`` imita lo que hacen nginx (``X-Accel-Redirect`` hacia una
+location ``internal``) y Apache/lighttpd (``X-Sendfile``): recibe la
+respuesta vacía del worker y sirve el archivo por su cuenta, con rangos.
+"""
+import os
+
+import pytest
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import Client
+from werkzeug.utils import send_file
+from werkzeug.wrappers import Response
+
+import app as biblioteca
+
+CONTENIDO = bytes(range(256)) * 40  # 10 240 bytes, cada posición distinguible
+NOMBRE = 'a' * 64 + '.pdf'
+UN_ANIO = 365 * 24 * 3600
+
+
+class ProxyStub:
+    """WSGI delante de la app que resuelve ``X-Accel-Redirect`` y ``X-Sendfile``.
+
+    ``cuerpos_worker`` guarda lo que la app devolvió como cuerpo en cada
+    petición: con la delegación activa debe estar vacío.
+    """
+
+    def __init__(self, aplicacion, internas):
+        self.aplicacion = aplicacion
+        self.internas = internas  # prefijo interno -> carpeta (como "location /_uploads/ { internal; alias ...; }")
+        self.cuerpos_worker = []
+
+    def __call__(self, environ, start_response):
+        upstream = Response.from_app(self.aplicacion, environ)
+        self.cuerpos_worker.append(upstream.get_data())
+        ruta = None
+        redireccion = upstream.headers.get('X-Accel-Redirect')
+        if redireccion:
+            for prefijo, carpeta in self.internas.items():
+                if redireccion.startswith(prefijo):
+                    ruta = os.path.join(carpeta, redireccion[len(prefijo):])
+        elif upstream.headers.get('X-Sendfile'):
+            ruta = upstream.headers['X-Sendfile']
+        if ruta is None:
+            return upstream(environ, start_response)
+        try:
+            servida = send_file(ruta, environ, mimetype=upstream.mimetype, conditional=True)
+        except HTTPException as e:  # 416: el proxy responde por su cuenta
+            return e(environ, start_response)
+        # como nginx, conserva las cabeceras de caché de la respuesta original
+        for cabecera in ('Cache-Control', 'Accept-Ranges'):
+            if cabecera in upstream.headers:
+                servida.headers[cabecera] = upstream.headers[cabecera]
+        return servida(environ, start_response)
+
+
+@pytest.fixture
+def carpeta(tmp_path, monkeypatch):
+    (tmp_path / NOMBRE).write_bytes(CONTENIDO)
+    monkeypatch.setitem(biblioteca.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setitem(biblioteca.app.config, 'UPLOADS_OFFLOAD', None)
+    return tmp_path
+
+
+def _cliente(carpeta, offload):
+    biblioteca.app.config['UPLOADS_OFFLOAD'] = offload
+    if offload is None:
+        return biblioteca.app.test_client(), None
+    proxy = ProxyStub(biblioteca.app.wsgi_app,
+                      {biblioteca.app.config['UPLOADS_ACCEL_PREFIX']: str(carpeta)})
+    return Client(proxy), proxy
+
+
+@pytest.mark.parametrize('offload', [None, 'x-accel-redirect', 'x-sendfile'])
+@pytest.mark.parametrize('rango, inicio, fin', [
+    ('bytes=0-99', 0, 99),
+    ('bytes=-100', len(CONTENIDO) - 100, len(CONTENIDO) - 1),
+    ('bytes=10000-', 10000, len(CONTENIDO) - 1),
+])
+def test_rango_parcial(carpeta, offload, rango, inicio, fin):
+    cliente, _ = _cliente(carpeta, offload)
+    r = cliente.get(f'/uploads/{NOMBRE}', headers={'Range': rango})
+    assert r.status_code == 206
+    assert r.headers['Content-Range'] == f'bytes {inicio}-{fin}/{len(CONTENIDO)}'
+    assert r.get_data() == CONTENIDO[inicio:fin + 1]
+    assert int(r.headers['Content-Length']) == fin - inicio + 1
+
+
+@pytest.mark.parametrize('offload', [None, 'x-accel-redirect', 'x-sendfile'])
+def test_rango_insatisfacible(carpeta, offload):
+    cliente, _ = _cliente(carpeta, offload)
+    r = cliente.get(f'/uploads/{NOMBRE}', headers={'Range': f'bytes={len(CONTENIDO) + 10}-'})
+    assert r.status_code == 416
+    assert r.headers['Content-Range'] == f'bytes */{len(CONTENIDO)}'
+
+
+@pytest.mark.parametrize('offload', [None, 'x-accel-redirect', 'x-sendfile'])
+def test_cabeceras_de_cache(carpeta, offload):
+    cliente, _ = _cliente(carpeta, offload)
+    r = cliente.get(f'/uploads/{NOMBRE}')
+    assert r.status_code == 200
+    assert r.get_data() == CONTENIDO
+    assert r.headers['Accept-Ranges'] == 'bytes'
+    cache = r.headers['Cache-Control']
+    assert 'public' in cache and 'immutable' in cache and f'max-age={UN_ANIO}' in cache
+
+
+def test_sin_offload_el_worker_sirve_el_archivo(carpeta):
+    r = biblioteca.app.test_client().get(f'/uploads/{NOMBRE}')
+    assert 'X-Accel-Redirect' not in r.headers and 'X-Sendfile' not in r.headers
+    assert r.get_data() == CONTENIDO
+
+
+def test_x_accel_redirect_libera_al_worker(carpeta):
+    biblioteca.app.config['UPLOADS_OFFLOAD'] = 'x-accel-redirect'
+    r = biblioteca.app.test_client().get(f'/uploads/{NOMBRE}', headers={'Range': 'bytes=0-99'})
+    assert r.status_code == 200
+    assert r.headers['X-Accel-Redirect'] == biblioteca.app.config['UPLOADS_ACCEL_PREFIX'] + NOMBRE
+    assert r.get_data() == b''
+    assert r.headers['Content-Type'] == 'application/pdf'
+
+
+def test_x_sendfile_libera_al_worker(carpeta):
+    biblioteca.app.config['UPLOADS_OFFLOAD'] = 'x-sendfile'
+    r = biblioteca.app.test_client().get(f'/uploads/{NOMBRE}')
+    assert r.headers['X-Sendfile'] == str(carpeta / NOMBRE)
+    assert r.get_data() == b''
+
+
+@pytest.mark.parametrize('offload', ['x-accel-redirect', 'x-sendfile'])
+def test_el_proxy_transfiere_y_el_worker_no(carpeta, offload):
+    cliente, proxy = _cliente(carpeta, offload)
+    r = cliente.get(f'/uploads/{NOMBRE}', headers={'Range': 'bytes=0-99'})
+    assert r.status_code == 206 and r.get_data() == CONTENIDO[:100]
+    assert proxy.cuerpos_worker == [b'']
+
+
+@pytest.mark.parametrize('offload', [None, 'x-accel-redirect', 'x-sendfile'])
+def test_inexistente_o_fuera_de_la_carpeta(carpeta, offload):
+    cliente, _ = _cliente(carpeta, offload)
+    assert cliente.get('/uploads/no-existe.pdf').status_code == 404
+    assert cliente.get('/uploads/..%2Fsecreto.pdf').status_code == 404
@@ -0,0 +1,47 @@
+import pytest
+
+import app as biblioteca
+import db
+import subidas
+
+
+@pytest.fixture
+def cliente(aplicacion, cliente_admin):
+    with aplicacion.app_context():
+        conn = db.get_connection()
+        conn.execute("INSERT INTO biblioteca_virtual (titulo, descripcion, filename, fecha_subida) "
+                     "VALUES ('Guía', 'original', 'guia.pdf', '2026-01-01 00:00:00')")
+        conn.commit()
+    return cliente_admin
+
+
+def _documento():
+    with biblioteca.app.app_context():
+        return dict(db.get_connection().execute('SELECT titulo, descripcion, filename FROM biblioteca_virtual').fetchone())
+
+
+def _subida_incompleta():
+    with biblioteca.app.app_context():
+        conn = db.get_connection()
+        estado = subidas.iniciar(conn, biblioteca.app.config['UPLOAD_FOLDER'], 'nueva.pdf', 10, {'pdf'}, None)
+        conn.commit()
+        return estado['id']
+
+
+@pytest.mark.parametrize('subida_id', [None, 'inexistente'])
+def test_editar_con_subida_fallida_no_guarda(cliente, subida_id):
+    subida_id = subida_id or _subida_incompleta()
+    r = cliente.post('/admin/biblioteca_virtual/edit/1',
+                     data={'titulo': 'Guía nueva', 'descripcion': 'cambiada', 'subida_id': subida_id})
+    assert r.status_code == 302 and r.headers['Location'].endswith('/admin/biblioteca_virtual/edit/1')
+    assert _documento() == {'titulo': 'Guía', 'descripcion': 'original', 'filename': 'guia.pdf'}
+    with cliente.session_transaction() as sesion:
+        mensajes = [m for _, m in sesion.get('_flashes', [])]
+    assert any(m.startswith('No se pudo completar la subida') for m in mensajes)
+    assert 'Documento actualizado.' not in mensajes
+
+
+def test_editar_sin_archivo_conserva_el_actual(cliente):
+    r = cliente.post('/admin/biblioteca_virtual/edit/1', data={'titulo': 'Guía nueva', 'descripcion': 'cambiada'})
+    assert r.status_code == 302 and r.headers['Location'].endswith('/admin/biblioteca_virtual')
+    assert _documento() == {'titulo': 'Guía nueva', 'descripcion': 'cambiada', 'filename': 'guia.pdf'}
@@ -0,0 +1,58 @@
+"""Las páginas ``?todo=1`` se transmiten leyendo un cursor después del teardown.
+
+Ese cursor no puede ser de la conexión del pool: al terminar la vista la
+conexión vuelve al pool y otra petición (otro hilo de gthread) la toma
+mientras el envío sigue leyendo.
+"""
+import pytest
+
+import db
+
+LIBROS = 300
+
+
+@pytest.fixture
+def catalogo(aplicacion):
+    with aplicacion.app_context():
+        conn = db.get_connection()
+        conn.executemany("INSERT INTO libro (titulo, autor, editorial, stock, seccion, codigo_libro) "
+                         "VALUES (?, 'Autor', 'Editorial', 1, 'Sección', ?)",
+                         [(f'Libro {i:04d}', f'SEC-{i:04d}') for i in range(LIBROS)])
+        conn.executemany("INSERT INTO prestamo (nombre, grado, curso, libro_id, dias, correo, fecha_prestamo) "
+                         "VALUES ('Estudiante', '10', 'A', ?, 7, 'e@ensdbexcelencia.edu.co', '2026-01-01')",
+                         [(i + 1,) for i in range(LIBROS)])
+        conn.commit()
+
+
+@pytest.fixture
+def propias(monkeypatch):
+    abiertas = []
+    original = db.conexion_propia
+
+    def registrar(app=None):
+        conn = original(app)
+        abiertas.append(conn)
+        return conn
+    monkeypatch.setattr(db, 'conexion_propia', registrar)
+    return abiertas
+
+
+@pytest.mark.parametrize('ruta, marca', [('/admin_libros?todo=1', 'SEC-'), ('/admin_historial?todo=1', 'Libro ')])
+def test_todo_se_transmite_con_conexion_propia(aplicacion, cliente_admin, catalogo, propias, ruta, marca):
+    r = cliente_admin.get(ruta, buffered=False)
+    partes = iter(r.response)
+    cuerpo = next(partes)
+    assert len(propias) == 1
+
+    # mientras el envío sigue abierto, el pool entrega su conexión a otra petición que escribe
+    with aplicacion.app_context():
+        conn = db.get_connection()
+        assert conn is not propias[0]
+        conn.execute("UPDATE libro SET stock = 0 WHERE id = 1")
+        conn.commit()
+
+    cuerpo += b''.join(partes)
+    r.close()
+    assert cuerpo.decode().count(marca) >= LIBROS
+    with pytest.raises(Exception):
+        propias[0].execute('SELECT 1')  # cerrada por call_on_close
@@ -0,0 +1,56 @@
+import sqlite3
+
+import autocompletar
+import migraciones
+import versiones
+
+
+def _base():
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    migraciones.migrar(conn)
+    conn.execute("INSERT INTO libro (titulo, autor, editorial, stock, seccion, codigo_libro) "
+                 "VALUES ('Cien años de soledad', 'García Márquez', 'Sudamericana', 3, 'Novela', 'NOV-001')")
+    return conn
+
+
+def test_el_stock_no_cambia_la_version_de_textos():
+    conn = _base()
+    antes = versiones.leer_versiones(conn, ('libro', 'libro_textos'))
+    conn.execute('UPDATE libro SET stock = stock - 1')
+    despues = versiones.leer_versiones(conn, ('libro', 'libro_textos'))
+    assert despues['libro'] == antes['libro'] + 1
+    assert despues['libro_textos'] == antes['libro_textos']
+    conn.execute("UPDATE libro SET titulo = 'El coronel no tiene quien le escriba'")
+    assert versiones.leer_versiones(conn, ('libro_textos',))['libro_textos'] == antes['libro_textos'] + 1
+
+
+def test_autocompletar_no_se_reconstruye_por_un_prestamo():
+    conn = _base()
+    autocompletar._indices.clear()
+    indice = autocompletar.obtener_indice(conn, 'libros')
+    conn.execute('UPDATE libro SET stock = 0')
+    assert autocompletar.obtener_indice(conn, 'libros') is indice
+    conn.execute("UPDATE libro SET autor = 'Gabriel García Márquez'")
+    nuevo = autocompletar.obtener_indice(conn, 'libros')
+    assert nuevo is not indice
+    assert nuevo.buscar('gabriel')[0]['valor'] == 'Gabriel García Márquez'
+
+
+def _esquema(conn):
+    return sorted((tipo, nombre, ' '.join((sql or '').split())) for tipo, nombre, sql in
+                  conn.execute('SELECT type, name, sql FROM sqlite_master'))
+
+
+def test_una_base_migrada_por_partes_llega_al_mismo_esquema(monkeypatch):
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    todas = migraciones.MIGRACIONES
+    monkeypatch.setattr(migraciones, 'MIGRACIONES', todas[:12])
+    migraciones.migrar(conn)
+    assert sorted(versiones.leer_versiones(conn, ('libro_textos', 'libro_catalogo'))) == ['libro_textos']
+    monkeypatch.setattr(migraciones, 'MIGRACIONES', todas)
+    assert migraciones.migrar(conn) == ['m013_version_catalogo']
+
+    nueva = sqlite3.connect(':memory:', isolation_level=None)
+    migraciones.migrar(nueva)
+    assert _esquema(conn) == _esquema(nueva)
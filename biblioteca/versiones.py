@@ -0,0 +1,77 @@
+"""Versiones de datos por tabla y ETags para las páginas de solo lectura.
+
+``version_datos`` guarda un contador por tabla que los triggers (creados en
+``migraciones.m007_version_datos``) incrementan en cada INSERT, UPDATE o
+DELETE, así ninguna ruta de escritura puede
+olvidarse de invalidar. Las vistas decoradas con ``etag_por_version``
+calculan su ETag a partir de esos contadores, la ruta, los parámetros y el
+usuario, y responden 304 sin ejecutar la vista cuando el navegador ya tiene
+esa versión.
+
+Hay además contadores más finos sobre ``libro`` que solo cambian con
+INSERT, DELETE o un UPDATE de ciertas columnas, para los índices en memoria
+que no dependen del stock (un préstamo no los invalida): ``libro_textos``
+(título, autor y código; m012) y ``libro_catalogo`` (además editorial,
+sección y portada; m013).
+"""
+import hashlib
+from functools import wraps
+
+from flask import make_response, request, session
+
+import db
+
+TABLAS_VERSIONADAS = ('libro', 'prestamo', 'reseña', 'biblioteca_virtual')
+
+
+def leer_versiones(conn, tablas=TABLAS_VERSIONADAS):
+    """Devuelve ``{tabla: version}`` para las tablas pedidas."""
+    marcas = ', '.join('?' * len(tablas))
+    return dict(conn.execute(
+        f'SELECT tabla, version FROM version_datos WHERE tabla IN ({marcas})', tuple(tablas)).fetchall())
+
+
+def version_global(conn):
+    """Un solo número que cambia con cualquier escritura en las tablas versionadas."""
+    return conn.execute('SELECT SUM(version) FROM version_datos').fetchone()[0] or 0
+
+
+def calcular_etag(tablas):
+    versiones = leer_versiones(db.get_connection(), tablas)
+    partes = [
+        request.endpoint or '',
+        request.path,
+        '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True))),
+        # las páginas muestran el correo del usuario: la misma URL difiere entre usuarios
+        session.get('correo') or '',
+        'admin' if session.get('admin') else '',
+        ','.join(f'{t}:{versiones.get(t, 0)}' for t in tablas),
+    ]
+    return hashlib.sha1('|'.join(partes).encode('utf-8')).hexdigest()
+
+
+def etag_por_version(*tablas):
+    """Decorador: ETag derivado de las versiones de ``tablas`` y 304 si no cambió.
+
+    Si hay mensajes flash pendientes la vista se ejecuta siempre (debe
+    mostrarlos y consumirlos).
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            if session.get('_flashes'):
+                return vista(*args, **kwargs)
+            etag = calcular_etag(tablas)
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+            else:
+                response = make_response(vista(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # el navegador guarda la página pero revalida siempre con If-None-Match
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+        return envoltura
+    return decorador
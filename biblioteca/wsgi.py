@@ -0,0 +1,12 @@
+"""Punto de entrada WSGI para un servidor pre-fork.
+
+    cd biblioteca && flask --app app construir-estaticos
+    cd biblioteca && gunicorn -c gunicorn.conf.py wsgi:application
+
+La configuración llega por variables de entorno BIBLIOTECA_* (ver app.py).
+Las migraciones corren una vez en el proceso maestro y cada worker se
+calienta después del fork (ver gunicorn.conf.py).
+"""
+from app import create_app
+
+application = create_app()